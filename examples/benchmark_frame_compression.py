@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+"""Compares the memory and sampling speed of raw and encoded frame storage.
+
+Fills a MemoryEfficientReplayBuffer with synthetic episodes of smooth images
+(three RGB cameras concatenated along the channels, as in the kitchen
+datasets) and reports the bytes of the pixel column and the samples per
+second of MemoryEfficientReplayBuffer.sample for each codec.
+"""
+import time
+
+import gym
+import numpy as np
+from absl import app, flags
+
+from jaxrl2.data import MemoryEfficientReplayBuffer
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list("codecs", ["raw", "zlib", "png", "jpeg"], "Storage formats to compare.")
+flags.DEFINE_integer("capacity", 5000, "Replay buffer capacity.")
+flags.DEFINE_integer("image_size", 128, "Image size.")
+flags.DEFINE_integer("num_channels", 9, "Channels of a frame.")
+flags.DEFINE_integer("num_stack", 3, "Stack frames.")
+flags.DEFINE_integer("ep_length", 50, "Episode length.")
+flags.DEFINE_integer("batch_size", 256, "Mini batch size.")
+flags.DEFINE_integer("num_batches", 20, "Number of timed batches.")
+flags.DEFINE_integer("frame_cache_size", 4096, "Decoded frames kept in the cache.")
+flags.DEFINE_integer("num_decode_threads", 4, "Decoder threads.")
+flags.DEFINE_integer("seed", 42, "Random seed.")
+
+
+def _episode(rng: np.random.RandomState) -> dict:
+    # Moving gradients plus sensor noise, which compress like camera images
+    # rather than like uniform noise.
+    size, length = FLAGS.image_size, FLAGS.ep_length + FLAGS.num_stack
+    y, x = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    phases = rng.uniform(0, 2 * np.pi, size=FLAGS.num_channels)
+    t = np.arange(length)[:, None, None, None]
+    frames = 127.5 + 100 * np.sin((x + y)[..., None] / 16.0 + phases + t / 10.0)
+    frames += rng.normal(0, 2, size=frames.shape)
+    frames = np.clip(frames, 0, 255).astype(np.uint8)
+
+    stacks = np.lib.stride_tricks.sliding_window_view(frames, FLAGS.num_stack, axis=0)
+    ep_length = FLAGS.ep_length
+    states = np.zeros((ep_length, 1), dtype=np.float32)
+    return dict(
+        observations=dict(pixels=stacks[:ep_length], states=states),
+        next_observations=dict(pixels=stacks[1 : ep_length + 1], states=states),
+        actions=np.zeros((ep_length, 2), dtype=np.float32),
+        rewards=np.zeros((ep_length,), dtype=np.float32),
+        masks=np.ones((ep_length,), dtype=np.float32),
+        dones=np.arange(ep_length) == ep_length - 1,
+    )
+
+
+def main(_):
+    shape = (FLAGS.image_size, FLAGS.image_size, FLAGS.num_channels, FLAGS.num_stack)
+    observation_space = gym.spaces.Dict(
+        dict(
+            pixels=gym.spaces.Box(low=0, high=255, shape=shape, dtype=np.uint8),
+            states=gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32),
+        )
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+
+    for codec in FLAGS.codecs:
+        replay_buffer = MemoryEfficientReplayBuffer(
+            observation_space,
+            action_space,
+            FLAGS.capacity,
+            frame_codec=None if codec == "raw" else codec,
+            frame_cache_size=FLAGS.frame_cache_size,
+            num_decode_threads=FLAGS.num_decode_threads,
+        )
+        replay_buffer.seed(FLAGS.seed)
+
+        rng = np.random.RandomState(FLAGS.seed)
+        insert_time = 0.0
+        while len(replay_buffer) < FLAGS.capacity:
+            episode = _episode(rng)
+            start = time.time()
+            replay_buffer.insert_episode(episode)
+            insert_time += time.time() - start
+
+        replay_buffer.sample(FLAGS.batch_size, include_pixels=False)
+        start = time.time()
+        for _ in range(FLAGS.num_batches):
+            replay_buffer.sample(FLAGS.batch_size, include_pixels=False)
+        sample_time = time.time() - start
+
+        num_bytes = replay_buffer.dataset_dict["observations"]["pixels"].nbytes
+        print(
+            f"{codec:>5}: {num_bytes / 2 ** 20:10.1f} MiB, "
+            f"{len(replay_buffer) / insert_time:10.0f} inserts/s, "
+            f"{FLAGS.num_batches * FLAGS.batch_size / sample_time:10.0f} samples/s"
+        )
+
+
+if __name__ == "__main__":
+    app.run(main)
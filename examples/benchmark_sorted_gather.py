@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+"""Compares sampling with the rows gathered in random and in slot order.
+
+Fills a ReplayBuffer and a MemoryEfficientReplayBuffer with synthetic
+episodes and reports the samples per second of sample() with the drawn
+rows gathered as drawn, gathered sorted (sort_indices=True), and gathered
+sorted and put back in the drawn order (sort_indices=True with indx). With
+storage_dir, the columns are memory-mapped files, and with cold_cache their
+pages are evicted from the page cache before every run, so that the rows
+are read from disk.
+"""
+import mmap
+import os
+import tempfile
+import time
+
+import gym
+import numpy as np
+from absl import app, flags
+
+from jaxrl2.data import MemoryEfficientReplayBuffer, ReplayBuffer
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list("buffers", ["replay", "memory_efficient"], "Replay buffers to compare.")
+flags.DEFINE_integer("capacity", 1_000_000, "Replay buffer capacity.")
+flags.DEFINE_integer("image_size", 8, "Image size.")
+flags.DEFINE_integer("num_channels", 3, "Channels of a frame.")
+flags.DEFINE_integer("num_stack", 3, "Stack frames.")
+flags.DEFINE_integer("ep_length", 1000, "Episode length.")
+flags.DEFINE_integer("batch_size", 256, "Mini batch size.")
+flags.DEFINE_integer("num_batches", 200, "Number of timed batches.")
+flags.DEFINE_string("storage_dir", None, "Directory of memory-mapped columns.")
+flags.DEFINE_boolean("cold_cache", True, "Evict memory-mapped columns before every run.")
+flags.DEFINE_integer("seed", 42, "Random seed.")
+
+
+def _episode(rng: np.random.RandomState) -> dict:
+    size, length = FLAGS.image_size, FLAGS.ep_length + FLAGS.num_stack
+    frames = rng.randint(0, 256, size=(length, size, size, FLAGS.num_channels), dtype=np.uint8)
+    stacks = np.lib.stride_tricks.sliding_window_view(frames, FLAGS.num_stack, axis=0)
+    ep_length = FLAGS.ep_length
+    states = np.zeros((ep_length, 1), dtype=np.float32)
+    return dict(
+        observations=dict(pixels=stacks[:ep_length], states=states),
+        next_observations=dict(pixels=stacks[1 : ep_length + 1], states=states),
+        actions=np.zeros((ep_length, 2), dtype=np.float32),
+        rewards=np.zeros((ep_length,), dtype=np.float32),
+        masks=np.ones((ep_length,), dtype=np.float32),
+        dones=np.arange(ep_length) == ep_length - 1,
+    )
+
+
+def _drop_page_cache(dataset_dict):
+    # Unmaps the pages of the memory-mapped columns from this process and
+    # evicts them from the page cache.
+    for v in dataset_dict.values():
+        if isinstance(v, dict):
+            _drop_page_cache(v)
+        elif isinstance(v, np.memmap):
+            v.flush()
+            v._mmap.madvise(mmap.MADV_DONTNEED)
+            fd = os.open(v.filename, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+
+def _samples_per_second(replay_buffer, mode: str) -> float:
+    if FLAGS.storage_dir is not None and FLAGS.cold_cache:
+        _drop_page_cache(replay_buffer.dataset_dict)
+    sample_args = {}
+    if isinstance(replay_buffer, MemoryEfficientReplayBuffer):
+        sample_args["include_pixels"] = False
+        rows = replay_buffer._correct_indices.indices
+    else:
+        rows = np.arange(len(replay_buffer))
+    replay_buffer.sample(FLAGS.batch_size, **sample_args)
+    start = time.time()
+    for _ in range(FLAGS.num_batches):
+        if mode == "restored":
+            # Draws as sample() does, with the rows put back in that order.
+            indx = rows[replay_buffer.np_random.randint(len(rows), size=FLAGS.batch_size)]
+            replay_buffer.sample(FLAGS.batch_size, indx=indx, sort_indices=True, **sample_args)
+        else:
+            replay_buffer.sample(
+                FLAGS.batch_size, sort_indices=mode == "sorted", **sample_args
+            )
+    return FLAGS.num_batches * FLAGS.batch_size / (time.time() - start)
+
+
+def main(_):
+    shape = (FLAGS.image_size, FLAGS.image_size, FLAGS.num_channels, FLAGS.num_stack)
+    observation_space = gym.spaces.Dict(
+        dict(
+            pixels=gym.spaces.Box(low=0, high=255, shape=shape, dtype=np.uint8),
+            states=gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32),
+        )
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+
+    for name in FLAGS.buffers:
+        storage_dir = FLAGS.storage_dir
+        if storage_dir is not None:
+            storage_dir = tempfile.mkdtemp(prefix=f"{name}_", dir=storage_dir)
+        if name == "replay":
+            replay_buffer = ReplayBuffer(
+                observation_space, action_space, FLAGS.capacity, storage_dir=storage_dir
+            )
+        else:
+            replay_buffer = MemoryEfficientReplayBuffer(
+                observation_space, action_space, FLAGS.capacity, storage_dir=storage_dir
+            )
+        replay_buffer.seed(FLAGS.seed)
+
+        rng = np.random.RandomState(FLAGS.seed)
+        while len(replay_buffer) < FLAGS.capacity:
+            replay_buffer.insert_episode(_episode(rng))
+
+        num_bytes = replay_buffer.dataset_dict["observations"]["pixels"].nbytes
+        print(f"{name}: {num_bytes / 2 ** 20:.1f} MiB of observation pixels")
+        for mode in ("random", "sorted", "restored"):
+            print(f"{mode:>10}: {_samples_per_second(replay_buffer, mode):10.0f} samples/s")
+
+
+if __name__ == "__main__":
+    app.run(main)
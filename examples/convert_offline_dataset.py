@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+"""Converts offline episodes into a chunked columnar episode store.
+
+The kitchen and adroit scripts and EpisodicTransitionDataset accept the output
+directory in place of the original dataset path, e.g.
+
+    python convert_offline_dataset.py --source=$STANDARD_KITCHEN_DATASETS \
+        --output_dir=/data/kitchen_indistribution --task=indistribution
+"""
+import os
+from glob import glob
+
+import numpy as np
+import tqdm
+from absl import app, flags
+
+from jaxrl2.data.episode_store import EpisodeStoreWriter
+from jaxrl2.data.eps_transition_dataset import calc_return_to_go, episode_to_columns
+from jaxrl2.data.kitchen_data.episode_utils import get_task_list, read_episode_file
+from jaxrl2.data.return_utils import discounted_returns
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('source', None, 'Directory with .npz episodes, or comma-separated out.npy files.')
+flags.DEFINE_string('output_dir', None, 'Directory of the episode store.')
+flags.DEFINE_enum('format', 'npz', ['npz', 'episodic'], 'npz: kitchen/adroit episode files; episodic: out.npy files of EpisodicTransitionDataset.')
+flags.DEFINE_string('task', None, 'Kitchen task (e.g. indistribution) whose rewards are summed; None keeps the stored reward.')
+flags.DEFINE_float('discount', 0.99, 'Discount of the precomputed mc_returns of npz episodes.')
+flags.DEFINE_integer('chunk_size', 4096, 'Number of rows per chunk file.')
+flags.mark_flags_as_required(['source', 'output_dir'])
+
+
+def npz_episodes(source, tasks_list, discount):
+    episode_files = sorted(glob(os.path.join(source, '**', '*.npz'), recursive=True))
+    for episode_file in tqdm.tqdm(episode_files, desc="Converting episodes"):
+        episode = read_episode_file(episode_file, tasks_list)
+        episode["mc_returns"] = discounted_returns(episode["reward"], discount, bootstrap_last=True)
+        masks = np.ones_like(episode["reward"], dtype=np.float32)
+        masks[-1] = 0
+        episode["masks"] = masks
+        yield episode
+
+
+def episodic_episodes(paths):
+    for path in paths:
+        data = np.load(path, allow_pickle=True).tolist()
+        for traj in tqdm.tqdm(data, desc=f"Converting {path}"):
+            # Same as in EpisodicTransitionDataset.
+            rews = np.array(traj["rewards"])
+            traj["mc_returns"] = calc_return_to_go(rews)
+            traj["masks"] = np.ones_like(np.array(traj["terminals"]))
+            yield episode_to_columns(traj)
+
+
+def main(_):
+    if FLAGS.format == 'npz':
+        tasks_list = None if FLAGS.task is None else get_task_list(FLAGS.task)
+        metadata = dict(tasks_list=tasks_list, discount=FLAGS.discount)
+        episodes = npz_episodes(FLAGS.source, tasks_list, FLAGS.discount)
+    else:
+        metadata = dict(sources=FLAGS.source.split(','))
+        episodes = episodic_episodes(FLAGS.source.split(','))
+
+    num_episodes = 0
+    with EpisodeStoreWriter(FLAGS.output_dir, chunk_size=FLAGS.chunk_size, metadata=metadata) as writer:
+        for episode in episodes:
+            writer.add_episode(episode)
+            num_episodes += 1
+    print(f"Wrote {num_episodes} episodes to {FLAGS.output_dir}.")
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -79,6 +79,8 @@ if __name__ == '__main__':
     #environment
     parser.add_argument('--episode_timelimit', default=40, help='prefix to use', type=int)
     parser.add_argument('--save_replay_buffer', action='store_true', help='whether to save the repaly buffer')
+    parser.add_argument('--lean_dataset', action='store_true', help='load the offline episodes into flat columns without keeping the raw episodes')
+    parser.add_argument('--task_stratified_sampling', action='store_true', help='index the replay buffer rows by their one-hot task_id and sample batches stratified by task')
     parser.add_argument('--reward_func_type', type=int, default=0, help='type of reward function')
     parser.add_argument('--rew_func_for_target_only', type=int, default=0, help='type of reward function')
     parser.add_argument('--bridge_clip_traj_length', type=int, default=-1, help='clip traj length')
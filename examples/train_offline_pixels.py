@@ -102,12 +102,16 @@ def main(_):
             sample_args={
                 "batch_size": FLAGS.batch_size,
                 "include_pixels": True,
-                "keys": ["observations", "actions"],
+                "keys": agent.batch_keys,
             }
         )
     else:
         replay_buffer_iterator = replay_buffer.get_iterator(
-            sample_args={"batch_size": FLAGS.batch_size, "include_pixels": False}
+            sample_args={
+                "batch_size": FLAGS.batch_size,
+                "include_pixels": False,
+                "keys": getattr(agent, "batch_keys", None),
+            }
         )
 
     for i in tqdm.tqdm(
@@ -1,8 +1,10 @@
+import functools
 import os
 import pickle
 import numpy as np
 
 import gym
+import jax
 # import d4rl2
 import tensorflow as tf
 import tqdm
@@ -26,6 +28,12 @@ from jaxrl2.wrappers.frame_stack import FrameStack
 import collections
 
 from jaxrl2.data.kitchen_data import MemoryEfficientReplayBuffer
+from jaxrl2.data.return_utils import discounted_returns
+from jaxrl2.data.dataset import MixingReplayBufferParallel
+from jaxrl2.data.device_dataset import DeviceDataset
+from jaxrl2.data.episode_store import EpisodeStore, is_episode_store
+from jaxrl2.data.kitchen_data.episode_utils import episode_to_transitions, load_episode, read_store_episodes
+from jaxrl2.data.parallel_loader import load_episodes
 
 from glob import glob
 
@@ -44,6 +52,14 @@ flags.DEFINE_string('datadir', "microwave", 'Directory with dataset files.')
 flags.DEFINE_integer('ep_length', 200, 'Episode length.')
 flags.DEFINE_integer('action_repeat', 1, 'Random seed.')
 flags.DEFINE_integer('replay_buffer_size', int(1e6), 'Number of transitions the (offline) replay buffer can hold.')
+flags.DEFINE_integer('replay_buffer_initial_size', None, 'Transitions the replay buffer columns are first allocated for; they grow up to replay_buffer_size as needed. All of them by default.')
+flags.DEFINE_string('replay_buffer_dir', None, 'If set, the replay buffer columns are memory-mapped files in this directory.')
+flags.DEFINE_integer('loader_workers', None, 'Processes that decode offline episodes; all cores by default, 0 decodes in the main process.')
+flags.DEFINE_boolean('loader_ordered', True, 'Insert offline episodes in file order rather than as soon as they are decoded.')
+flags.DEFINE_integer('sampling_processes', 0, 'If positive, replay buffer batches are sampled in this many processes.')
+flags.DEFINE_boolean('device_dataset', False, 'Keep the offline dataset on the device and sample batches inside the jitted update.')
+flags.DEFINE_boolean('pack_frames', False, 'Send the unique frames of each batch and rebuild the frame stacks inside the jitted update.')
+flags.DEFINE_string('frame_codec', None, 'Store the replay buffer frames encoded with this codec (png, jpeg or zlib).')
 flags.DEFINE_integer('seed', 42, 'Random seed.')
 flags.DEFINE_integer('eval_episodes', 250,
                      'Number of episodes used for evaluation.')
@@ -138,21 +154,37 @@ def main(_):
     print('Agent created')
 
     print("Loading replay buffer")
-    replay_buffer = MemoryEfficientReplayBuffer(env.observation_space, env.action_space, FLAGS.replay_buffer_size)
+    replay_buffer = MemoryEfficientReplayBuffer(env.observation_space, env.action_space, FLAGS.replay_buffer_size, storage_dir=FLAGS.replay_buffer_dir, frame_codec=FLAGS.frame_codec, initial_capacity=FLAGS.replay_buffer_initial_size)
     replay_buffer.seed(FLAGS.seed)
-    replay_buffer_iterator = replay_buffer.get_iterator(sample_args={"batch_size": FLAGS.batch_size, "include_pixels": False})
-    load_data(replay_buffer, FLAGS.datadir, FLAGS.ep_length, 3, FLAGS.proprio, FLAGS.discount, debug=FLAGS.debug)
+    assert not (FLAGS.pack_frames and FLAGS.sampling_processes), "Packed batches vary in size and cannot be sampled into shared memory."
+    assert not (FLAGS.frame_codec and FLAGS.sampling_processes), "Encoded frames cannot be shared with sampling processes."
+    if isinstance(agent, PixelCQLLearnerEncoderSepParallel):
+        # The pmapped update takes a sub-batch per device.
+        assert not (FLAGS.pack_frames or FLAGS.sampling_processes), "The pmapped update samples in threads, without packed frames."
+        parallel_replay_buffer = MixingReplayBufferParallel([replay_buffer], [1.0])
+        replay_buffer_iterator = parallel_replay_buffer.get_iterator(FLAGS.batch_size, keys=getattr(agent, "batch_keys", None), include_pixels=False)
+    else:
+        replay_buffer_iterator = replay_buffer.get_iterator(sample_args={"batch_size": FLAGS.batch_size, "include_pixels": False, "pack_frames": FLAGS.pack_frames, "keys": getattr(agent, "batch_keys", None)}, num_processes=FLAGS.sampling_processes)
+    load_data(replay_buffer, FLAGS.datadir, FLAGS.ep_length, 3, FLAGS.proprio, FLAGS.discount, debug=FLAGS.debug, num_workers=FLAGS.loader_workers, ordered=FLAGS.loader_ordered)
 
     if FLAGS.take_top is not None or FLAGS.filter_threshold is not None:
-        ds.filter(take_top=FLAGS.take_top, threshold=FLAGS.filter_threshold)
+        replay_buffer.filter(take_top=FLAGS.take_top, threshold=FLAGS.filter_threshold)
 
     print('Replay buffer loaded')
 
+    if FLAGS.device_dataset and isinstance(agent, PixelCQLLearnerEncoderSepParallel):
+        # Every device samples its sub-batch from its own shard.
+        offline_iterator = parallel_replay_buffer.get_sharded_dataset(FLAGS.batch_size, include_pixels=False)
+    elif FLAGS.device_dataset:
+        offline_iterator = DeviceDataset.from_dataset(replay_buffer, FLAGS.batch_size, include_pixels=False)
+    else:
+        offline_iterator = replay_buffer_iterator
+
     print('Start offline training')
     tbar = tqdm.tqdm(range(1, FLAGS.max_gradient_steps + 1), smoothing=0.1, disable=not FLAGS.tqdm)
     for i in tbar:
         tbar.set_description(f"[{FLAGS.algorithm} {FLAGS.seed}] (offline)")
-        batch = next(replay_buffer_iterator)
+        batch = next(offline_iterator)
 
         out = agent.update(batch)
 
@@ -241,11 +273,7 @@ def main(_):
                     wandb.log({f"training/{decode[k]}": v}, step=i + FLAGS.max_gradient_steps)
                 observation, done = env.reset(), False
 
-                reward_to_go = [0]*len(transitions)
-                prev_return = transitions[-1]["rewards"]/(1- FLAGS.discount)
-                for i in range(len(transitions)):
-                    reward_to_go[-i-1] = transitions[-i-1]["rewards"] + FLAGS.discount * prev_return
-                    prev_return = reward_to_go[-i-1]
+                reward_to_go = discounted_returns(np.array([transition["rewards"] for transition in transitions]), FLAGS.discount, bootstrap_last=True)
 
                 for i, transition in enumerate(transitions):
                     transition["mc_returns"] = reward_to_go[i]
@@ -305,79 +333,30 @@ def make_env(task, ep_length, action_repeat, proprio, camera_angle=None):
         raise ValueError(f"Unsupported environment suite: \"{suite}\".")
     return env
 
-def load_episode(episode_file, discount):
-    with open(episode_file, 'rb') as f:
-        episode = np.load(f, allow_pickle=True)
-
-        episode = {k: episode[k] for k in episode.keys() if k not in ['image_128'] and "metadata" not in k and "str" not in episode[k].dtype.name and episode[k].dtype != object}
-
-    reward_to_go = np.zeros_like(episode["reward"])
-    prev_return = episode["reward"][-1]/(1- discount)
-    # prev_return = 0
-    for i in range(episode["reward"].shape[0]):
-        reward_to_go[-i-1] = episode["reward"][-i-1] + discount * prev_return
-        prev_return = reward_to_go[-i-1]
-
-    episode["mc_returns"] = reward_to_go
-
-    return episode
-
-def load_data(replay_buffer, offline_dataset_path, ep_length, num_stack, proprio, discount, debug=False):
-    episode_files = glob(os.path.join(offline_dataset_path, '**', '*.npz'), recursive=True)
+def load_data(replay_buffer, offline_dataset_path, ep_length, num_stack, proprio, discount, debug=False, num_workers=None, ordered=True):
+    if is_episode_store(offline_dataset_path):
+        # Converted with convert_offline_dataset.py; only the needed columns of
+        # the loaded episodes are read.
+        keys = ["image", "action", "reward", "mc_returns"] + (["proprio"] if proprio else [])
+        episodes = read_store_episodes(offline_dataset_path, keys, discount)
+        episodes = tqdm.tqdm(episodes, total=len(EpisodeStore(offline_dataset_path)), desc="Loading offline data")
+    else:
+        episode_files = glob(os.path.join(offline_dataset_path, '**', '*.npz'), recursive=True)
+        load_fn = functools.partial(load_episode, discount=discount)
+        episodes = load_episodes(load_fn, episode_files, num_workers=num_workers, ordered=ordered, desc="Loading offline data")
+    num_episodes = 0
     total_transitions = 0
 
-    for episode_file in tqdm.tqdm(episode_files, total=len(episode_files), desc="Loading offline data"):
-        episode = load_episode(episode_file, discount)
-
-        # observation, done = env.reset(), False
-        frames = collections.deque(maxlen=num_stack)
-        for _ in range(num_stack):
-            frames.append(episode["image"][0])
-
-        observation = dict(pixels=np.stack(frames, axis=-1))
-        if proprio:
-            observation["states"] = episode["proprio"][0]
-        done = False
-
-        i = 1
-        while not done:
-            # action = agent.sample_actions(observation)
-            action = episode["action"][i]
-            mc_returns = episode["mc_returns"][i]
-
-            # next_observation, reward, done, info = env.step(action)
-            frames.append(episode["image"][i])
-            next_observation = dict(pixels=np.stack(frames, axis=-1))
-            if proprio:
-                next_observation["states"] = episode["proprio"][i]
-            reward = episode["reward"][i]
-            done = i >= episode["image"].shape[0] - 1
-            # print(f"i: {i}, done: {done}")
-            info = {}
-
-            if not done or "TimeLimit.truncated" in info:
-                mask = 1.0
-            else:
-                mask = 0.0
-            replay_buffer.insert(
-                dict(
-                    observations=observation,
-                    actions=action,
-                    rewards=reward,
-                    masks=mask,
-                    dones=done,
-                    next_observations=next_observation,
-                    mc_returns=mc_returns,
-                )
-            )
-            observation = next_observation
-            total_transitions += 1
-            i += 1
+    for episode in episodes:
+        transitions = episode_to_transitions(episode, num_stack, proprio)
+        replay_buffer.insert_episode(transitions)
+        num_episodes += 1
+        total_transitions += len(transitions["rewards"])
 
-            if debug and total_transitions > 5000:
-                return
+        if debug and total_transitions > 5000:
+            return
 
-    print(f"Loaded {len(episode_files)} episodes and {total_transitions} total transitions.")
+    print(f"Loaded {num_episodes} episodes and {total_transitions} total transitions.")
     print(f"replay_buffer capacity {replay_buffer._capacity}, replay_buffer size {replay_buffer._size}.")
     assert replay_buffer._capacity >= total_transitions
 
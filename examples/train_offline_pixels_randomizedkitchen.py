@@ -27,6 +27,8 @@ from jaxrl2.wrappers.frame_stack import FrameStack
 import collections
 
 from jaxrl2.data.kitchen_data import MemoryEfficientReplayBuffer
+from jaxrl2.data.return_utils import discounted_returns
+from jaxrl2.data.kitchen_data.episode_utils import concat_cameras, read_episode_file
 
 from glob import glob
 
@@ -154,7 +156,7 @@ def main(_):
     replay_buffer = env.q_learning_dataset(include_pixels=False, size=FLAGS.replay_buffer_size, discount=FLAGS.discount, debug=FLAGS.debug)
 
     if FLAGS.take_top is not None or FLAGS.filter_threshold is not None:
-        ds.filter(take_top=FLAGS.take_top, threshold=FLAGS.filter_threshold)
+        replay_buffer.filter(take_top=FLAGS.take_top, threshold=FLAGS.filter_threshold)
 
 
     print('Replay buffer loaded')
@@ -268,11 +270,7 @@ def main(_):
                     wandb.log({f"training/{decode[k]}": v}, step=i + FLAGS.max_gradient_steps)
                 observation, done = env.reset(), False
 
-                reward_to_go = [0]*len(transitions)
-                prev_return = transitions[-1]["rewards"]/(1- FLAGS.discount)
-                for i in range(len(transitions)):
-                    reward_to_go[-i-1] = transitions[-i-1]["rewards"] + FLAGS.discount * prev_return
-                    prev_return = reward_to_go[-i-1]
+                reward_to_go = discounted_returns(np.array([transition["rewards"] for transition in transitions]), FLAGS.discount, bootstrap_last=True)
 
                 for i, transition in enumerate(transitions):
                     transition["mc_returns"] = reward_to_go[i]
@@ -355,29 +353,14 @@ def make_env(task, ep_length, action_repeat, proprio, im_size=128, camera_ids="0
     return env
 
 def load_episode(episode_file, task, tasks_list):
-    with open(episode_file, 'rb') as f:
-        episode = np.load(f, allow_pickle=True)
-
-        if tasks_list is None:
-            episode = {k: episode[k] for k in episode.keys() if k not in ['image_128'] and "metadata" not in k and "str" not in episode[k].dtype.name and episode[k].dtype != object}
-        else:
-            if "reward" in episode:
-                rewards = episode["reward"]
-            else:
-                rewards = sum([episode[f"reward {obj}"] for obj in tasks_list])
-
-            episode = {k: episode[k] for k in episode.keys() if k not in ['image_128'] and "metadata" not in k and "str" not in episode[k].dtype.name and episode[k].dtype != object and "init_q" not in k and "observation" not in k and "terminal" not in k and "goal" not in k}
-            episode["reward"] = rewards
-
+    episode = read_episode_file(episode_file, tasks_list)
 
     # extra_image_camera_0_rgb
     # extra_image_camera_1_rgb
     # extra_image_camera_gripper_rgb
 
-        if "standardkitchen" in task:
-            keys = ["extra_image_camera_0_rgb", "extra_image_camera_1_rgb", "extra_image_camera_gripper_rgb"]
-            img = np.concatenate([episode[key] for key in keys], axis=-1)
-            episode["image"] = img
+    if "standardkitchen" in task:
+        episode["image"] = concat_cameras(episode, ["camera_0", "camera_1", "camera_gripper"])
 
     return episode
 
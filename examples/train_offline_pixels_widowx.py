@@ -121,7 +121,7 @@ def main(variant):
             raise ValueError(f"Unknown dataset type {config_type}")
         
         filter_success = variant['algorithm'] in ['bc'] or variant.get('filter_success', False)
-        replay_buffer = EpisodicTransitionDataset(dataset_paths, filter_success=filter_success)
+        replay_buffer = EpisodicTransitionDataset(dataset_paths, filter_success=filter_success, lean=variant.get('lean_dataset', False))
 
         offline_training_loop(
             variant,
@@ -15,17 +15,79 @@ from jaxrl2.utils.visualization_utils import visualize_image_actions
 from jaxrl2.wrappers.reaching_reward_wrapper import compute_distance_reward
 from jaxrl2.utils.visualization_utils import visualize_states_rewards, visualize_image_rewards
 from jaxrl2.data.dataset import MixingReplayBuffer, PropertyReplayBuffer
+from jaxrl2.data.prioritized_replay_buffer import PrioritizedReplayBuffer
 from jaxrl2.utils.visualization_utils import sigmoid
 
+def _replay_buffers(replay_buffer):
+    # The replay buffers batches are drawn from, inside mixing and property buffers.
+    if hasattr(replay_buffer, 'replay_buffers'):
+        return [b for buf in replay_buffer.replay_buffers for b in _replay_buffers(buf)]
+    if hasattr(replay_buffer, 'replay_buffer'):
+        return _replay_buffers(replay_buffer.replay_buffer)
+    return [replay_buffer]
+
+def enable_task_sampling(replay_buffer):
+    """Stratifies the batches of replay_buffer by the one-hot task_id of the observations.
+
+    Returns the replay buffers that are indexed by task, for log_task_counts.
+    """
+    buffers = _replay_buffers(replay_buffer)
+    for buf in buffers:
+        if not hasattr(buf, 'set_task_sampling'):
+            raise ValueError(f'{type(buf).__name__} cannot be sampled by task, only replay buffers can.')
+        buf.set_task_sampling(task_key='task_id')
+    return buffers
+
+def log_task_counts(task_buffers, wandb_logger, step):
+    for j, buf in enumerate(task_buffers):
+        for label, count in enumerate(buf.task_counts()):
+            wandb_logger.log({f'task_counts/buffer{j}_task{label}': count}, step=step)
+
+def _replace_replay_buffer(replay_buffer, old, new):
+    # replay_buffer with old, inside mixing and property buffers, replaced by new.
+    if replay_buffer is old:
+        return new
+    if hasattr(replay_buffer, 'replay_buffers'):
+        replay_buffer.set_replay_buffers(
+            [_replace_replay_buffer(b, old, new) for b in replay_buffer.replay_buffers])
+    elif hasattr(replay_buffer, 'replay_buffer'):
+        replay_buffer.replay_buffer = _replace_replay_buffer(replay_buffer.replay_buffer, old, new)
+    return replay_buffer
+
+def enable_prioritized_replay(variant, online_replay_buffer, replay_buffer):
+    """Samples the rows of online_replay_buffer by the TD errors of the critic.
+
+    The online buffer is wrapped by a PrioritizedReplayBuffer where replay_buffer
+    samples it, so the offline rows keep their share of the batches, with
+    importance weights of 1. Returns the PrioritizedReplayBuffer, whose
+    update_priorities() takes the td_errors of the updates, and replay_buffer.
+    """
+    if variant.get('task_stratified_sampling', False):
+        raise ValueError('Prioritized replay cannot be combined with task stratified sampling.')
+    online_buffers = _replay_buffers(online_replay_buffer)
+    if len(online_buffers) != 1:
+        raise ValueError('Only a single online replay buffer can be prioritized, not one split into positives and negatives.')
+    if not any(b is online_buffers[0] for b in _replay_buffers(replay_buffer)):
+        raise ValueError('The online replay buffer is not sampled by the training loop.')
+    prioritized_buffer = PrioritizedReplayBuffer(online_buffers[0])
+    return prioritized_buffer, _replace_replay_buffer(replay_buffer, online_buffers[0], prioritized_buffer)
+
 def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_buffer=None, wandb_logger=None, perform_control_evals=True, task_id_mapping=None):
     if eval_replay_buffer is None:
         eval_replay_buffer = replay_buffer
-    replay_buffer_iterator = replay_buffer.get_iterator(variant.batch_size)
+    task_buffers = []
+    if variant.get('task_stratified_sampling', False):
+        task_buffers = enable_task_sampling(replay_buffer)
+    replay_buffer_iterator = replay_buffer.get_iterator(variant.batch_size, keys=getattr(agent, "batch_keys", None))
     if eval_replay_buffer is not None:
         eval_replay_buffer_iterator = eval_replay_buffer.get_iterator(variant.batch_size)
+    # The mixing ratio of a MixingReplayBuffer follows its schedule, if any.
+    has_mixing_schedule = getattr(replay_buffer, 'mixing_schedule', None) is not None
     for i in tqdm(range(1, variant.online_start + 1),
                   smoothing=0.1,
                   ):
+        if has_mixing_schedule:
+            replay_buffer.set_step(i)
         t0 = time.time()
         batch = next(replay_buffer_iterator)
         tget_data = time.time() - t0
@@ -38,6 +100,8 @@ def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_b
                 agent.unreplicate()
             wandb_logger.log({'t_get_data': tget_data}, step=i)
             wandb_logger.log({'t_update': tupdate}, step=i)
+            if hasattr(replay_buffer_iterator, 'stats'):
+                wandb_logger.log({f'prefetch/{k}': v for k, v in replay_buffer_iterator.stats.items()}, step=i)
             # if 'pixels' in update_info and i % (variant.eval_interval*10) == 0:
             if 'pixels' in update_info and i % variant.eval_interval == 0:
                 if variant.algorithm == 'reward_classifier':
@@ -58,6 +122,7 @@ def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_b
                     wandb_logger.log({f'training/{k}': v}, step=i)
                 elif v.ndim <= 2:
                     wandb_logger.log_histogram(f'training/{k}', v, i)
+            log_task_counts(task_buffers, wandb_logger, i)
 
         if variant.checkpoint_interval != -1:
             if i % variant.checkpoint_interval == 0:
@@ -69,7 +134,17 @@ def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_b
 
 def trajwise_alternating_training_loop(variant, agent, env, eval_env, online_replay_buffer, replay_buffer, wandb_logger,
                                        perform_control_evals=True, real_env=True, saver=None):
-    replay_buffer_iterator = replay_buffer.get_iterator(variant.batch_size)
+    prioritized_buffer = None
+    if variant.get('prioritized_replay', False):
+        prioritized_buffer, replay_buffer = enable_prioritized_replay(variant, online_replay_buffer, replay_buffer)
+    task_buffers = []
+    if variant.get('task_stratified_sampling', False):
+        task_buffers = enable_task_sampling(replay_buffer)
+    if replay_buffer is prioritized_buffer:
+        replay_buffer_iterator = replay_buffer.get_iterator(sample_args=dict(batch_size=variant.batch_size))
+    else:
+        replay_buffer_iterator = replay_buffer.get_iterator(variant.batch_size)
+    has_mixing_schedule = getattr(replay_buffer, 'mixing_schedule', None) is not None
 
     traj_collect_func = collect_traj_timed
 
@@ -90,8 +165,12 @@ def trajwise_alternating_training_loop(variant, agent, env, eval_env, online_rep
             if len(online_replay_buffer) > variant.start_online_updates:
                 for _ in range(len(traj)*variant.multi_grad_step):
                     # online perform update once we have some amount of online trajs
+                    if has_mixing_schedule:
+                        replay_buffer.set_step(i)
                     batch = next(replay_buffer_iterator)
                     update_info = agent.update(batch)
+                    if prioritized_buffer is not None:
+                        prioritized_buffer.update_priorities(np.asarray(batch['indx']), update_info.pop('td_errors'))
                     pbar.update()
                     i += 1
 
@@ -102,6 +181,7 @@ def trajwise_alternating_training_loop(variant, agent, env, eval_env, online_rep
                             elif v.ndim <= 2:
                                 wandb_logger.log_histogram(f'training/{k}', v, i)
                         wandb_logger.log({'replay_buffer_size': len(online_replay_buffer)}, i)
+                        log_task_counts(task_buffers, wandb_logger, i)
 
                     if i % variant.eval_interval == 0:
                         if perform_control_evals:
@@ -113,8 +193,8 @@ def trajwise_alternating_training_loop(variant, agent, env, eval_env, online_rep
                         if i % variant.checkpoint_interval == 0:
                             agent.save_checkpoint(variant.outputdir, i, variant.checkpoint_interval)
                             if hasattr(variant, 'save_replay_buffer') and variant.save_replay_buffer:
-                                print('saving replay buffer to ', variant.outputdir + '/replaybuffer.npy')
-                                online_replay_buffer.save(variant.outputdir + '/replaybuffer.npy')
+                                print('saving replay buffer to ', variant.outputdir + '/replay_buffer')
+                                online_replay_buffer.save(variant.outputdir + '/replay_buffer')
 
 def add_online_data_to_buffer(variant, traj, online_replay_buffer):
     if variant.only_add_success:
@@ -144,7 +224,6 @@ def add_online_data_to_buffer(variant, traj, online_replay_buffer):
                  masks=mask,
                  dones=step['done'],
                  next_observations=next_obs,
-                 trajectory_id=online_replay_buffer._traj_counter
                  ))
 
 def run_multiple_trajs(variant, agent, env, num_trajs, deterministic=True, visualize_run=False):
@@ -314,12 +393,16 @@ def stepwise_alternating_training_loop(variant, batch_size, agent, env, eval_env
 
 
 def make_multiple_value_reward_visulizations(agent, variant, i, replay_buffer, wandb_logger):
+    trajs = replay_buffer.get_random_trajs(3)
+    if isinstance(trajs, list):
+        # MixingReplayBuffer returns the trajectories of each of its buffers.
+        trajs = trajs[0]
     try:
-        trajs = replay_buffer.get_random_trajs(3)
         images = agent.make_value_reward_visulization(variant, trajs)
-        wandb_logger.log({'reward_value_images': wandb.Image(images)}, step=i)
-    except:
-        pass
+    except Exception as e:
+        print('Warning, value/reward visualization failed: {!r}'.format(e))
+        return
+    wandb_logger.log({'reward_value_images': wandb.Image(images)}, step=i)
 
 
 def perform_control_eval(agent, eval_env, i, variant, wandb_logger, visualize_run=False):
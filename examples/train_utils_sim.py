@@ -14,8 +14,64 @@ from jaxrl2.utils.visualization_utils import visualize_image_actions
 from jaxrl2.utils.visualization_utils import visualize_states_rewards, visualize_image_rewards
 from jaxrl2.utils.visualization_utils import sigmoid
 from jaxrl2.data.dataset import PropertyReplayBuffer, MixingReplayBuffer
+from jaxrl2.data.prioritized_replay_buffer import PrioritizedReplayBuffer
+from jaxrl2.data.return_utils import discounted_returns, nstep_returns
 import gc;
 
+def _replay_buffers(replay_buffer):
+    # The replay buffers batches are drawn from, inside mixing and property buffers.
+    if hasattr(replay_buffer, 'replay_buffers'):
+        return [b for buf in replay_buffer.replay_buffers for b in _replay_buffers(buf)]
+    if hasattr(replay_buffer, 'replay_buffer'):
+        return _replay_buffers(replay_buffer.replay_buffer)
+    return [replay_buffer]
+
+def enable_task_sampling(replay_buffer):
+    """Stratifies the batches of replay_buffer by the one-hot task_id of the observations.
+
+    Returns the replay buffers that are indexed by task, for log_task_counts.
+    """
+    buffers = _replay_buffers(replay_buffer)
+    for buf in buffers:
+        if not hasattr(buf, 'set_task_sampling'):
+            raise ValueError(f'{type(buf).__name__} cannot be sampled by task, only replay buffers can.')
+        buf.set_task_sampling(task_key='task_id')
+    return buffers
+
+def log_task_counts(task_buffers, wandb_logger, step):
+    for j, buf in enumerate(task_buffers):
+        for label, count in enumerate(buf.task_counts()):
+            wandb_logger.log({f'task_counts/buffer{j}_task{label}': count}, step=step)
+
+def _replace_replay_buffer(replay_buffer, old, new):
+    # replay_buffer with old, inside mixing and property buffers, replaced by new.
+    if replay_buffer is old:
+        return new
+    if hasattr(replay_buffer, 'replay_buffers'):
+        replay_buffer.set_replay_buffers(
+            [_replace_replay_buffer(b, old, new) for b in replay_buffer.replay_buffers])
+    elif hasattr(replay_buffer, 'replay_buffer'):
+        replay_buffer.replay_buffer = _replace_replay_buffer(replay_buffer.replay_buffer, old, new)
+    return replay_buffer
+
+def enable_prioritized_replay(variant, online_replay_buffer, replay_buffer):
+    """Samples the rows of online_replay_buffer by the TD errors of the critic.
+
+    The online buffer is wrapped by a PrioritizedReplayBuffer where replay_buffer
+    samples it, so the offline rows keep their share of the batches, with
+    importance weights of 1. Returns the PrioritizedReplayBuffer, whose
+    update_priorities() takes the td_errors of the updates, and replay_buffer.
+    """
+    if variant.get('task_stratified_sampling', False):
+        raise ValueError('Prioritized replay cannot be combined with task stratified sampling.')
+    online_buffers = _replay_buffers(online_replay_buffer)
+    if len(online_buffers) != 1:
+        raise ValueError('Only a single online replay buffer can be prioritized, not one split into positives and negatives.')
+    if not any(b is online_buffers[0] for b in _replay_buffers(replay_buffer)):
+        raise ValueError('The online replay buffer is not sampled by the training loop.')
+    prioritized_buffer = PrioritizedReplayBuffer(online_buffers[0])
+    return prioritized_buffer, _replace_replay_buffer(replay_buffer, online_buffers[0], prioritized_buffer)
+
 def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_buffer=None, wandb_logger=None, perform_control_evals=True, task_id_mapping=None):
     if eval_replay_buffer is None:
         eval_replay_buffer = replay_buffer
@@ -26,7 +82,10 @@ def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_b
             replay_buffer.set_mixing_ratio(1) #offline only    
             print("set target ratio to 1 for offline pretraining")
     
-    replay_buffer_iterator = replay_buffer.get_iterator(variant.batch_size)
+    task_buffers = []
+    if variant.get('task_stratified_sampling', False):
+        task_buffers = enable_task_sampling(replay_buffer)
+    replay_buffer_iterator = replay_buffer.get_iterator(variant.batch_size, keys=getattr(agent, "batch_keys", None))
     if eval_replay_buffer is not None:
         eval_replay_buffer_iterator = eval_replay_buffer.get_iterator(variant.batch_size)
 
@@ -39,8 +98,12 @@ def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_b
     if hasattr(agent, 'replicate'):
         agent.replicate()
 
+    # The mixing ratio of a MixingReplayBuffer follows its schedule, if any.
+    has_mixing_schedule = getattr(replay_buffer, 'mixing_schedule', None) is not None
     for i in tqdm(range(1, variant.online_start + 1), smoothing=0.1,):
         
+        if has_mixing_schedule:
+            replay_buffer.set_step(i)
         t0 = time.time()
         batch = next(replay_buffer_iterator)
         tget_data = time.time() - t0
@@ -60,7 +123,7 @@ def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_b
                 replay_buffer.set_mixing_ratio(variant.target_mixing_ratio)
                 print(f"set target ratio to {variant.target_mixing_ratio} for offline finetuning")
                 del replay_buffer_iterator
-                replay_buffer_iterator = replay_buffer.get_iterator(variant.batch_size)
+                replay_buffer_iterator = replay_buffer.get_iterator(variant.batch_size, keys=getattr(agent, "batch_keys", None))
                 changed_buffer_to_finetuning = True
                 
                 if hasattr(agent, '_cql_alpha') and hasattr(variant, 'cql_alpha_offline_finetuning') and variant.cql_alpha_offline_finetuning > 0:
@@ -71,6 +134,8 @@ def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_b
                 agent.unreplicate()
             wandb_logger.log({'t_get_data': tget_data}, step=i)
             wandb_logger.log({'t_update': tupdate}, step=i)
+            if hasattr(replay_buffer_iterator, 'stats'):
+                wandb_logger.log({f'prefetch/{k}': v for k, v in replay_buffer_iterator.stats.items()}, step=i)
             if 'pixels' in update_info and i % (variant.eval_interval*10) == 0:
                 if variant.algorithm == 'reward_classifier':
                     image = visualize_image_rewards(update_info.pop('pixels'), batch['rewards'], update_info.pop('rewards_mean'), batch['observations'], task_id_mapping=task_id_mapping)
@@ -93,6 +158,7 @@ def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_b
                     wandb_logger.log({f'training/{k}': v}, step=i)
                 elif v.ndim <= 2:
                     wandb_logger.log_histogram(f'training/{k}', v, i)
+            log_task_counts(task_buffers, wandb_logger, i)
 
         if variant.checkpoint_interval != -1:
             if i % variant.checkpoint_interval == 0:
@@ -104,7 +170,17 @@ def offline_training_loop(variant, agent, eval_env, replay_buffer, eval_replay_b
 
 def trajwise_alternating_training_loop(variant, agent, env, eval_env, online_replay_buffer, replay_buffer, wandb_logger,
                                        perform_control_evals=True, real_env=True, saver=None):
-    replay_buffer_iterator = replay_buffer.get_iterator(variant.batch_size)
+    prioritized_buffer = None
+    if variant.get('prioritized_replay', False):
+        prioritized_buffer, replay_buffer = enable_prioritized_replay(variant, online_replay_buffer, replay_buffer)
+    task_buffers = []
+    if variant.get('task_stratified_sampling', False):
+        task_buffers = enable_task_sampling(replay_buffer)
+    if replay_buffer is prioritized_buffer:
+        replay_buffer_iterator = replay_buffer.get_iterator(sample_args=dict(batch_size=variant.batch_size))
+    else:
+        replay_buffer_iterator = replay_buffer.get_iterator(variant.batch_size)
+    has_mixing_schedule = getattr(replay_buffer, 'mixing_schedule', None) is not None
 
     traj_collect_func = collect_traj
 
@@ -150,8 +226,12 @@ def trajwise_alternating_training_loop(variant, agent, env, eval_env, online_rep
                     #     agent.perform_eval(variant, i, wandb_logger, replay_buffer, replay_buffer_iterator, eval_env)
 
                     # online perform update once we have some amount of online trajs
+                    if has_mixing_schedule:
+                        replay_buffer.set_step(i)
                     batch = next(replay_buffer_iterator)
                     update_info = agent.update(batch, i)
+                    if prioritized_buffer is not None:
+                        prioritized_buffer.update_priorities(np.asarray(batch['indx']), update_info.pop('td_errors'))
 
                     pbar.update()
                     i += 1
@@ -164,6 +244,7 @@ def trajwise_alternating_training_loop(variant, agent, env, eval_env, online_rep
                             elif v.ndim <= 2:
                                 wandb_logger.log_histogram(f'training/{k}', v, i)
                         wandb_logger.log({'replay_buffer_size': len(online_replay_buffer)}, i)
+                        log_task_counts(task_buffers, wandb_logger, i)
 
                     if i % variant.eval_interval == 0:
                         wandb_logger.log({'num_online_samples': len(online_replay_buffer)}, step=i)
@@ -180,8 +261,8 @@ def trajwise_alternating_training_loop(variant, agent, env, eval_env, online_rep
                         if i % variant.checkpoint_interval == 0:
                             agent.save_checkpoint(variant.outputdir, i, variant.checkpoint_interval)
                             if hasattr(variant, 'save_replay_buffer') and variant.save_replay_buffer:
-                                print('saving replay buffer to ', variant.outputdir + '/replaybuffer.npy')
-                                online_replay_buffer.save(variant.outputdir + '/replaybuffer.npy')
+                                print('saving replay buffer to ', variant.outputdir + '/replay_buffer')
+                                online_replay_buffer.save(variant.outputdir + '/replay_buffer')
 
                     if variant.get('alpha_schedule_interval', False) and variant.alpha_schedule_interval > 0 and i % variant.alpha_schedule_interval == 0:
                         if isinstance(online_replay_buffer, PropertyReplayBuffer):
@@ -270,9 +351,9 @@ def add_online_data_to_buffer(variant, traj, online_replay_buffer):
             masks.append(mask)
             rewards.append(reward)
         
-        monte_carlo_return = calc_return_to_go(rewards, masks, variant.discount)
+        monte_carlo_return = discounted_returns(rewards, variant.discount, masks=masks)
         if variant.get("online_bound_nstep_return", -1) > 0:
-            nstep_return = calc_nstep_return(variant.online_bound_nstep_return, rewards, masks, variant.discount)
+            nstep_return = nstep_returns(rewards, variant.online_bound_nstep_return, variant.discount, masks=masks)
 
         if variant.reward_type == 'dense':
             is_positive=True
@@ -309,7 +390,6 @@ def add_online_data_to_buffer(variant, traj, online_replay_buffer):
                     masks=masks[t],
                     dones=step['done'],
                     next_observations=next_obs,
-                    trajectory_id=online_replay_buffer._traj_counter,
                     mc_returns=monte_carlo_return[t] if is_positive else -25.0,
                     nstep_returns=nstep_return[t],
                     nstep_observations=nstep_obs,
@@ -327,7 +407,6 @@ def add_online_data_to_buffer(variant, traj, online_replay_buffer):
                 masks=masks[t],
                 dones=step['done'],
                 next_observations=next_obs,
-                trajectory_id=online_replay_buffer._traj_counter,
                 mc_returns=monte_carlo_return[t] if is_positive else -25.0,
                 is_offline = 0
             )
@@ -609,40 +688,3 @@ def _reshape_image(obs):
         return obs
     else:
         raise ValueError
-
-RETURN_TO_GO_DICT = dict()
-
-def calc_return_to_go(rewards, masks, gamma):
-    global RETURN_TO_GO_DICT
-    rewards_str = str(rewards) + str(masks) + str(gamma)
-    if rewards_str in RETURN_TO_GO_DICT.keys():
-        reward_to_go = RETURN_TO_GO_DICT[rewards_str]
-    else:
-        reward_to_go = [0]*len(rewards)
-        prev_return = 0
-        for i in range(len(rewards)):
-            reward_to_go[-i-1] = rewards[-i-1] + gamma * prev_return * masks[-i-1]
-            prev_return = reward_to_go[-i-1]
-        RETURN_TO_GO_DICT[rewards_str] = reward_to_go
-    return reward_to_go
-
-NSTEP_RETURN_DICT = dict()
-def calc_nstep_return(n, rewards, masks, gamma):
-    global NSTEP_RETURN_DICT
-    rewards_str = str(rewards) + str(masks) + str(gamma)
-    if rewards_str in NSTEP_RETURN_DICT.keys():
-        nstep_return = NSTEP_RETURN_DICT[rewards_str]
-    else:
-        nstep_return = [0]*len(rewards)
-        prev_return = 0
-        terminal_counts=1
-        for i in range(len(rewards)):
-            if i < n + terminal_counts - 1:
-                nstep_return[-i-1] = rewards[-i-1] + gamma * prev_return * masks[-i-1]
-            else:
-                nstep_return[-i-1] = rewards[-i-1] + gamma * prev_return * masks[-i-1] - (gamma**n) * rewards[-i-1+n] * masks[-i-1]
-            prev_return = nstep_return[-i-1]
-            if i!= 0 and masks[-i-1] == 0: # deal with the negative traj wich does not have terminal
-                terminal_counts+=1
-        NSTEP_RETURN_DICT[rewards_str] = nstep_return
-    return nstep_return
\ No newline at end of file
@@ -1,3 +1,5 @@
+from typing import Optional, Tuple
+
 import numpy as np
 from flax.training.train_state import TrainState
 
@@ -13,6 +15,10 @@ class Agent(object):
     _critic: TrainState
     _rng: PRNGKey
 
+    # The batch columns that update() reads, passed as the keys of
+    # Dataset.sample so that the others are not gathered; all if None.
+    batch_keys: Optional[Tuple[str, ...]] = None
+
     def eval_actions(self, observations: np.ndarray) -> np.ndarray:
         actions = eval_actions_jit(
             self._actor.apply_fn, self._actor.params, observations
@@ -16,6 +16,8 @@ _log_prob_update_jit = jax.jit(log_prob_update)
 
 
 class BCLearner(Agent):
+    batch_keys = ("observations", "actions")
+
     def __init__(
         self,
         seed: int,
@@ -127,7 +127,12 @@ def update_critic(
 
     def critic_loss_fn(critic_params: Params) -> Tuple[jnp.ndarray, Dict[str, float]]:
         qs = critic.apply_fn({'params': critic_params}, batch['observations'], batch['actions'])
-        critic_loss = ((qs - target_q)**2).mean()
+        td_errors = qs - target_q
+        if 'importance_weights' in batch:
+            # Batches of a PrioritizedReplayBuffer, whose bias is corrected.
+            critic_loss = (batch['importance_weights'] * td_errors**2).mean()
+        else:
+            critic_loss = (td_errors**2).mean()
         bellman_loss = critic_loss
 
         # CQL loss
@@ -188,6 +193,8 @@ def update_critic(
             'actions_mean': batch['actions'].mean(),
             'actions_max': batch['actions'].max(),
             'actions_min': batch['actions'].min(),
+            # Per sample, for PrioritizedReplayBuffer.update_priorities.
+            'td_errors': td_errors,
         }
         
         if bound_q_with_mc_global:
@@ -179,7 +179,12 @@ def update_critic(
             
         new_model_state = (new_model_state_encoder, new_model_state_decoder)
 
-        critic_loss = ((qs - target_q)**2).mean()
+        td_errors = qs - target_q
+        if 'importance_weights' in batch:
+            # Batches of a PrioritizedReplayBuffer, whose bias is corrected.
+            critic_loss = (batch['importance_weights'] * td_errors**2).mean()
+        else:
+            critic_loss = (td_errors**2).mean()
         bellman_loss = critic_loss
 
         qs_to_log = copy.deepcopy(qs) # copy to avoid modifying the original qs
@@ -326,6 +331,8 @@ def update_critic(
             'target_q_max': target_q.max(),
             'target_q_min': target_q.min(),
             'target_q_std': target_q.std(),
+            # Per sample, for PrioritizedReplayBuffer.update_priorities.
+            'td_errors': td_errors,
         }
 
         if tr_penalty_coefficient != 0:
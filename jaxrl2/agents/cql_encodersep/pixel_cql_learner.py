@@ -40,6 +40,7 @@ from jaxrl2.networks.encoders.resnet_encoderv2 import ResNetV2Encoder
 from jaxrl2.networks.values import StateActionEnsemble
 from jaxrl2.types import Params, PRNGKey
 from jaxrl2.utils.target_update import soft_target_update
+from jaxrl2.data.device_dataset import sample_device_batch
 # from jaxrl_m.vision import bigvision_resnetv2 as resnet
 # from jaxrl_m.vision import encoders as encoders
 
@@ -59,6 +60,7 @@ def _update_jit(
     method:bool = False, method_const:float = 0.0, method_type:int=0, bc_update=0,
     cross_norm:bool = False, color_jitter:bool = False, bound_q_with_mc:bool = False, online_bound_nstep_return:int=-1
     ) -> Tuple[PRNGKey, TrainState, TrainState, Params, TrainState, Dict[str,float]]:
+    rng, batch = sample_device_batch(rng, batch)
 
     aug_pixels = batch['observations']['pixels']
     aug_next_pixels = batch['next_observations']['pixels']
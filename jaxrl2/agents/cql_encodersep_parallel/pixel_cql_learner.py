@@ -39,6 +39,7 @@ from jaxrl2.networks.encoders.impala_encoder import ImpalaEncoder, BiggerImpalaE
 from jaxrl2.networks.encoders.resnet_encoderv1 import ResNet18, ResNet34, ResNetSmall, ResNet50
 from jaxrl2.networks.encoders.resnet_encoderv2 import ResNetV2Encoder
 from jaxrl2.data.dataset import DatasetDict
+from jaxrl2.data.device_dataset import sample_device_batch
 from jaxrl2.networks.normal_policy import NormalPolicy
 from jaxrl2.networks.values import StateActionEnsemble, StateValue, AuxStateActionEnsemble
 from jaxrl2.networks.values.state_action_value import StateActionValue, AuxStateActionValue
@@ -69,6 +70,7 @@ def _update_jit(
     critic_reduction: str, cql_alpha: float, max_q_backup: bool,
     dr3_coefficient: float, color_jitter: bool, cross_norm:bool, aug_next:bool,
     basis_projection_coefficient: float, use_basis_projection: bool, use_gaussian_policy: bool, min_q_version: int):
+    rng, batch = sample_device_batch(rng, batch)
 
     # Comment out when using the naive replay buffer
     # batch = _unpack(batch)
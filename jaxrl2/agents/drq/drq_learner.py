@@ -24,6 +24,8 @@ from jaxrl2.networks.pixel_multiplexer import PixelMultiplexer
 from jaxrl2.networks.values import StateActionEnsemble
 from jaxrl2.types import Params, PRNGKey
 from jaxrl2.utils.target_update import soft_target_update
+from jaxrl2.data.device_dataset import sample_device_batch
+from jaxrl2.data.packed_frames import unpack_frames
 
 import os ###===###
 from flax.training import checkpoints
@@ -33,6 +35,9 @@ from glob import glob ###---###
 # Helps to minimize CPU to GPU transfer.
 def _unpack(batch):
     # Assuming that if next_observation is missing, it's combined with observation:
+    batch = batch.copy(
+        add_or_replace={"observations": unpack_frames(batch["observations"])}
+    )
     obs_pixels = batch["observations"]["pixels"][..., :-1]
     next_obs_pixels = batch["observations"]["pixels"][..., 1:]
 
@@ -71,6 +76,7 @@ def _update_jit(
     backup_entropy: bool,
     critic_reduction: str,
 ) -> Tuple[PRNGKey, TrainState, TrainState, Params, TrainState, Dict[str, float]]:
+    rng, batch = sample_device_batch(rng, batch)
     batch = _unpack(batch)
     actor = _share_encoder(source=critic, target=actor)
 
@@ -51,6 +51,7 @@ from jaxrl2.networks.kitchen_networks.values.state_action_value import StateActi
 from jaxrl2.networks.kitchen_networks.values.state_value import StateValueEnsemble
 from jaxrl2.types import Params, PRNGKey
 from jaxrl2.utils.target_update import soft_target_update
+from jaxrl2.data.device_dataset import sample_device_batch
 # from jaxrl_m.vision import bigvision_resnetv2 as resnet
 # from jaxrl_m.vision import encoders as encoders
 from icecream import ic
@@ -72,6 +73,7 @@ def _update_jit(
     method:bool = False, method_const:float = 0.0, method_type:int=0,
     cross_norm:bool = False, color_jitter:bool = False, bound_q_with_mc:bool = False, online_bound_nstep_return:int=-1
     ) -> Tuple[PRNGKey, TrainState, TrainState, Params, TrainState, Dict[str,float]]:
+    rng, batch = sample_device_batch(rng, batch)
 
     # Comment out when using the naive replay buffer
     batch = _unpack(batch)
@@ -20,6 +20,7 @@ from jaxrl2.networks.kitchen_networks.encoders import D4PGEncoder, D4PGEncoderGr
 from jaxrl2.networks.kitchen_networks.normal_policy import UnitStdNormalPolicy
 from jaxrl2.networks.kitchen_networks.pixel_multiplexer import PixelMultiplexer, PixelMultiplexerMultiple
 from jaxrl2.types import Params, PRNGKey
+from jaxrl2.data.device_dataset import sample_device_batch
 
 
 import os ###===###
@@ -34,6 +35,7 @@ from typing import Any
 def _update_jit(
     rng: PRNGKey, actor: TrainState, batch: TrainState
 ) -> Tuple[PRNGKey, TrainState, TrainState, Params, TrainState, Dict[str, float]]:
+    rng, batch = sample_device_batch(rng, batch)
     batch = _unpack(batch)
 
     rng, key = jax.random.split(rng)
@@ -47,6 +49,9 @@ def _update_jit(
 
 
 class PixelBCLearner(Agent):
+    # _unpack splits the frames of the observations into next_observations.
+    batch_keys = ("observations", "actions", "next_observations/pixels")
+
     def __init__(
         self,
         seed: int,
@@ -11,6 +11,8 @@ import jax.numpy as jnp
 import flax.linen as nn
 from jaxrl2.agents.drq.augmentations import batched_random_crop
 from jaxrl2.data.kitchen_data.dataset import DatasetDict
+from jaxrl2.data.device_dataset import sample_device_batch
+from jaxrl2.data.packed_frames import unpack_frames
 from jaxrl2.networks.jaxrl5_networks import (MLP, Ensemble, StateActionValue, StateValue,
                                           DDPM, FourierFeatures, cosine_beta_schedule, PixelMultiplexer,
                                           ddpm_sampler, MLPResNet, get_weight_decay_mask, vp_beta_schedule)
@@ -36,6 +38,9 @@ def expectile_loss(diff, expectile=0.8):
 # Helps to minimize CPU to GPU transfer.
 def _unpack(batch):
     # Assuming that if next_observation is missing, it's combined with observation:
+    batch = batch.copy(
+        add_or_replace={"observations": unpack_frames(batch["observations"])}
+    )
     for pixel_key in batch["observations"].keys():
         if pixel_key not in batch["next_observations"]:
             obs_pixels = batch["observations"][pixel_key][..., :-1]
@@ -483,6 +488,8 @@ class PixelIDQLLearner(Agent):
     @jax.jit
     def update(self, batch: DatasetDict):
         agent = self
+        rng, batch = sample_device_batch(agent.rng, batch)
+        agent = agent.replace(rng=rng)
 
         if "pixels" not in batch["next_observations"]:
             batch = _unpack(batch)
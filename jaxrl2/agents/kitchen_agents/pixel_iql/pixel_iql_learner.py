@@ -24,6 +24,7 @@ from jaxrl2.networks.kitchen_networks.pixel_multiplexer import PixelMultiplexer,
 from jaxrl2.networks.kitchen_networks.values import StateActionEnsemble, StateValue
 from jaxrl2.types import Params, PRNGKey
 from jaxrl2.utils.target_update import soft_target_update
+from jaxrl2.data.device_dataset import sample_device_batch
 
 import os ###===###
 from flax.training import checkpoints
@@ -45,6 +46,7 @@ def _update_jit(
     critic_reduction: str,
     share_encoder: bool,
 ) -> Tuple[PRNGKey, TrainState, TrainState, Params, TrainState, Dict[str, float]]:
+    rng, batch = sample_device_batch(rng, batch)
     batch = _unpack(batch)
 
     if share_encoder:
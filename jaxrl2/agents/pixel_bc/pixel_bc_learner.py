@@ -20,6 +20,7 @@ from jaxrl2.networks.encoders import D4PGEncoder, D4PGEncoderGroups ###===### ##
 from jaxrl2.networks.normal_policy import UnitStdNormalPolicy
 from jaxrl2.networks.pixel_multiplexer import PixelMultiplexer, PixelMultiplexerMultiple
 from jaxrl2.types import Params, PRNGKey
+from jaxrl2.data.device_dataset import sample_device_batch
 
 
 import os ###===###
@@ -34,9 +35,9 @@ from typing import Any
 def _update_jit(
     rng: PRNGKey, actor: TrainState, batch: TrainState
 ) -> Tuple[PRNGKey, TrainState, TrainState, Params, TrainState, Dict[str, float]]:
+    rng, batch = sample_device_batch(rng, batch)
     # batch = _unpack(batch)
     aug_pixels = batch['observations']['pixels']
-    aug_next_pixels = batch['next_observations']['pixels']
 
     if batch['observations']['pixels'].squeeze().ndim != 2:
         # random crop
@@ -55,6 +56,8 @@ def _update_jit(
 
 
 class PixelBCLearner(Agent):
+    batch_keys = ("observations", "actions")
+
     def __init__(
         self,
         seed: int,
@@ -31,6 +31,7 @@ from jaxrl2.networks.pixel_multiplexer import PixelMultiplexer, PixelMultiplexer
 from jaxrl2.networks.values import StateActionEnsemble, StateValue
 from jaxrl2.types import Params, PRNGKey
 from jaxrl2.utils.target_update import soft_target_update
+from jaxrl2.data.device_dataset import sample_device_batch
 
 import os ###===###
 from flax.training import checkpoints
@@ -56,6 +57,7 @@ def _update_jit(
     bound_q_with_mc: bool,
     share_encoder: bool,
 ) -> Tuple[PRNGKey, TrainState, TrainState, Params, TrainState, Dict[str, float]]:
+    rng, batch = sample_device_batch(rng, batch)
     batch = _unpack(batch)
 
     if share_encoder:
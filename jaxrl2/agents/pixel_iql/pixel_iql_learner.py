@@ -32,6 +32,7 @@ from jaxrl2.networks.normal_policy import NormalPolicy
 from jaxrl2.networks.values import StateActionEnsemble, StateValue
 from jaxrl2.types import Params, PRNGKey
 from jaxrl2.utils.target_update import soft_target_update
+from jaxrl2.data.device_dataset import sample_device_batch
 
 
 class TrainState(train_state.TrainState):
@@ -44,6 +45,7 @@ def _update_jit(
     discount: float, tau: float, expectile: float, A_scaling: float,
     critic_reduction: str, color_jitter: bool, share_encoders: bool, aug_next: bool
 ) -> Tuple[PRNGKey, TrainState, TrainState, Params, TrainState, Dict[str, float]]:
+    rng, batch = sample_device_batch(rng, batch)
     
     aug_pixels = batch['observations']['pixels']
     aug_next_pixels = batch['next_observations']['pixels']
@@ -30,6 +30,7 @@ from jaxrl2.networks.normal_policy import NormalPolicy
 from jaxrl2.networks.values import StateActionEnsemble
 from jaxrl2.types import Params, PRNGKey
 from jaxrl2.utils.target_update import soft_target_update
+from jaxrl2.data.device_dataset import sample_device_batch
 
 
 class TrainState(train_state.TrainState):
@@ -41,6 +42,7 @@ def _update_jit(
     target_critic_params: Params, batch: TrainState,
     discount: float, tau: float, alpha: float, color_jitter: bool, share_encoders: bool, aug_next: bool
 ) -> Tuple[PRNGKey, TrainState, TrainState, Params, TrainState, Dict[str,float]]:
+    rng, batch = sample_device_batch(rng, batch)
 
     aug_pixels = batch['observations']['pixels']
     aug_next_pixels = batch['next_observations']['pixels']
@@ -0,0 +1,96 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from flax.core import frozen_dict
+
+from jaxrl2.types import DataType
+
+DatasetDict = Dict[str, DataType]
+
+
+def _schema(batch: DatasetDict, prefix: tuple = ()) -> Tuple[tuple, ...]:
+    schema = []
+    for k, v in batch.items():
+        if isinstance(v, (dict, frozen_dict.FrozenDict)):
+            schema.extend(_schema(v, prefix + (k,)))
+        else:
+            schema.append((prefix + (k,), v.shape, np.dtype(v.dtype).str))
+    return tuple(schema)
+
+
+def _empty_like(batch: DatasetDict, batch_size: Optional[int] = None) -> DatasetDict:
+    # With batch_size, the arrays have batch_size rows instead of those of batch.
+    out = {}
+    for k, v in batch.items():
+        if isinstance(v, (dict, frozen_dict.FrozenDict)):
+            out[k] = _empty_like(v, batch_size)
+        elif batch_size is None:
+            out[k] = np.empty(v.shape, dtype=v.dtype)
+        else:
+            out[k] = np.empty((batch_size, *v.shape[1:]), dtype=v.dtype)
+    return out
+
+
+def copy_into(batch: DatasetDict, out: DatasetDict):
+    """Copies the arrays of batch that are not already those of out into them."""
+    for k, v in batch.items():
+        if isinstance(v, (dict, frozen_dict.FrozenDict)):
+            copy_into(v, out[k])
+        elif v is not out[k]:
+            out[k][...] = v
+
+
+def take_rows(column, indx: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Gathers the rows indx of column into out, raising on out-of-range
+    indices as indexing does.
+
+    np.take buffers the gather with mode="raise", so the indices are
+    checked here and gathered with mode="wrap", which leaves valid indices
+    as they are and maps negative ones like indexing.
+    """
+    indx = np.asarray(indx)
+    if indx.size and (indx.min() < -len(column) or indx.max() >= len(column)):
+        raise IndexError(f"Index out of bounds for a column with {len(column)} rows.")
+    return np.take(column, indx, axis=0, out=out, mode="wrap")
+
+
+def slice_batch(batch: DatasetDict, start: int, stop: int) -> DatasetDict:
+    """Views of rows [start, stop) of every array of a nested batch."""
+    out = {}
+    for k, v in batch.items():
+        if isinstance(v, (dict, frozen_dict.FrozenDict)):
+            out[k] = slice_batch(v, start, stop)
+        else:
+            out[k] = v[start:stop]
+    return out
+
+
+class BatchPool(object):
+    """Free lists of preallocated batch buffers, one per batch schema.
+
+    get() returns a buffer with the shapes and dtypes of the template batch,
+    to be passed as the out argument of Dataset.sample, and release() hands
+    it back once the batch is no longer used. New buffers are only allocated
+    when all buffers of the schema are in use, so the pool grows to the
+    number of batches in flight at once.
+    """
+
+    def __init__(self):
+        self._free = {}
+        self._lock = threading.Lock()
+        self.num_allocated = 0
+
+    def get(self, template: DatasetDict) -> DatasetDict:
+        schema = _schema(template)
+        with self._lock:
+            free = self._free.setdefault(schema, [])
+            if free:
+                return free.pop()
+            self.num_allocated += 1
+        return _empty_like(template)
+
+    def release(self, buffer: DatasetDict):
+        schema = _schema(buffer)
+        with self._lock:
+            self._free.setdefault(schema, []).append(buffer)
@@ -0,0 +1,269 @@
+import collections
+import io
+import operator
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+import numpy as np
+
+CODECS = ("png", "jpeg", "zlib")
+
+
+def _channel_groups(frame: np.ndarray):
+    # PNG and JPEG images have one or three channels, so e.g. three
+    # concatenated RGB cameras are encoded as three images.
+    if frame.ndim == 2:
+        return [frame]
+    num_channels = frame.shape[-1]
+    if num_channels % 3 == 0:
+        return [frame[..., i : i + 3] for i in range(0, num_channels, 3)]
+    return [frame[..., i] for i in range(num_channels)]
+
+
+def encode_frame(frame: np.ndarray, codec: str, quality: int = 95):
+    if codec == "zlib":
+        return zlib.compress(np.ascontiguousarray(frame).tobytes(), 1)
+
+    from PIL import Image
+
+    assert frame.dtype == np.uint8, "PNG and JPEG frames must be uint8."
+    encoded = []
+    for image in _channel_groups(frame):
+        buffer = io.BytesIO()
+        if codec == "png":
+            Image.fromarray(np.ascontiguousarray(image)).save(
+                buffer, format="PNG", compress_level=1
+            )
+        else:
+            Image.fromarray(np.ascontiguousarray(image)).save(
+                buffer, format="JPEG", quality=quality
+            )
+        encoded.append(buffer.getvalue())
+    return tuple(encoded)
+
+
+def decode_frame(
+    encoded, codec: str, frame_shape: Tuple[int, ...], dtype: np.dtype
+) -> np.ndarray:
+    if codec == "zlib":
+        return np.frombuffer(zlib.decompress(encoded), dtype=dtype).reshape(frame_shape)
+
+    from PIL import Image
+
+    images = [np.asarray(Image.open(io.BytesIO(image))) for image in encoded]
+    images = [image[..., None] if image.ndim == 2 else image for image in images]
+    return np.concatenate(images, axis=-1).reshape(frame_shape)
+
+
+class CompressedFrames(object):
+    """A column of frames stored encoded, one object per slot.
+
+    Frames are encoded on assignment and decoded by take() and indexing,
+    which is how the replay buffers read their columns. Each gather decodes
+    the frames missing from an LRU cache of decoded frames once, in a thread
+    pool, so overlapping frame stacks and recently sampled slots are decoded
+    only once. Zlib and the PNG / JPEG encoders of Pillow release the GIL.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        frame_shape: Tuple[int, ...],
+        dtype: np.dtype = np.uint8,
+        codec: str = "png",
+        quality: int = 95,
+        cache_size: int = 4096,
+        num_threads: int = 4,
+    ):
+        """
+        :param codec: "png" (lossless), "jpeg" (lossy, see quality) or
+            "zlib" (lossless, any dtype and shape).
+        :param cache_size: number of decoded frames kept in the LRU cache.
+        """
+        assert codec in CODECS, f"Unknown codec {codec}, expected one of {CODECS}."
+        self.shape = (capacity, *frame_shape)
+        self.dtype = np.dtype(dtype)
+        self._codec = codec
+        self._quality = quality
+        self._cache_size = cache_size
+        self._num_threads = num_threads
+
+        self._encoded = np.empty((capacity,), dtype=object)
+        # Incremented on every assignment, so that frames decoded while their
+        # slot was overwritten are not cached.
+        self._versions = np.zeros((capacity,), dtype=np.int64)
+        self._cache = collections.OrderedDict()
+        self._pid = None
+        self._init_threads()
+
+    def _init_threads(self):
+        # The lock and the decoding threads belong to the process that
+        # created them; a forked child creates its own on first use.
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ("_lock", "_executor", "_cache", "_pid"):
+            del state[k]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = collections.OrderedDict()
+        self._init_threads()
+
+    def _map(self, fn, items):
+        if self._pid != os.getpid():
+            self._init_threads()
+        if len(items) < 2 or self._num_threads < 2:
+            return [fn(item) for item in items]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self._num_threads)
+        return list(self._executor.map(fn, items))
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the encoded frames."""
+        num_bytes = 0
+        for encoded in self._encoded:
+            if isinstance(encoded, tuple):
+                num_bytes += sum(len(image) for image in encoded)
+            elif encoded is not None:
+                num_bytes += len(encoded)
+        return num_bytes
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _slots(self, index):
+        # Single slots and slices are resolved without building an array of
+        # all slots, so that inserting a row does not scale with the capacity.
+        if isinstance(index, slice):
+            return np.arange(*index.indices(len(self)))
+        try:
+            slot = operator.index(index)
+        except TypeError:
+            return np.arange(len(self))[index]
+        if not -len(self) <= slot < len(self):
+            raise IndexError(
+                f"index {slot} is out of bounds for a column with {len(self)} rows"
+            )
+        return slot % len(self)
+
+    def __setitem__(self, index, frames):
+        slots = self._slots(index)
+        frames = np.asarray(frames, dtype=self.dtype)
+        if np.ndim(slots) == 0:
+            encoded = [encode_frame(frames, self._codec, self._quality)]
+        else:
+            frames = np.broadcast_to(frames, (len(slots), *self.shape[1:]))
+            encoded = self._map(
+                lambda frame: encode_frame(frame, self._codec, self._quality),
+                list(frames),
+            )
+        slots = np.atleast_1d(slots)
+        with self._lock:
+            for slot, frame in zip(slots, encoded):
+                self._encoded[slot] = frame
+                self._versions[slot] += 1
+                self._cache.pop(slot, None)
+
+    def _num_images(self) -> int:
+        if self._codec == "zlib":
+            return 1
+        return len(_channel_groups(np.empty(self.shape[1:], self.dtype)))
+
+    def get_encoded(self, slots) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the frames of slots without decoding them, e.g. to save them.
+
+        The frames are returned as the concatenated bytes of their images and
+        the lengths of the images of every slot, -1 for empty slots.
+        """
+        slots = np.asarray(slots)
+        lengths = np.full((len(slots), self._num_images()), -1, dtype=np.int64)
+        with self._lock:
+            encoded = self._encoded[slots]
+        images = []
+        for i, frame in enumerate(encoded):
+            if frame is not None:
+                frame_images = (frame,) if self._codec == "zlib" else frame
+                lengths[i] = [len(image) for image in frame_images]
+                images.extend(frame_images)
+        return np.frombuffer(b"".join(images), dtype=np.uint8), lengths
+
+    def set_encoded(self, slots, encoded: np.ndarray, lengths: np.ndarray):
+        """Assigns frames returned by get_encoded() to slots, without encoding them."""
+        data = np.asarray(encoded, dtype=np.uint8).tobytes()
+        frames = []
+        offset = 0
+        for frame_lengths in lengths:
+            if frame_lengths[0] < 0:
+                frames.append(None)
+                continue
+            images = []
+            for length in frame_lengths:
+                images.append(data[offset : offset + length])
+                offset += length
+            frames.append(images[0] if self._codec == "zlib" else tuple(images))
+        with self._lock:
+            for slot, frame in zip(np.asarray(slots), frames):
+                self._encoded[slot] = frame
+                self._versions[slot] += 1
+                self._cache.pop(slot, None)
+
+    def __getitem__(self, index) -> np.ndarray:
+        return self.take(self._slots(index))
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        frames = self.take(np.arange(len(self)))
+        return frames if dtype is None else frames.astype(dtype)
+
+    def _decode(self, slot: int) -> np.ndarray:
+        encoded = self._encoded[slot]
+        if encoded is None:
+            return np.zeros(self.shape[1:], dtype=self.dtype)
+        return decode_frame(encoded, self._codec, self.shape[1:], self.dtype)
+
+    def take(self, indices, axis: int = 0, out=None, mode: str = "raise") -> np.ndarray:
+        assert axis == 0
+        indices = np.asarray(indices)
+        if mode == "clip":
+            indices = np.clip(indices, 0, len(self) - 1)
+        elif mode == "wrap":
+            indices = indices % len(self)
+
+        slots, inverse = np.unique(indices, return_inverse=True)
+        decoded = [None] * len(slots)
+        missing = []
+        with self._lock:
+            for i, slot in enumerate(slots):
+                frame = self._cache.get(slot)
+                if frame is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end(slot)
+                    decoded[i] = frame
+            versions = self._versions[slots]
+
+        for i, frame in zip(missing, self._map(self._decode, [slots[i] for i in missing])):
+            decoded[i] = frame
+
+        if self._cache_size > 0:
+            with self._lock:
+                for i in missing:
+                    if self._versions[slots[i]] == versions[i]:
+                        self._cache[slots[i]] = decoded[i]
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+
+        frames = np.stack(decoded) if decoded else np.empty((0, *self.shape[1:]), self.dtype)
+        return np.take(frames, inverse.reshape(indices.shape), axis=0, out=out)
@@ -13,19 +13,16 @@ class D4RLDataset(Dataset):
             lim = 1 - eps
             dataset_dict["actions"] = np.clip(dataset_dict["actions"], -lim, lim)
 
+        # An episode ends at a terminal or where the next observation is not
+        # the observation of the next step.
         dones = np.full_like(dataset_dict["rewards"], False, dtype=bool)
-
-        for i in range(len(dones) - 1):
-            if (
-                np.linalg.norm(
-                    dataset_dict["observations"][i + 1]
-                    - dataset_dict["next_observations"][i]
-                )
-                > 1e-6
-                or dataset_dict["terminals"][i] == 1.0
-            ):
-                dones[i] = True
-
+        dones[:-1] = (
+            np.linalg.norm(
+                dataset_dict["observations"][1:] - dataset_dict["next_observations"][:-1],
+                axis=-1,
+            )
+            > 1e-6
+        ) | (dataset_dict["terminals"][:-1] == 1.0)
         dones[-1] = True
 
         dataset_dict["masks"] = 1.0 - dataset_dict["terminals"]
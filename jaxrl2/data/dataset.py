@@ -1,5 +1,5 @@
-from typing import Dict, Iterable, Optional, Tuple, Union
-import collections
+import os
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
 import jax
 import numpy as np
 from gym.utils import seeding
@@ -8,12 +8,17 @@ from jaxrl2.types import DataType
 
 DatasetDict = Dict[str, DataType]
 from flax.core import frozen_dict
+from jaxrl2.data.batch_pool import _empty_like, copy_into, slice_batch, take_rows
+from jaxrl2.data.compressed_frames import CompressedFrames
+from jaxrl2.data.index_set import IndexSet
+from jaxrl2.data.prefetch import PrefetchIterator, make_iterator
+from jaxrl2.data.return_utils import episode_boundaries, episode_returns
 
 def concat_recursive(batches):
     new_batch = {}
     for k, v in batches[0].items():
-        if isinstance(v, frozen_dict.FrozenDict):
-            new_batch[k] = concat_recursive([batches[0][k], batches[1][k]])
+        if isinstance(v, (dict, frozen_dict.FrozenDict)):
+            new_batch[k] = concat_recursive([b[k] for b in batches])
         else:
             new_batch[k] = np.concatenate([b[k] for b in batches], 0)
     return new_batch
@@ -23,7 +28,7 @@ def _check_lengths(dataset_dict: DatasetDict,
     for v in dataset_dict.values():
         if isinstance(v, dict):
             dataset_len = dataset_len or _check_lengths(v, dataset_len)
-        elif isinstance(v, np.ndarray):
+        elif isinstance(v, (np.ndarray, CompressedFrames)):
             item_len = len(v)
             dataset_len = dataset_len or item_len
             assert dataset_len == item_len, 'Inconsistent item lengths in the dataset.'
@@ -38,7 +43,7 @@ def _split(dataset_dict: DatasetDict,
     for k, v in dataset_dict.items():
         if isinstance(v, dict):
             train_v, test_v = _split(v, index)
-        elif isinstance(v, np.ndarray):
+        elif isinstance(v, (np.ndarray, CompressedFrames)):
             train_v, test_v = v[:index], v[index:]
         else:
             raise TypeError('Unsupported type.')
@@ -48,23 +53,75 @@ def _split(dataset_dict: DatasetDict,
 
 
 def _sample(dataset_dict: Union[np.ndarray, DatasetDict],
-            indx: np.ndarray) -> DatasetDict:
-    if isinstance(dataset_dict, np.ndarray):
-        return dataset_dict[indx]
+            indx: np.ndarray,
+            out: Optional[Union[np.ndarray, DatasetDict]] = None) -> DatasetDict:
+    # With out, the rows are gathered into the preallocated arrays of out.
+    # Columns missing from out, e.g. empty dicts of a flattened batch, are
+    # allocated.
+    if isinstance(dataset_dict, (np.ndarray, CompressedFrames)):
+        if out is None:
+            return dataset_dict[indx]
+        return take_rows(dataset_dict, indx, out)
     elif isinstance(dataset_dict, dict):
         batch = {}
         for k, v in dataset_dict.items():
-            batch[k] = _sample(v, indx)
+            batch[k] = _sample(v, indx, None if out is None else out.get(k))
     else:
         raise TypeError("Unsupported type.")
     return batch
 
 
+def _key_tree(keys: Iterable[str]) -> Dict[str, Optional[dict]]:
+    # Nests column names, e.g. 'observations/pixels', into a tree whose None
+    # leaves select whole columns or dicts of columns.
+    tree = {}
+    for key in keys:
+        node = tree
+        *parents, name = key.split('/')
+        for parent in parents:
+            if node.get(parent, {}) is None:
+                break
+            node = node.setdefault(parent, {})
+        else:
+            node[name] = None
+    return tree
+
+
+def _select(dataset_dict: DatasetDict,
+            key_tree: Dict[str, Optional[dict]]) -> DatasetDict:
+    # The columns of key_tree, without copying them.
+    return {
+        k: dataset_dict[k] if sub_tree is None else _select(dataset_dict[k], sub_tree)
+        for k, sub_tree in key_tree.items()
+    }
+
+
+def select_keys(dataset_dict: DatasetDict, keys: Iterable[str]) -> DatasetDict:
+    """The columns named by keys, where nested columns are named by their
+    path, e.g. 'observations/pixels', and a dict by its name."""
+    return _select(dataset_dict, _key_tree(keys))
+
+
+def _unpermute(batch: DatasetDict, inverse: np.ndarray) -> DatasetDict:
+    # Rows gathered at indx[order] are put back in the order of indx, in
+    # place, with inverse the inverse permutation of order. Gathering the
+    # rows is faster than scattering them into the strided stacks of a
+    # sliding window.
+    if isinstance(batch, np.ndarray):
+        batch[...] = batch[inverse]
+    else:
+        for v in batch.values():
+            _unpermute(v, inverse)
+    return batch
+
+
 class Dataset(object):
 
     def __init__(self, dataset_dict: DatasetDict, seed: Optional[int] = None):
         self.dataset_dict = dataset_dict
         self.dataset_len = _check_lengths(dataset_dict)
+        # Rows that sample() draws from once filter() was called.
+        self._sample_indices = None
 
         # Seeding similar to OpenAI Gym:
         # https://github.com/openai/gym/blob/master/gym/spaces/space.py#L46
@@ -88,24 +145,49 @@ class Dataset(object):
     def sample(self,
                batch_size: int,
                keys: Optional[Iterable[str]] = None,
-               indx: Optional[np.ndarray] = None) -> frozen_dict.FrozenDict:
+               indx: Optional[np.ndarray] = None,
+               out: Optional[DatasetDict] = None,
+               sort_indices: bool = False) -> frozen_dict.FrozenDict:
+        """
+        :param keys: the columns to gather; nested columns are named by
+            their path, e.g. 'observations/pixels'. All columns if None.
+        :param out: preallocated batch, e.g. from a BatchPool, that the rows
+            are gathered into instead of new arrays.
+        :param sort_indices: if True, the rows are gathered in the order of
+            their slots, which reads large and memory-mapped columns in
+            address order. Drawn rows stay in that order, so that the rows of
+            a batch are no longer shuffled; the rows of a given indx are put
+            back in its order.
+        """
+        inverse = None
         if indx is None:
+            if self._sample_indices is None:
+                num_rows = len(self)
+            else:
+                num_rows = len(self._sample_indices)
             if hasattr(self.np_random, 'integers'):
-                indx = self.np_random.integers(len(self), size=batch_size)
+                indx = self.np_random.integers(num_rows, size=batch_size)
             else:
-                indx = self.np_random.randint(len(self), size=batch_size)
-
-        batch = dict()
+                indx = self.np_random.randint(num_rows, size=batch_size)
+            if self._sample_indices is not None:
+                indx = self._sample_indices.indices[indx]
+            if sort_indices:
+                indx = np.sort(indx)
+        elif sort_indices:
+            indx = np.asarray(indx)
+            order = np.argsort(indx, kind='stable')
+            indx = indx[order]
+            inverse = np.argsort(order)
 
         if keys is None:
-            keys = self.dataset_dict.keys()
+            dataset_dict = self.dataset_dict
+        else:
+            dataset_dict = select_keys(self.dataset_dict, keys)
 
-        for k in keys:
-            if isinstance(self.dataset_dict[k], dict):
-                batch[k] = _sample(self.dataset_dict[k], indx)
-            else:
-                batch[k] = self.dataset_dict[k][indx]
+        batch = _sample(dataset_dict, indx, out)
 
+        if inverse is not None:
+            _unpermute(batch, inverse)
         return frozen_dict.freeze(batch)
 
     def split(self, ratio: float) -> Tuple['Dataset', 'Dataset']:
@@ -115,43 +197,219 @@ class Dataset(object):
                                                        index)
         return Dataset(train_dataset_dict), Dataset(test_dataset_dict)
 
+    def _episode_rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        # The rows in insertion order and whether each is a step of an episode.
+        return np.arange(len(self)), np.full((len(self),), True)
+
+    def _trajectory_boundaries_and_returns(
+            self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Starts, ends and returns of the episodes, with the starts and ends
+        as positions into the rows of _episode_rows()."""
+        rows, is_step = self._episode_rows()
+        dones = np.asarray(self.dataset_dict['dones'][rows], dtype=bool)
+        rewards = self.dataset_dict['rewards'][rows]
+        episode_starts, episode_ends = episode_boundaries(dones & is_step)
+        return (episode_starts, episode_ends,
+                episode_returns(np.where(is_step, rewards, 0), episode_starts))
+
+    def filter(self,
+               percentile: Optional[float] = None,
+               threshold: Optional[float] = None,
+               take_top: Optional[float] = None):
+        """Restricts sampling to the episodes with the highest returns.
+
+        Keeps the episodes with returns of at least threshold, or in the top
+        percentile (take_top is an alias) percent. The rows are not copied;
+        sample() draws from an index of the kept ones, which rows inserted
+        into a replay buffer afterwards join. Each call replaces the previous
+        filter.
+        """
+        if take_top is not None:
+            assert percentile is None
+            percentile = take_top
+        assert (percentile is None) != (threshold is None)
+
+        rows, is_step = self._episode_rows()
+        (episode_starts, episode_ends,
+         episode_returns) = self._trajectory_boundaries_and_returns()
+
+        if percentile is not None:
+            threshold = np.percentile(episode_returns, 100 - percentile)
+
+        keep = np.repeat(episode_returns >= threshold,
+                         episode_ends - episode_starts)
+        self._filter_rows(rows[is_step & keep], rows[is_step & ~keep])
+
+    def _filter_rows(self, kept_rows: np.ndarray, removed_rows: np.ndarray):
+        self._sample_indices = IndexSet(self.dataset_len)
+        self._sample_indices.add_many(kept_rows)
+
+    def normalize_returns(self, scaling: float = 1000) -> float:
+        """Scales the rewards in place so that the episode returns span
+        scaling. Returns the factor, for rewards inserted afterwards."""
+        (_, _, episode_returns) = self._trajectory_boundaries_and_returns()
+        factor = scaling / (np.max(episode_returns) - np.min(episode_returns))
+        self.dataset_dict['rewards'] *= factor
+        return float(factor)
+
+    def compute_action_stats(self) -> Dict[str, np.ndarray]:
+        actions = self.dataset_dict['actions'][:len(self)]
+        return {'mean': actions.mean(axis=0), 'std': actions.std(axis=0)}
+
+    def get_iterator(self,
+                     batch_size: int,
+                     keys: Optional[Iterable[str]] = None,
+                     indx: Optional[np.ndarray] = None,
+                     queue_size: int = 2,
+                     num_workers: int = 1,
+                     num_processes: int = 0):
+        """
+        :param num_processes: if positive, batches are sampled in this many
+            processes by a SharedMemorySampler instead of in threads.
+        """
+        return make_iterator(self, self.np_random,
+                             dict(batch_size=batch_size, keys=keys, indx=indx),
+                             queue_size, num_workers, num_processes)
+
+
+def _mixing_weights(mixing_ratio, num_buffers: int) -> np.ndarray:
+    # A float is the probability of the first of two buffers.
+    if np.ndim(mixing_ratio) == 0:
+        assert num_buffers == 2
+        weights = np.array([mixing_ratio, 1 - mixing_ratio], dtype=np.float64)
+    else:
+        weights = np.asarray(mixing_ratio, dtype=np.float64)
+        assert weights.shape == (num_buffers,)
+    assert np.all(weights >= 0) and weights.sum() > 0
+    return weights / weights.sum()
+
+
+def _sub_batch_sizes(weights: np.ndarray, batch_size: int,
+                     deterministic: bool = False) -> np.ndarray:
+    # The sizes are batch_size * weights rounded down, with the rest of the
+    # batch from the last buffer, unless a buffer would get less than one
+    # transition; then they are drawn from the global numpy state.
+    if not deterministic and np.min(weights) * batch_size < 1:
+        return np.random.multinomial(batch_size, weights)
+    sizes = np.floor(batch_size * weights[:-1]).astype(np.int64)
+    return np.append(sizes, batch_size - sizes.sum())
+
+
+def _pooled_action_stats(action_stats, weights: np.ndarray) -> Dict[str, np.ndarray]:
+    # Mean and std of the mixture of the buffers with the mixing weights.
+    means = np.stack([stats['mean'] for stats in action_stats])
+    stds = np.stack([stats['std'] for stats in action_stats])
+    weights = weights.reshape((-1,) + (1,) * (means.ndim - 1))
+    actions_mean = np.sum(weights * means, axis=0)
+    second_moment = np.sum(weights * (stds**2 + means**2), axis=0)
+    actions_std = np.sqrt(np.maximum(second_moment - actions_mean**2, 0))
+    return {'mean': actions_mean, 'std': actions_std}
+
+
+def _is_prioritized(replay_buffer) -> bool:
+    # Whether the batches of replay_buffer have the indx and importance_weights
+    # of a PrioritizedReplayBuffer, inside mixing and property buffers.
+    if hasattr(replay_buffer, 'update_priorities'):
+        return True
+    if hasattr(replay_buffer, 'replay_buffers'):
+        return any(_is_prioritized(b) for b in replay_buffer.replay_buffers)
+    if hasattr(replay_buffer, 'replay_buffer'):
+        return _is_prioritized(replay_buffer.replay_buffer)
+    return False
+
+
+def _sample_unprioritized(replay_buffer, batch_size: int, keys, out=None):
+    # The batch of a buffer mixed with a prioritized one, with indx -1, which
+    # update_priorities() skips, and importance weights of 1.
+    if out is not None:
+        out = {k: v for k, v in out.items() if k not in ('indx', 'importance_weights')}
+    batch = replay_buffer.sample(batch_size, keys, out=out)
+    return batch.copy(add_or_replace=dict(
+        indx=np.full((batch_size,), -1, dtype=np.int64),
+        importance_weights=np.ones((batch_size,), dtype=np.float32)))
+
 
 class MixingReplayBuffer():
 
     def __init__(
             self,
             replay_buffers,
-            mixing_ratio
+            mixing_ratio,
+            mixing_schedule: Optional[Callable[[int], Union[float, Iterable[float]]]] = None
     ):
 
         """
         :param replay_buffers: sample from given replay buffer with specified probability
+        :param mixing_ratio: the probability of the first buffer if there are
+            two, or a weight per buffer.
+        :param mixing_schedule: maps the step passed to set_step() to a
+            mixing_ratio.
         """
 
         self.replay_buffers = replay_buffers
-        self.mixing_ratio = mixing_ratio
-        assert len(replay_buffers) == 2
+        self.mixing_schedule = mixing_schedule
+        self.set_mixing_ratio(mixing_ratio)
+        # Zero-row batches with the schema of the mixed batches, per keys.
+        self._templates = {}
 
     def sample(self,
                batch_size: int,
                keys: Optional[Iterable[str]] = None,
-               indx: Optional[np.ndarray] = None) -> frozen_dict.FrozenDict:
+               indx: Optional[np.ndarray] = None,
+               out: Optional[DatasetDict] = None) -> frozen_dict.FrozenDict:
+        """
+        :param out: preallocated batch that every replay buffer writes its
+            sub-batch into, at its slice, so that nothing is concatenated.
+            Without it, such a batch is allocated once the schema is known
+            from the first batch.
+
+        If a buffer is prioritized, the rows of the others get the indx and
+        importance_weights of unprioritized rows.
+        """
+        sub_batch_sizes = _sub_batch_sizes(self._weights, batch_size)
+        template_key = None if keys is None else tuple(keys)
+        if out is None and template_key in self._templates:
+            out = _empty_like(self._templates[template_key], batch_size)
+
+        prioritized = [_is_prioritized(b) for b in self.replay_buffers]
+        unprioritized = [any(prioritized) and not p for p in prioritized]
+
+        def sample_buffer(i, sb, out=None):
+            if unprioritized[i]:
+                return _sample_unprioritized(self.replay_buffers[i], sb, keys, out=out)
+            return self.replay_buffers[i].sample(sb, keys, out=out)
+
+        if out is not None:
+            start = 0
+            for i, sb in enumerate(sub_batch_sizes):
+                if sb > 0:
+                    sub_out = slice_batch(out, start, start + sb)
+                    copy_into(sample_buffer(i, sb, out=sub_out), sub_out)
+                start += sb
+            return frozen_dict.freeze(out)
 
         batches = []
-        if min(self.mixing_ratio, 1 - self.mixing_ratio) * batch_size < 1:
-            size_first = int(np.random.binomial(n=batch_size, p=self.mixing_ratio))
-        else:
-            size_first = int(np.floor(batch_size*self.mixing_ratio))
-        sub_batch_sizes = [size_first, batch_size - size_first]
-        for buf, sb in zip(self.replay_buffers, sub_batch_sizes):
+        for i, sb in enumerate(sub_batch_sizes):
             if sb > 0:
-                batches.append(buf.sample(sb))
+                batches.append(sample_buffer(i, sb))
         mixed_batch = concat_recursive(batches) if len(batches) > 1 else batches[0]
+        self._templates[template_key] = _empty_like(slice_batch(mixed_batch, 0, 0))
         return frozen_dict.freeze(mixed_batch)
 
     def set_mixing_ratio(self, mixing_ratio):
+        self._weights = _mixing_weights(mixing_ratio, len(self.replay_buffers))
         self.mixing_ratio = mixing_ratio
 
+    def set_replay_buffers(self, replay_buffers):
+        """Replaces the buffers, e.g. by prioritized wrappers of them."""
+        assert len(replay_buffers) == len(self.replay_buffers)
+        self.replay_buffers = replay_buffers
+        self._templates = {}
+
+    def set_step(self, step: int):
+        if self.mixing_schedule is not None:
+            self.set_mixing_ratio(self.mixing_schedule(step))
+
     def seed(self, seed):
         [b.seed(seed) for b in self.replay_buffers]
 
@@ -169,35 +427,25 @@ class MixingReplayBuffer():
                      batch_size: int,
                      keys: Optional[Iterable[str]] = None,
                      indx: Optional[np.ndarray] = None,
-                     queue_size: int = 2):
-        # See https://flax.readthedocs.io/en/latest/_modules/flax/jax_utils.html#prefetch_to_device
-        # queue_size = 2 should be ok for one GPU.
-
-        queue = collections.deque()
-
-        def enqueue(n):
-            for _ in range(n):
-                data = self.sample(batch_size, keys, indx)
-                queue.append(jax.device_put(data))
-
-        enqueue(queue_size)
-        while queue:
-            yield queue.popleft()
-            enqueue(1)
+                     queue_size: int = 2,
+                     num_workers: int = 1,
+                     num_processes: int = 0):
+        return make_iterator(self, self.replay_buffers[0].np_random,
+                             dict(batch_size=batch_size, keys=keys, indx=indx),
+                             queue_size, num_workers, num_processes)
     
     def increment_traj_counter(self):
         [b.increment_traj_counter() for b in self.replay_buffers]
 
-    def compute_action_stats(self):
-
-        action_stats_0 = self.replay_buffers[0].compute_action_stats()
-        action_stats_1 = self.replay_buffers[1].compute_action_stats()
+    def save(self, path: str, wait: bool = False):
+        return [b.save(os.path.join(path, str(i)), wait) for i, b in enumerate(self.replay_buffers)]
 
-        ratio = self.mixing_ratio
-        actions_mean = ratio * action_stats_0['mean'] + (1 - ratio) * action_stats_1['mean']
-        actions_std = np.sqrt(ratio * action_stats_0['std'] ** 2 + (1 - ratio) * action_stats_1['std']** 2 + ratio * (1 - ratio) * (action_stats_0['mean'] - action_stats_1['mean']) ** 2)
+    def load(self, path: str):
+        [b.load(os.path.join(path, str(i))) for i, b in enumerate(self.replay_buffers)]
 
-        return {'mean': actions_mean, 'std': actions_std}
+    def compute_action_stats(self):
+        return _pooled_action_stats(
+            [b.compute_action_stats() for b in self.replay_buffers], self._weights)
 
     def normalize_actions(self, action_stats):
         # do not normalize gripper dimension (last dimension)
@@ -209,35 +457,49 @@ class MixingReplayBufferParallel():
             self,
             replay_buffers,
             mixing_ratio,
-            num_devices=len(jax.devices())
+            num_devices=len(jax.devices()),
+            mixing_schedule: Optional[Callable[[int], Union[float, Iterable[float]]]] = None
     ):
 
         """
         :param replay_buffers: sample from given replay buffer with specified probability
+        :param mixing_ratio: the probability of the first buffer if there are
+            two, or a weight per buffer.
+        :param mixing_schedule: maps the step passed to set_step() to a
+            mixing_ratio.
         """
 
         self.replay_buffers = replay_buffers
-        self.mixing_ratio = mixing_ratio
-        assert len(replay_buffers) == 2
+        self.mixing_schedule = mixing_schedule
+        self.set_mixing_ratio(mixing_ratio)
         self.num_devices=num_devices
 
     def sample(self,
                batch_size: int,
                keys: Optional[Iterable[str]] = None,
-               indx: Optional[np.ndarray] = None) -> frozen_dict.FrozenDict:
+               indx: Optional[np.ndarray] = None,
+               **kwargs) -> frozen_dict.FrozenDict:
+        """
+        :param kwargs: passed to the sample() of every replay buffer, e.g.
+            include_pixels.
+        """
 
         batches = []
-        if min(self.mixing_ratio, 1 - self.mixing_ratio) * batch_size < 1:
-            size_first = int(np.random.binomial(n=batch_size, p=self.mixing_ratio))
-        else:
-            size_first = int(np.floor(batch_size*self.mixing_ratio))
-        sub_batch_sizes = [size_first, batch_size - size_first]
+        sub_batch_sizes = _sub_batch_sizes(self._weights, batch_size)
         for buf, sb in zip(self.replay_buffers, sub_batch_sizes):
             if sb > 0:
-                batches.append(buf.sample(sb))
+                batches.append(buf.sample(sb, keys, **kwargs))
         mixed_batch = concat_recursive(batches) if len(batches) > 1 else batches[0]
         return frozen_dict.freeze(mixed_batch)
 
+    def set_mixing_ratio(self, mixing_ratio):
+        self._weights = _mixing_weights(mixing_ratio, len(self.replay_buffers))
+        self.mixing_ratio = mixing_ratio
+
+    def set_step(self, step: int):
+        if self.mixing_schedule is not None:
+            self.set_mixing_ratio(self.mixing_schedule(step))
+
     def seed(self, seed):
         [b.seed(seed) for b in self.replay_buffers]
         
@@ -255,43 +517,84 @@ class MixingReplayBufferParallel():
                      batch_size: int,
                      keys: Optional[Iterable[str]] = None,
                      indx: Optional[np.ndarray] = None,
-                     queue_size: int = 2):
-        # See https://flax.readthedocs.io/en/latest/_modules/flax/jax_utils.html#prefetch_to_device
-        # queue_size = 2 should be ok for one GPU.
-
-        queue = collections.deque()
-
-        def enqueue(n):
-            assert batch_size % self.num_devices == 0
-            effective_batch_size = batch_size // self.num_devices
-            for _ in range(n):
-                data = [self.sample(effective_batch_size, keys, indx) for _ in range(self.num_devices)]   
-                queue.append(jax.device_put_sharded(data, jax.devices()))
-
-        enqueue(queue_size)
-        while queue:
-            yield queue.popleft()
-            enqueue(1)
-    
+                     queue_size: int = 2,
+                     num_workers: int = 1,
+                     **kwargs):
+        from jaxrl2.data.device_dataset import _put_sharded
+
+        assert batch_size % self.num_devices == 0
+        effective_batch_size = batch_size // self.num_devices
+        devices = jax.devices()[:self.num_devices]
+
+        def sample():
+            return [self.sample(effective_batch_size, keys, indx, **kwargs)
+                    for _ in range(self.num_devices)]
+
+        return PrefetchIterator(
+            sample,
+            queue_size=queue_size,
+            num_workers=num_workers,
+            put_fn=lambda data: _put_sharded(data, devices),
+        )
+
+    def get_sharded_dataset(self, batch_size: int, include_pixels: bool = True):
+        """Places a shard of each replay buffer on every device.
+
+        Returns a MixingDeviceDataset to pass to the pmapped update in place of
+        the batches of get_iterator: every device samples its
+        batch_size // num_devices transitions from its own shards. The
+        replay buffers must not change afterwards, and the sub-batch sizes
+        are fixed, with floor(sub-batch * weight) transitions from every
+        buffer but the last.
+        """
+        from jaxrl2.data.device_dataset import DeviceDataset, MixingDeviceDataset
+
+        assert batch_size % self.num_devices == 0
+        effective_batch_size = batch_size // self.num_devices
+        sub_batch_sizes = _sub_batch_sizes(self._weights, effective_batch_size,
+                                           deterministic=True)
+
+        devices = jax.devices()[:self.num_devices]
+        datasets = tuple(
+            DeviceDataset.from_dataset_sharded(buf, int(sb), include_pixels, devices)
+            for buf, sb in zip(self.replay_buffers, sub_batch_sizes) if sb > 0)
+        return MixingDeviceDataset(datasets=datasets)
+
     def increment_traj_counter(self):
         [b.increment_traj_counter() for b in self.replay_buffers]
 
-    def compute_action_stats(self):
+    def save(self, path: str, wait: bool = False):
+        return [b.save(os.path.join(path, str(i)), wait) for i, b in enumerate(self.replay_buffers)]
 
-        action_stats_0 = self.replay_buffers[0].compute_action_stats()
-        action_stats_1 = self.replay_buffers[1].compute_action_stats()
+    def load(self, path: str):
+        [b.load(os.path.join(path, str(i))) for i, b in enumerate(self.replay_buffers)]
 
-        ratio = self.mixing_ratio
-        actions_mean = ratio * action_stats_0['mean'] + (1 - ratio) * action_stats_1['mean']
-        actions_std = np.sqrt(ratio * action_stats_0['std'] ** 2 + (1 - ratio) * action_stats_1['std']** 2 + ratio * (1 - ratio) * (action_stats_0['mean'] - action_stats_1['mean']) ** 2)
-
-        return {'mean': actions_mean, 'std': actions_std}
+    def compute_action_stats(self):
+        return _pooled_action_stats(
+            [b.compute_action_stats() for b in self.replay_buffers], self._weights)
 
     def normalize_actions(self, action_stats):
         # do not normalize gripper dimension (last dimension)
         [b.normalize_actions(action_stats) for b in self.replay_buffers]
 
 
+def _same_property(value, cached_value: np.ndarray) -> bool:
+    return np.shape(value) == cached_value.shape and np.array_equal(value, cached_value)
+
+
+def _property_column(value, batch_size: int) -> np.ndarray:
+    # Float32 rows repeating the property: arrays get a leading batch axis
+    # and scalars become (batch_size, 1) columns. Read-only, since every
+    # batch shares them.
+    if isinstance(value, np.ndarray):
+        column = np.repeat(value.astype(np.float32)[None], batch_size, axis=0)
+    elif isinstance(value, (float, int, np.number)):
+        column = np.full((batch_size, 1), value, dtype=np.float32)
+    else:
+        assert False, "Unsupported type"
+    column.flags.writeable = False
+    return column
+
 
 """
 Adds additional properties to the dataset.
@@ -309,25 +612,34 @@ class PropertyReplayBuffer():
         """
         self.replay_buffer = replay_buffer
         self.property_dict = property_dict
-
-    def sample(self, batch_size: int, keys: Optional[Iterable[str]] = None, indx: Optional[np.ndarray] = None):
-        batch = self.replay_buffer.sample(batch_size)
-        update_batch = {}
-        for name, value in self.property_dict.items():
-            if isinstance(value, np.ndarray):
-                update_batch[name] = jnp.array(value)
-                update_batch[name] = jnp.expand_dims(batch[name], axis=0).repeat(batch_size, axis=0)
-            elif isinstance(value, float):
-                update_batch[name] = jnp.full((batch_size, 1), value)
-            elif isinstance(value, int):
-                update_batch[name] = jnp.full((batch_size, 1), float(value))
-            else:
-                assert False, "Unsupported type"
-                
-            update_batch[name] = update_batch[name].astype(jnp.float32)
-            batch = batch.copy(add_or_replace=update_batch)
-        
-        return frozen_dict.freeze(batch)
+        self._values = {}
+        self._columns = {}
+
+    def _property_columns(self, batch_size: int) -> DatasetDict:
+        # The columns are built once per batch size and rebuilt only when a
+        # property changes, e.g. when the training loop anneals cql_alpha.
+        if not (self._values.keys() == self.property_dict.keys() and all(
+                _same_property(v, self._values[k]) for k, v in self.property_dict.items())):
+            self._values = {k: np.array(v) for k, v in self.property_dict.items()}
+            self._columns = {}
+        if batch_size not in self._columns:
+            self._columns[batch_size] = {
+                name: _property_column(value, batch_size)
+                for name, value in self.property_dict.items()
+            }
+        return self._columns[batch_size]
+
+    def sample(self, batch_size: int, keys: Optional[Iterable[str]] = None, indx: Optional[np.ndarray] = None,
+               out: Optional[DatasetDict] = None):
+        if out is not None:
+            out = {k: v for k, v in out.items() if k not in self.property_dict}
+        columns = self._property_columns(batch_size)
+        if keys is not None:
+            keys = list(keys)
+            columns = {k: v for k, v in columns.items() if k in keys}
+            keys = [k for k in keys if k not in self.property_dict]
+        batch = self.replay_buffer.sample(batch_size, keys, out=out)
+        return batch.copy(add_or_replace=columns)
 
     def seed(self, seed):
         return self.replay_buffer.seed(seed)
@@ -342,25 +654,22 @@ class PropertyReplayBuffer():
                      batch_size: int,
                      keys: Optional[Iterable[str]] = None,
                      indx: Optional[np.ndarray] = None,
-                     queue_size: int = 2):
-        # See https://flax.readthedocs.io/en/latest/_modules/flax/jax_utils.html#prefetch_to_device
-        # queue_size = 2 should be ok for one GPU.
-
-        queue = collections.deque()
-
-        def enqueue(n):
-            for _ in range(n):
-                data = self.sample(batch_size, keys, indx)
-                queue.append(jax.device_put(data))
-
-        enqueue(queue_size)
-        while queue:
-            yield queue.popleft()
-            enqueue(1)
+                     queue_size: int = 2,
+                     num_workers: int = 1,
+                     num_processes: int = 0):
+        return make_iterator(self, self.replay_buffer.np_random,
+                             dict(batch_size=batch_size, keys=keys, indx=indx),
+                             queue_size, num_workers, num_processes)
     
     def increment_traj_counter(self):
         return self.replay_buffer.increment_traj_counter()
 
+    def save(self, path: str, wait: bool = False):
+        return self.replay_buffer.save(path, wait)
+
+    def load(self, path: str):
+        return self.replay_buffer.load(path)
+
     def compute_action_stats(self):
         return self.replay_buffer.compute_action_stats()
 
@@ -0,0 +1,221 @@
+from typing import Optional, Sequence, Tuple, Union
+
+import flax
+import jax
+import jax.numpy as jnp
+import numpy as np
+from flax.core import frozen_dict
+
+from jaxrl2.data.compressed_frames import CompressedFrames
+from jaxrl2.data.dataset import Dataset, DatasetDict
+from jaxrl2.types import PRNGKey
+
+
+def _slice(dataset_dict: Union[np.ndarray, DatasetDict], start: int, stop: int):
+    # Rows past the end of the dataset are zero padding, so that all shards
+    # have the same shape. Compressed frames are decoded.
+    if isinstance(dataset_dict, (np.ndarray, CompressedFrames)):
+        rows = np.asarray(dataset_dict[max(start, 0) : stop])
+        if len(rows) == stop - start:
+            return rows
+        padded = np.zeros((stop - start, *rows.shape[1:]), dtype=rows.dtype)
+        padded[max(-start, 0) : max(-start, 0) + len(rows)] = rows
+        return padded
+    return {k: _slice(v, start, stop) for k, v in dataset_dict.items()}
+
+
+def _put_sharded(shards, devices: Sequence[jax.Device]):
+    if hasattr(jax, "device_put_sharded"):
+        return jax.device_put_sharded(shards, devices)
+    # Newer jax versions dropped device_put_sharded; pmap accepts arrays
+    # sharded along the leading axis of a one-dimensional mesh instead.
+    sharding = jax.sharding.NamedSharding(
+        jax.sharding.Mesh(np.array(devices), ("devices",)),
+        jax.sharding.PartitionSpec("devices"),
+    )
+    stacked = jax.tree_util.tree_map(lambda *xs: np.stack(xs), *shards)
+    return jax.device_put(stacked, sharding)
+
+
+def _sample_indices(dataset: Dataset) -> Tuple[np.ndarray, int]:
+    # The rows that dataset.sample draws from, and the frames stacked before
+    # each of them.
+    correct_indices = getattr(dataset, "_correct_indices", None)
+    if correct_indices is not None:
+        return np.sort(correct_indices.indices), dataset._num_stack
+    sample_indices = getattr(dataset, "_sample_indices", None)
+    if sample_indices is not None:
+        return np.sort(sample_indices.indices), 0
+    return np.arange(len(dataset)), 0
+
+
+@flax.struct.dataclass
+class DeviceDataset:
+    """A fixed dataset whose columns live on the device.
+
+    Passed to a learner's update in place of a batch, it is sampled inside the
+    jitted update (see sample_device_batch), so that no batch is gathered on
+    the host or copied to the device during offline training. Memory-efficient
+    buffers keep their unstacked frames and the frame stacks are gathered on
+    the device, in the same layout as MemoryEfficientReplayBuffer.sample.
+
+    Iterating over it yields itself, so it can replace the iterator returned by
+    get_iterator in the training loops.
+    """
+
+    dataset_dict: frozen_dict.FrozenDict
+    indices: jnp.ndarray
+    num_indices: jnp.ndarray
+    batch_size: int = flax.struct.field(pytree_node=False)
+    num_stack: int = flax.struct.field(pytree_node=False, default=0)
+    include_pixels: bool = flax.struct.field(pytree_node=False, default=True)
+
+    @classmethod
+    def from_dataset(
+        cls,
+        dataset: Dataset,
+        batch_size: int,
+        include_pixels: bool = True,
+        device: Optional[jax.Device] = None,
+    ) -> "DeviceDataset":
+        """Copies the filled part of a Dataset or ReplayBuffer to the device.
+
+        Only the rows that dataset.sample draws from are sampled, e.g. the
+        episodes kept by Dataset.filter.
+
+        :param include_pixels: as in MemoryEfficientReplayBuffer.sample; if
+            False, observations contain the num_stack + 1 frames and
+            next_observations no pixels.
+        """
+        indices, num_stack = _sample_indices(dataset)
+        assert len(indices) > 0, "Cannot sample from an empty dataset."
+        dataset_dict = _slice(dataset.dataset_dict, 0, len(dataset))
+
+        dataset_dict, indices, num_indices = jax.device_put(
+            (frozen_dict.freeze(dataset_dict), indices.astype(np.int32), np.int32(len(indices))),
+            device,
+        )
+        return cls(
+            dataset_dict=dataset_dict,
+            indices=indices,
+            num_indices=num_indices,
+            batch_size=batch_size,
+            num_stack=num_stack,
+            include_pixels=include_pixels,
+        )
+
+    @classmethod
+    def from_dataset_sharded(
+        cls,
+        dataset: Dataset,
+        batch_size: int,
+        include_pixels: bool = True,
+        devices: Optional[Sequence[jax.Device]] = None,
+    ) -> "DeviceDataset":
+        """Splits a Dataset or ReplayBuffer into one shard per device.
+
+        The leaves have a leading device axis, so that each device of a pmap
+        samples batch_size transitions from its own shard. The shards are
+        contiguous ranges of the sample indices; for memory-efficient buffers
+        they also hold the num_stack frames before their first index.
+        """
+        if devices is None:
+            devices = jax.local_devices()
+        indices, num_stack = _sample_indices(dataset)
+        assert len(indices) >= len(devices), "Every shard needs a sample index."
+
+        parts = np.array_split(indices, len(devices))
+        starts = [part[0] - num_stack for part in parts]
+        shard_len = max(part[-1] + 1 - start for part, start in zip(parts, starts))
+        num_indices = max(len(part) for part in parts)
+
+        shards = []
+        for part, start in zip(parts, starts):
+            shard_indices = np.zeros((num_indices,), dtype=np.int32)
+            shard_indices[: len(part)] = part - start
+            shards.append(
+                (
+                    frozen_dict.freeze(
+                        _slice(dataset.dataset_dict, start, start + shard_len)
+                    ),
+                    shard_indices,
+                    np.int32(len(part)),
+                )
+            )
+        dataset_dict, indices, num_indices = _put_sharded(shards, devices)
+        return cls(
+            dataset_dict=dataset_dict,
+            indices=indices,
+            num_indices=num_indices,
+            batch_size=batch_size,
+            num_stack=num_stack,
+            include_pixels=include_pixels,
+        )
+
+    def __len__(self) -> int:
+        return int(np.sum(self.num_indices))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> "DeviceDataset":
+        return self
+
+    def sample(self, key: PRNGKey) -> frozen_dict.FrozenDict:
+        positions = jax.random.randint(key, (self.batch_size,), 0, self.num_indices)
+        indx = self.indices[positions]
+
+        if self.num_stack == 0:
+            return jax.tree_util.tree_map(lambda x: x[indx], self.dataset_dict)
+
+        dataset_dict = self.dataset_dict.unfreeze()
+        obs_pixels = dataset_dict["observations"].pop("pixels")
+        batch = jax.tree_util.tree_map(lambda x: x[indx], dataset_dict)
+
+        frames = indx[:, None] + jnp.arange(-self.num_stack, 1)
+        obs_pixels = jnp.moveaxis(obs_pixels[frames], 1, -1)
+        if self.include_pixels:
+            batch["observations"]["pixels"] = obs_pixels[..., :-1]
+            batch["next_observations"]["pixels"] = obs_pixels[..., 1:]
+        else:
+            batch["observations"]["pixels"] = obs_pixels
+        return frozen_dict.freeze(batch)
+
+
+@flax.struct.dataclass
+class MixingDeviceDataset:
+    """Concatenates batches sampled from several DeviceDatasets.
+
+    The batch_size of every dataset is its part of the mixed batch.
+    """
+
+    datasets: Tuple[DeviceDataset, ...]
+
+    def __len__(self) -> int:
+        return sum(len(dataset) for dataset in self.datasets)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> "MixingDeviceDataset":
+        return self
+
+    def sample(self, key: PRNGKey) -> frozen_dict.FrozenDict:
+        keys = jax.random.split(key, len(self.datasets))
+        batches = [dataset.sample(k) for dataset, k in zip(self.datasets, keys)]
+        return jax.tree_util.tree_map(lambda *xs: jnp.concatenate(xs), *batches)
+
+
+def sample_device_batch(
+    rng: PRNGKey,
+    batch: Union[DeviceDataset, MixingDeviceDataset, frozen_dict.FrozenDict],
+) -> Tuple[PRNGKey, frozen_dict.FrozenDict]:
+    """Samples the batch inside a jitted or pmapped update if it is a
+    DeviceDataset or a MixingDeviceDataset.
+
+    Other batches are returned unchanged, together with the unchanged rng.
+    """
+    if isinstance(batch, (DeviceDataset, MixingDeviceDataset)):
+        rng, key = jax.random.split(rng)
+        batch = batch.sample(key)
+    return rng, batch
@@ -0,0 +1,165 @@
+import json
+import os
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from flax import traverse_util
+
+from jaxrl2.data.dataset import DatasetDict, _check_lengths
+
+_INDEX_FILE = "index.json"
+_OFFSETS_FILE = "episode_offsets.npy"
+
+
+def is_episode_store(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, _INDEX_FILE))
+
+
+def _chunk_file(path: str, column: str, chunk: int) -> str:
+    return os.path.join(path, *column.split("/"), f"{chunk:06d}.npy")
+
+
+class EpisodeStoreWriter(object):
+    """Writes episodes into a chunked columnar store.
+
+    Every column (e.g. "observations/pixels") is a directory of .npy files with
+    chunk_size rows each, so that a reader can memory-map single chunks. Episodes
+    are concatenated along the rows; index.json holds the column specs and
+    user metadata, episode_offsets.npy the first row of every episode.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 4096, metadata: Optional[dict] = None):
+        if is_episode_store(path):
+            raise FileExistsError(f"{path} already contains an episode store.")
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._chunk_size = chunk_size
+        self._metadata = metadata or {}
+
+        self._columns = None
+        self._pending = {}
+        self._num_pending = 0
+        self._num_chunks = 0
+        self._offsets = [0]
+
+    def add_episode(self, episode: DatasetDict):
+        episode_len = _check_lengths(episode)
+        columns = traverse_util.flatten_dict(episode, sep="/")
+        if self._columns is None:
+            self._columns = {
+                k: dict(dtype=np.asarray(v).dtype.str, shape=list(np.shape(v)[1:]))
+                for k, v in columns.items()
+            }
+            self._pending = {k: [] for k in columns}
+        assert columns.keys() == self._columns.keys(), "Inconsistent episode keys."
+
+        for k, v in columns.items():
+            self._pending[k].append(np.asarray(v, dtype=self._columns[k]["dtype"]))
+        self._num_pending += episode_len
+        self._offsets.append(self._offsets[-1] + episode_len)
+
+        while self._num_pending >= self._chunk_size:
+            self._write_chunk(self._chunk_size)
+
+    def _write_chunk(self, num_rows: int):
+        for k, pending in self._pending.items():
+            rows = np.concatenate(pending, axis=0)
+            filename = _chunk_file(self._path, k, self._num_chunks)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            np.save(filename, rows[:num_rows])
+            self._pending[k] = [rows[num_rows:]]
+        self._num_pending -= num_rows
+        self._num_chunks += 1
+
+    def close(self):
+        if self._num_pending > 0:
+            self._write_chunk(self._num_pending)
+        np.save(os.path.join(self._path, _OFFSETS_FILE), np.asarray(self._offsets, dtype=np.int64))
+        with open(os.path.join(self._path, _INDEX_FILE), "w") as f:
+            json.dump(
+                dict(
+                    columns=self._columns or {},
+                    chunk_size=self._chunk_size,
+                    num_chunks=self._num_chunks,
+                    metadata=self._metadata,
+                ),
+                f,
+                indent=2,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Without an index, an interrupted conversion is not mistaken for a store.
+        if exc_type is None:
+            self.close()
+
+
+class EpisodeStore(object):
+    """Lazy reader for stores written by EpisodeStoreWriter.
+
+    Opening a store reads only the index. Chunks are memory-mapped on first
+    use, so loading some episodes and columns reads only their rows.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, _INDEX_FILE)) as f:
+            index = json.load(f)
+        self._path = path
+        self._columns = index["columns"]
+        self._chunk_size = index["chunk_size"]
+        self.metadata = index["metadata"]
+        self._offsets = np.load(os.path.join(path, _OFFSETS_FILE))
+        self._chunks = {}
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @property
+    def keys(self) -> list:
+        return list(self._columns.keys())
+
+    @property
+    def episode_lengths(self) -> np.ndarray:
+        return np.diff(self._offsets)
+
+    def _chunk(self, column: str, chunk: int) -> np.ndarray:
+        if (column, chunk) not in self._chunks:
+            self._chunks[(column, chunk)] = np.load(
+                _chunk_file(self._path, column, chunk), mmap_mode="r"
+            )
+        return self._chunks[(column, chunk)]
+
+    def _read_rows(self, column: str, start: int, end: int) -> np.ndarray:
+        spec = self._columns[column]
+        rows = np.empty((end - start, *spec["shape"]), dtype=spec["dtype"])
+        position = start
+        while position < end:
+            chunk, offset = divmod(position, self._chunk_size)
+            num_rows = min(end - position, self._chunk_size - offset)
+            rows[position - start : position - start + num_rows] = self._chunk(
+                column, chunk
+            )[offset : offset + num_rows]
+            position += num_rows
+        return rows
+
+    def get_episode(self, indx: int, keys: Optional[Iterable[str]] = None) -> DatasetDict:
+        """Returns episode indx as a nested dict of arrays.
+
+        :param keys: flat column names (e.g. "observations/pixels") to read;
+            all columns by default.
+        """
+        if keys is None:
+            keys = self._columns.keys()
+        start, end = self._offsets[indx], self._offsets[indx + 1]
+        columns = {k: self._read_rows(k, start, end) for k in keys}
+        return traverse_util.unflatten_dict(columns, sep="/")
+
+    def get_episodes(
+        self, indxs: Optional[Iterable[int]] = None, keys: Optional[Iterable[str]] = None
+    ) -> Iterator[DatasetDict]:
+        if indxs is None:
+            indxs = range(len(self))
+        for indx in indxs:
+            yield self.get_episode(indx, keys)
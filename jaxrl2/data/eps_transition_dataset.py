@@ -5,28 +5,19 @@ import numpy as np
 import os
 import gc
 import jax
-from jaxrl2.data.dataset import Dataset
+from jaxrl2.data.dataset import Dataset, _check_lengths, _sample
+from jaxrl2.data.episode_store import EpisodeStore, is_episode_store
+from jaxrl2.data.return_utils import discounted_returns
 import tqdm
 import jax.numpy as jnp
 
-RETURN_TO_GO_DICT = dict()
-
-
 def calc_return_to_go(rewards, masks=None, gamma=0.99):
     if masks is None:
         masks = rewards
-    global RETURN_TO_GO_DICT
-    rewards_str = str(rewards) + str(masks) + str(gamma)
-    if rewards_str in RETURN_TO_GO_DICT.keys():
-        reward_to_go = RETURN_TO_GO_DICT[rewards_str]
-    else:
-        reward_to_go = [0] * len(rewards)
-        prev_return = rewards[-1] / (1 - gamma)
-        for i in range(len(rewards)):
-            reward_to_go[-i - 1] = rewards[-i - 1] + gamma * prev_return * masks[-i - 1]
-            prev_return = reward_to_go[-i - 1]
-        RETURN_TO_GO_DICT[rewards_str] = reward_to_go
-    return reward_to_go
+    rewards = np.asarray(rewards)
+    return discounted_returns(
+        rewards, gamma, masks=masks, bootstrap_last=True
+    ).reshape(rewards.shape)
 
 
 def is_dict_like(x):
@@ -98,9 +89,7 @@ def append_all_dicts(dict_list):
     return return_dict
 
 
-def reformat_nested_dict(
-    concat_dict, addition, remapping={}, obs_remapping={}, add_framestack_dim=True
-):
+def episode_to_columns(addition):
     # convert addition to correct format
     new_format_dict = {}
     for k in addition.keys():
@@ -116,7 +105,12 @@ def reformat_nested_dict(
                 if k not in new_format_dict.keys():
                     new_format_dict[k] = []
                 new_format_dict[k].append(addition[k][i])
-    new_format_dict = npify_dict(new_format_dict)
+    return npify_dict(new_format_dict)
+
+
+def remap_columns(
+    new_format_dict, remapping={}, obs_remapping={}, add_framestack_dim=True
+):
     # now remap and append
     new_format_dict = remap_dict(new_format_dict, remapping)
     new_format_dict["observations"] = remap_dict(
@@ -135,6 +129,131 @@ def reformat_nested_dict(
     return new_format_dict
 
 
+def reformat_nested_dict(
+    concat_dict, addition, remapping={}, obs_remapping={}, add_framestack_dim=True
+):
+    return remap_columns(
+        episode_to_columns(addition),
+        remapping=remapping,
+        obs_remapping=obs_remapping,
+        add_framestack_dim=add_framestack_dim,
+    )
+
+
+class _FlatColumns(object):
+    # Nested columns that episodes are copied into, grown geometrically so
+    # that every row is copied O(1) times.
+
+    def __init__(self):
+        self._columns = None
+        self._capacity = 0
+        self._num_rows = 0
+
+    def _reserve(self, template: dict, num_rows: int, expected_rows: int) -> int:
+        # Returns the first of num_rows new rows of columns like template.
+        if self._num_rows + num_rows > self._capacity:
+            capacity = max(2 * self._capacity, self._num_rows + num_rows, expected_rows)
+            columns = _allocate_like(template, capacity)
+            if self._columns is not None:
+                _copy_rows(columns, _sample(self._columns, np.s_[: self._num_rows]), 0)
+            self._columns = columns
+            self._capacity = capacity
+        offset = self._num_rows
+        self._num_rows += num_rows
+        return offset
+
+    def append(self, episode: dict, expected_rows: int):
+        num_rows = _check_lengths(episode)
+        offset = self._reserve(episode, num_rows, expected_rows)
+        _copy_rows(self._columns, episode, offset)
+
+    def append_steps(self, episode: dict, layout: "_StepLayout", expected_rows: int):
+        # Writes a raw episode, whose observations are lists of per-step
+        # dicts, straight into the columns, converted as by
+        # reformat_nested_dict but without building per-step lists first.
+        num_rows = len(episode["rewards"])
+        offset = self._reserve(layout.template, num_rows, expected_rows)
+        for key, subkey, path, channels in layout.values:
+            column = self._columns
+            for k in path:
+                column = column[k]
+            if layout.add_framestack_dim and key in _OBSERVATION_KEYS:
+                column = column[..., 0]
+            if channels is not None:
+                column = column[..., channels]
+            if subkey is None:
+                column[offset : offset + num_rows] = episode[key]
+            else:
+                for t, step in enumerate(episode[key]):
+                    column[offset + t] = step[subkey]
+
+    def columns(self) -> dict:
+        # Views; the unused rows at the end were never written, so their
+        # pages are not committed.
+        return _sample(self._columns, np.s_[: self._num_rows])
+
+
+_OBSERVATION_KEYS = ("observations", "next_observations")
+
+
+class _StepLayout(object):
+    # Where every value of the steps of a raw episode goes in the columns:
+    # (key, subkey of a per-step dict or None, column path, channels of the
+    # column or None), with values remapped to the same column concatenated
+    # along the last axis, in order. template has empty columns of that layout.
+
+    def __init__(self, episode: dict, remapping={}, obs_remapping={}, add_framestack_dim=True):
+        self.add_framestack_dim = add_framestack_dim
+        sources = {}
+        for key, values in episode.items():
+            if is_dict_like(values[0]):
+                for subkey, value in values[0].items():
+                    name = obs_remapping.get(subkey, subkey) if key in _OBSERVATION_KEYS else subkey
+                    sources.setdefault((remapping.get(key, key), name), []).append(
+                        (key, subkey, np.asarray(value)))
+            else:
+                value = np.asarray(values)
+                sources.setdefault((remapping.get(key, key), None), []).append((key, None, value[0]))
+
+        self.values = []
+        self.template = {}
+        for (column_key, name), values in sources.items():
+            path = (column_key,) if name is None else (column_key, name)
+            shapes = [value.shape for _, _, value in values]
+            dtype = np.result_type(*[value.dtype for _, _, value in values])
+            if len(values) == 1:
+                key, subkey, _ = values[0]
+                shape = shapes[0]
+                self.values.append((key, subkey, path, None))
+            else:
+                start = 0
+                for (key, subkey, _), value_shape in zip(values, shapes):
+                    stop = start + value_shape[-1]
+                    self.values.append((key, subkey, path, slice(start, stop)))
+                    start = stop
+                shape = (*shapes[0][:-1], start)
+            if add_framestack_dim and values[0][0] in _OBSERVATION_KEYS:
+                shape = (*shape, 1)
+            node = self.template
+            for k in path[:-1]:
+                node = node.setdefault(k, {})
+            node[path[-1]] = np.empty((0, *shape), dtype=dtype)
+
+
+def _allocate_like(columns: dict, capacity: int) -> dict:
+    if is_dict_like(columns):
+        return {k: _allocate_like(v, capacity) for k, v in columns.items()}
+    return np.empty((capacity, *columns.shape[1:]), dtype=columns.dtype)
+
+
+def _copy_rows(columns: dict, rows: dict, offset: int):
+    for k, v in rows.items():
+        if is_dict_like(v):
+            _copy_rows(columns[k], v, offset)
+        else:
+            columns[k][offset : offset + len(v)] = v
+
+
 class EpisodicTransitionDataset(Dataset):
     def __init__(
         self,
@@ -145,7 +264,14 @@ class EpisodicTransitionDataset(Dataset):
         max_traj_per_buffer=200,
         filter_success=False,
         success_reward_filter=1,
+        lean=False,
     ):
+        """
+        :param lean: write the steps of every episode straight into
+            preallocated flat columns and drop its raw episode right away,
+            instead of keeping the raw episodes in self.episodes and
+            concatenating the converted ones at the end.
+        """
         if isinstance(paths, str):
             paths = [paths]
         assert isinstance(paths, list)
@@ -154,26 +280,36 @@ class EpisodicTransitionDataset(Dataset):
         self.episodes = []
         new_format_dicts = []
         self.episode_as_dict = None
+        flat_columns = _FlatColumns()
+        step_layout = None
 
         self.episodes_lens = []
         for path in paths:
             assert os.path.exists(path), f"Path {path} does not exist"
             print("Loading data from", path)
 
-            try:
-                data = np.load(path, allow_pickle=True).tolist()
-            except:
-                continue # skip this path
+            if is_episode_store(path):
+                # Converted with examples/convert_offline_dataset.py; only the
+                # kept trajectories are read, already in columnar format.
+                store = EpisodeStore(path)
+                data = list(store.get_episodes(range(min(len(store), max_traj_per_buffer))))
+            else:
+                try:
+                    data = np.load(path, allow_pickle=True).tolist()
+                except:
+                    continue # skip this path
 
-            self.episodes.extend(data)
+            if not lean:
+                self.episodes.extend(data)
 
             succ = []
             num_traj = min(len(data), max_traj_per_buffer)
             for i in tqdm.tqdm(range(num_traj)):
                 rews = np.array(data[i]["rewards"])
 
-                data[i]["mc_returns"] = calc_return_to_go(rews)
-                data[i]["masks"] = np.ones_like(np.array(data[i]["terminals"]))
+                if "mc_returns" not in data[i]:
+                    data[i]["mc_returns"] = calc_return_to_go(rews)
+                    data[i]["masks"] = np.ones_like(np.array(data[i]["terminals"]))
 
                 succ.append(rews.max() >= success_reward_filter)
                 if filter_success and rews.max() < success_reward_filter:
@@ -181,62 +317,61 @@ class EpisodicTransitionDataset(Dataset):
 
                 self.episodes_lens.append(len(rews))
 
-                new_format_dict = reformat_nested_dict(
-                    self.episode_as_dict,
-                    data[i],
-                    remapping=remapping,
-                    obs_remapping=obs_remapping,
-                    add_framestack_dim=add_framestack_dim,
-                )
-                new_format_dicts.append(new_format_dict)
+                expected_rows = len(rews) * num_traj * len(paths)
+                if is_episode_store(path):
+                    new_format_dict = remap_columns(
+                        data[i],
+                        remapping=remapping,
+                        obs_remapping=obs_remapping,
+                        add_framestack_dim=add_framestack_dim,
+                    )
+                elif lean:
+                    if step_layout is None:
+                        step_layout = _StepLayout(
+                            data[i], remapping, obs_remapping, add_framestack_dim
+                        )
+                    flat_columns.append_steps(data[i], step_layout, expected_rows)
+                    data[i] = None
+                    continue
+                else:
+                    new_format_dict = reformat_nested_dict(
+                        self.episode_as_dict,
+                        data[i],
+                        remapping=remapping,
+                        obs_remapping=obs_remapping,
+                        add_framestack_dim=add_framestack_dim,
+                    )
+                if lean:
+                    flat_columns.append(new_format_dict, expected_rows)
+                    data[i] = None
+                else:
+                    new_format_dicts.append(new_format_dict)
 
             print("Success rate:", np.mean(succ))
             gc.collect()
         
-        self.episode_as_dict = append_all_dicts(new_format_dicts)
+        if lean:
+            self.episode_as_dict = flat_columns.columns()
+        else:
+            self.episode_as_dict = append_all_dicts(new_format_dicts)
         self.episodes_lens = np.array(self.episodes_lens)
+        self.episodes_starts = np.cumsum(self.episodes_lens) - self.episodes_lens
         self.episodes = np.array(self.episodes)
         super().__init__(self.episode_as_dict)
 
-        print("Total number of episodes:", len(self.episodes))
+        print("Total number of episodes:", len(self.episodes_lens))
         
     def get_random_trajs(self, num_trajs):
-        trajs = []
-        for _ in range(num_trajs):
-            traj = self.episodes[np.random.randint(len(self.episodes))]
-            trajs.append(traj)
-        
-        new_format_dict = {}
-        for k in traj.keys():
-            new_format_dict[k] = []
-            for i in range(len(trajs)):
-                new_format_dict[k].append(trajs[i][k])
-        
-        new_format_dict = npify_dict(new_format_dict)
-        
-        return new_format_dict
-
-    def get_iterator(
-        self,
-        batch_size: int,
-        keys: Optional[Iterable[str]] = None,
-        indx: Optional[np.ndarray] = None,
-        queue_size: int = 2,
-    ):
-        # See https://flax.readthedocs.io/en/latest/_modules/flax/jax_utils.html#prefetch_to_device
-        # queue_size = 2 should be ok for one GPU.
-
-        queue = deque()
-
-        def enqueue(n):
-            for _ in range(n):
-                data = self.sample(batch_size, keys, indx)
-                queue.append(jax.device_put(data))
-
-        enqueue(queue_size)
-        while queue:
-            yield queue.popleft()
-            enqueue(1)
+        """Samples converted episodes, as lists of views per key."""
+        if hasattr(self.np_random, "integers"):
+            indxs = self.np_random.integers(len(self.episodes_lens), size=num_trajs)
+        else:
+            indxs = self.np_random.randint(len(self.episodes_lens), size=num_trajs)
+        trajs = [
+            _sample(self.dataset_dict, np.s_[start : start + length])
+            for start, length in zip(self.episodes_starts[indxs], self.episodes_lens[indxs])
+        ]
+        return {k: [traj[k] for traj in trajs] for k in self.dataset_dict}
 
 
 def main():
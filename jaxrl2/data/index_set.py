@@ -0,0 +1,72 @@
+import numpy as np
+
+
+class IndexSet(object):
+    """A set of slots in [0, capacity) stored as a dense array.
+
+    Supports O(1) insertion and removal (swap with the last element) and
+    uniform sampling with a single vectorized draw.
+    """
+
+    def __init__(self, capacity: int):
+        self._indices = np.empty((capacity,), dtype=np.int64)
+        self._positions = np.full((capacity,), -1, dtype=np.int64)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, indx: int) -> bool:
+        return self._positions[indx] >= 0
+
+    @property
+    def indices(self) -> np.ndarray:
+        return self._indices[: self._size]
+
+    def add(self, indx: int):
+        if self._positions[indx] >= 0:
+            return
+        self._indices[self._size] = indx
+        self._positions[indx] = self._size
+        self._size += 1
+
+    def discard(self, indx: int):
+        position = self._positions[indx]
+        if position < 0:
+            return
+        last = self._indices[self._size - 1]
+        self._indices[position] = last
+        self._positions[last] = position
+        self._positions[indx] = -1
+        self._size -= 1
+
+    def add_many(self, indxs: np.ndarray):
+        indxs = np.unique(np.asarray(indxs, dtype=np.int64))
+        indxs = indxs[self._positions[indxs] < 0]
+        new_size = self._size + len(indxs)
+        self._indices[self._size : new_size] = indxs
+        self._positions[indxs] = np.arange(self._size, new_size)
+        self._size = new_size
+
+    def discard_many(self, indxs: np.ndarray):
+        indxs = np.unique(np.asarray(indxs, dtype=np.int64))
+        positions = self._positions[indxs]
+        indxs, positions = indxs[positions >= 0], positions[positions >= 0]
+        if len(indxs) == 0:
+            return
+
+        new_size = self._size - len(indxs)
+        self._positions[indxs] = -1
+
+        # Removed elements leave holes in the kept prefix; fill them with the
+        # surviving elements of the tail.
+        holes = positions[positions < new_size]
+        tail = self._indices[new_size : self._size]
+        movers = tail[self._positions[tail] >= 0]
+        self._indices[holes] = movers
+        self._positions[movers] = holes
+        self._size = new_size
+
+    def clear(self):
+        self._positions[self.indices] = -1
+        self._size = 0
@@ -4,6 +4,10 @@ import numpy as np
 from flax.core import frozen_dict
 from gym.utils import seeding
 
+from jaxrl2.data.batch_pool import take_rows
+from jaxrl2.data.compressed_frames import CompressedFrames
+from jaxrl2.data.index_set import IndexSet
+from jaxrl2.data.return_utils import episode_boundaries, episode_returns
 from jaxrl2.types import DataType
 
 DatasetDict = Dict[str, DataType]
@@ -13,7 +17,7 @@ def _check_lengths(dataset_dict: DatasetDict, dataset_len: Optional[int] = None)
     for v in dataset_dict.values():
         if isinstance(v, dict):
             dataset_len = dataset_len or _check_lengths(v, dataset_len)
-        elif isinstance(v, np.ndarray):
+        elif isinstance(v, (np.ndarray, CompressedFrames)):
             item_len = len(v)
             dataset_len = dataset_len or item_len
             assert dataset_len == item_len, "Inconsistent item lengths in the dataset."
@@ -27,7 +31,7 @@ def _subselect(dataset_dict: DatasetDict, index: np.ndarray) -> DatasetDict:
     for k, v in dataset_dict.items():
         if isinstance(v, dict):
             new_v = _subselect(v, index)
-        elif isinstance(v, np.ndarray):
+        elif isinstance(v, (np.ndarray, CompressedFrames)):
             new_v = v[index]
         else:
             raise TypeError("Unsupported type.")
@@ -36,23 +40,77 @@ def _subselect(dataset_dict: DatasetDict, index: np.ndarray) -> DatasetDict:
 
 
 def _sample(
-    dataset_dict: Union[np.ndarray, DatasetDict], indx: np.ndarray
+    dataset_dict: Union[np.ndarray, DatasetDict],
+    indx: np.ndarray,
+    out: Optional[Union[np.ndarray, DatasetDict]] = None,
 ) -> DatasetDict:
-    if isinstance(dataset_dict, np.ndarray):
-        return dataset_dict[indx]
+    # With out, the rows are gathered into the preallocated arrays of out.
+    # Columns missing from out, e.g. empty dicts of a flattened batch, are
+    # allocated.
+    if isinstance(dataset_dict, (np.ndarray, CompressedFrames)):
+        if out is None:
+            return dataset_dict[indx]
+        return take_rows(dataset_dict, indx, out)
     elif isinstance(dataset_dict, dict):
         batch = {}
         for k, v in dataset_dict.items():
-            batch[k] = _sample(v, indx)
+            batch[k] = _sample(v, indx, None if out is None else out.get(k))
     else:
         raise TypeError("Unsupported type.")
     return batch
 
 
+def _key_tree(keys: Iterable[str]) -> Dict[str, Optional[dict]]:
+    # Nests column names, e.g. "observations/pixels", into a tree whose None
+    # leaves select whole columns or dicts of columns.
+    tree = {}
+    for key in keys:
+        node = tree
+        *parents, name = key.split("/")
+        for parent in parents:
+            if node.get(parent, {}) is None:
+                break
+            node = node.setdefault(parent, {})
+        else:
+            node[name] = None
+    return tree
+
+
+def _select(
+    dataset_dict: DatasetDict, key_tree: Dict[str, Optional[dict]]
+) -> DatasetDict:
+    # The columns of key_tree, without copying them.
+    return {
+        k: dataset_dict[k] if sub_tree is None else _select(dataset_dict[k], sub_tree)
+        for k, sub_tree in key_tree.items()
+    }
+
+
+def select_keys(dataset_dict: DatasetDict, keys: Iterable[str]) -> DatasetDict:
+    """The columns named by keys, where nested columns are named by their
+    path, e.g. "observations/pixels", and a dict by its name."""
+    return _select(dataset_dict, _key_tree(keys))
+
+
+def _unpermute(batch: DatasetDict, inverse: np.ndarray) -> DatasetDict:
+    # Rows gathered at indx[order] are put back in the order of indx, in
+    # place, with inverse the inverse permutation of order. Gathering the
+    # rows is faster than scattering them into the strided stacks of a
+    # sliding window.
+    if isinstance(batch, np.ndarray):
+        batch[...] = batch[inverse]
+    else:
+        for v in batch.values():
+            _unpermute(v, inverse)
+    return batch
+
+
 class Dataset(object):
     def __init__(self, dataset_dict: DatasetDict, seed: Optional[int] = None):
         self.dataset_dict = dataset_dict
         self.dataset_len = _check_lengths(dataset_dict)
+        # Rows that sample() draws from once filter() was called.
+        self._sample_indices = None
 
         # Seeding similar to OpenAI Gym:
         # https://github.com/openai/gym/blob/master/gym/spaces/space.py#L46
@@ -78,24 +136,49 @@ class Dataset(object):
         batch_size: int,
         keys: Optional[Iterable[str]] = None,
         indx: Optional[np.ndarray] = None,
+        out: Optional[DatasetDict] = None,
+        sort_indices: bool = False,
     ) -> frozen_dict.FrozenDict:
+        """
+        :param keys: the columns to gather; nested columns are named by
+            their path, e.g. "observations/pixels". All columns if None.
+        :param out: preallocated batch, e.g. from a BatchPool, that the rows
+            are gathered into instead of new arrays.
+        :param sort_indices: if True, the rows are gathered in the order of
+            their slots, which reads large and memory-mapped columns in
+            address order. Drawn rows stay in that order, so that the rows of
+            a batch are no longer shuffled; the rows of a given indx are put
+            back in its order.
+        """
+        inverse = None
         if indx is None:
+            if self._sample_indices is None:
+                num_rows = len(self)
+            else:
+                num_rows = len(self._sample_indices)
             if hasattr(self.np_random, "integers"):
-                indx = self.np_random.integers(len(self), size=batch_size)
+                indx = self.np_random.integers(num_rows, size=batch_size)
             else:
-                indx = self.np_random.randint(len(self), size=batch_size)
-
-        batch = dict()
+                indx = self.np_random.randint(num_rows, size=batch_size)
+            if self._sample_indices is not None:
+                indx = self._sample_indices.indices[indx]
+            if sort_indices:
+                indx = np.sort(indx)
+        elif sort_indices:
+            indx = np.asarray(indx)
+            order = np.argsort(indx, kind="stable")
+            indx = indx[order]
+            inverse = np.argsort(order)
 
         if keys is None:
-            keys = self.dataset_dict.keys()
+            dataset_dict = self.dataset_dict
+        else:
+            dataset_dict = select_keys(self.dataset_dict, keys)
 
-        for k in keys:
-            if isinstance(self.dataset_dict[k], dict):
-                batch[k] = _sample(self.dataset_dict[k], indx)
-            else:
-                batch[k] = self.dataset_dict[k][indx]
+        batch = _sample(dataset_dict, indx, out)
 
+        if inverse is not None:
+            _unpermute(batch, inverse)
         return frozen_dict.freeze(batch)
 
     def split(self, ratio: float) -> Tuple["Dataset", "Dataset"]:
@@ -112,32 +195,45 @@ class Dataset(object):
         test_dataset_dict = _subselect(self.dataset_dict, test_index)
         return Dataset(train_dataset_dict), Dataset(test_dataset_dict)
 
-    def _trajectory_boundaries_and_returns(self) -> Tuple[list, list, list]:
-        episode_starts = [0]
-        episode_ends = []
-
-        episode_return = 0
-        episode_returns = []
+    def _episode_rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        # The rows in insertion order and whether each is a step of an episode.
+        return np.arange(len(self)), np.full((len(self),), True)
 
-        for i in range(len(self)):
-            episode_return += self.dataset_dict["rewards"][i]
-
-            if self.dataset_dict["dones"][i]:
-                episode_returns.append(episode_return)
-                episode_ends.append(i + 1)
-                if i + 1 < len(self):
-                    episode_starts.append(i + 1)
-                episode_return = 0.0
-
-        return episode_starts, episode_ends, episode_returns
+    def _trajectory_boundaries_and_returns(
+        self,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Starts, ends and returns of the episodes, with the starts and ends
+        as positions into the rows of _episode_rows()."""
+        rows, is_step = self._episode_rows()
+        dones = np.asarray(self.dataset_dict["dones"][rows], dtype=bool)
+        rewards = self.dataset_dict["rewards"][rows]
+        episode_starts, episode_ends = episode_boundaries(dones & is_step)
+        return (
+            episode_starts,
+            episode_ends,
+            episode_returns(np.where(is_step, rewards, 0), episode_starts),
+        )
 
     def filter(
-        self, percentile: Optional[float] = None, threshold: Optional[float] = None
+        self,
+        percentile: Optional[float] = None,
+        threshold: Optional[float] = None,
+        take_top: Optional[float] = None,
     ):
-        assert (percentile is None and threshold is not None) or (
-            percentile is not None and threshold is None
-        )
-
+        """Restricts sampling to the episodes with the highest returns.
+
+        Keeps the episodes with returns of at least threshold, or in the top
+        percentile (take_top is an alias) percent. The rows are not copied;
+        sample() draws from an index of the kept ones, which rows inserted
+        into a replay buffer afterwards join. Each call replaces the previous
+        filter.
+        """
+        if take_top is not None:
+            assert percentile is None
+            percentile = take_top
+        assert (percentile is None) != (threshold is None)
+
+        rows, is_step = self._episode_rows()
         (
             episode_starts,
             episode_ends,
@@ -147,19 +243,17 @@ class Dataset(object):
         if percentile is not None:
             threshold = np.percentile(episode_returns, 100 - percentile)
 
-        bool_indx = np.full((len(self),), False, dtype=bool)
+        keep = np.repeat(episode_returns >= threshold, episode_ends - episode_starts)
+        self._filter_rows(rows[is_step & keep], rows[is_step & ~keep])
 
-        for i in range(len(episode_returns)):
-            if episode_returns[i] >= threshold:
-                bool_indx[episode_starts[i] : episode_ends[i]] = True
+    def _filter_rows(self, kept_rows: np.ndarray, removed_rows: np.ndarray):
+        self._sample_indices = IndexSet(self.dataset_len)
+        self._sample_indices.add_many(kept_rows)
 
-        self.dataset_dict = _subselect(self.dataset_dict, bool_indx)
-
-        self.dataset_len = _check_lengths(self.dataset_dict)
-
-    def normalize_returns(self, scaling: float = 1000):
+    def normalize_returns(self, scaling: float = 1000) -> float:
+        """Scales the rewards in place so that the episode returns span
+        scaling. Returns the factor, for rewards inserted afterwards."""
         (_, _, episode_returns) = self._trajectory_boundaries_and_returns()
-        self.dataset_dict["rewards"] /= np.max(episode_returns) - np.min(
-            episode_returns
-        )
-        self.dataset_dict["rewards"] *= scaling
+        factor = scaling / (np.max(episode_returns) - np.min(episode_returns))
+        self.dataset_dict["rewards"] *= factor
+        return float(factor)
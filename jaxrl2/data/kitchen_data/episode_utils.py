@@ -0,0 +1,142 @@
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from jaxrl2.data.episode_store import EpisodeStore
+from jaxrl2.data.kitchen_data.dataset import DatasetDict
+from jaxrl2.data.return_utils import discounted_returns
+
+
+def get_task_list(task: str) -> List[str]:
+    if task == "indistribution":
+        tasks_list = ['microwave', 'kettle', 'light switch', 'slide cabinet']
+    elif task == "outofdistribution":
+        tasks_list = ['microwave', 'kettle', "bottom burner", 'light switch']
+    else:
+        raise ValueError(f"Unsupported task: \"{task}\".")
+
+    return tasks_list
+
+
+def read_episode_file(episode_file: str, tasks_list: Optional[List[str]] = None) -> DatasetDict:
+    """Reads the numeric arrays of an offline .npz episode.
+
+    If tasks_list is given, the reward is the sum of the rewards of these tasks
+    and the per-task entries are dropped.
+    """
+    with open(episode_file, 'rb') as f:
+        episode = np.load(f, allow_pickle=True)
+
+        def keep(k):
+            return (
+                k not in ['image_128']
+                and "metadata" not in k
+                and "str" not in episode[k].dtype.name
+                and episode[k].dtype != object
+            )
+
+        if tasks_list is None:
+            return {k: episode[k] for k in episode.keys() if keep(k)}
+
+        if "reward" in episode:
+            rewards = episode["reward"]
+        else:
+            rewards = sum([episode[f"reward {obj}"] for obj in tasks_list])
+
+        episode = {
+            k: episode[k]
+            for k in episode.keys()
+            if keep(k)
+            and "init_q" not in k
+            and "observation" not in k
+            and "terminal" not in k
+            and "goal" not in k
+        }
+        episode["reward"] = rewards
+    return episode
+
+
+def concat_cameras(episode: DatasetDict, camera_ids: Iterable[str]) -> np.ndarray:
+    """Concatenates the extra_image_<camera_id>_rgb images along the channels."""
+    keys = sorted(f"{camera_id}_rgb" for camera_id in camera_ids)
+    return np.concatenate([episode[f"extra_image_{key}"] for key in keys], axis=-1)
+
+
+def load_episode(
+    episode_file: str,
+    discount: float,
+    tasks_list: Optional[List[str]] = None,
+    camera_ids: Optional[Iterable[str]] = None,
+) -> DatasetDict:
+    """Reads an offline .npz episode and adds its mc_returns.
+
+    If camera_ids are given, the images of these cameras are concatenated
+    into episode["image"].
+    """
+    episode = read_episode_file(episode_file, tasks_list)
+    episode["mc_returns"] = discounted_returns(episode["reward"], discount, bootstrap_last=True)
+    if camera_ids is not None:
+        episode["image"] = concat_cameras(episode, camera_ids)
+    return episode
+
+
+def read_store_episodes(
+    path: str,
+    keys: Iterable[str],
+    discount: float,
+    tasks_list: Optional[List[str]] = None,
+) -> Iterator[DatasetDict]:
+    """Lazily reads the given columns of the episodes of a converted store.
+
+    The stored rewards and mc_returns must have been computed for the same
+    tasks and discount.
+    """
+    store = EpisodeStore(path)
+    if store.metadata.get("tasks_list") != tasks_list:
+        raise ValueError(
+            f"{path} was converted for tasks {store.metadata.get('tasks_list')}, not {tasks_list}."
+        )
+    if store.metadata.get("discount") != discount:
+        raise ValueError(
+            f"{path} was converted with discount {store.metadata.get('discount')}, not {discount}."
+        )
+    return store.get_episodes(keys=keys)
+
+
+def stack_frames(frames: np.ndarray, num_stack: int) -> np.ndarray:
+    """Returns a (T, ..., num_stack) view of frame stacks, padded with the first frame."""
+    padding = np.repeat(frames[:1], num_stack - 1, axis=0)
+    frames = np.concatenate([padding, frames], axis=0)
+    return np.lib.stride_tricks.sliding_window_view(frames, num_stack, axis=0)
+
+
+def episode_to_transitions(
+    episode: DatasetDict, num_stack: int, proprio: bool
+) -> DatasetDict:
+    """Converts a loaded offline episode into arrays for insert_episode().
+
+    Step i of the episode becomes the transition from observation i - 1 to
+    observation i, as in the per-transition loaders; the last transition is
+    terminal.
+    """
+    pixels = stack_frames(episode["image"], num_stack)
+    episode_len = episode["image"].shape[0] - 1
+
+    observations = dict(pixels=pixels[:-1])
+    next_observations = dict(pixels=pixels[1:])
+    if proprio:
+        observations["states"] = episode["proprio"][:-1]
+        next_observations["states"] = episode["proprio"][1:]
+
+    dones = np.zeros((episode_len,), dtype=bool)
+    dones[-1] = True
+
+    return dict(
+        observations=observations,
+        actions=episode["action"][1:],
+        rewards=episode["reward"][1:],
+        masks=1.0 - dones.astype(np.float32),
+        dones=dones,
+        next_observations=next_observations,
+        mc_returns=episode["mc_returns"][1:],
+    )
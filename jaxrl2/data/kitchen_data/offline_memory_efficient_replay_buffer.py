@@ -1,11 +1,50 @@
-import collections
 import glob
+import threading
+from typing import Dict, Iterator
 
 import gym
-import jax
 import numpy as np
+from flax.core import frozen_dict
 
 from jaxrl2.data.kitchen_data.memory_efficient_replay_buffer import MemoryEfficientReplayBuffer
+from jaxrl2.data.parallel_loader import _in_pool, _in_process
+
+CAMERAS = ("camera_0_rgb", "camera_1_rgb", "camera_gripper_rgb")
+
+STATE_KEYS = ("ee_forces", "ee_qp", "robot_qp")
+
+
+def read_episode(path: str) -> Dict[str, np.ndarray]:
+    """Reads an episode file, with the cameras of every step concatenated
+    along the channels as "frames"."""
+    episode = np.load(path, allow_pickle=True)
+    decoded = {k: np.asarray(episode[k]) for k in STATE_KEYS + ("action", "reward")}
+    decoded["frames"] = np.concatenate([episode[k] for k in CAMERAS], axis=-1)
+    return decoded
+
+
+def _episode_dict(decoded: Dict[str, np.ndarray], num_stack: int) -> dict:
+    # Transition t goes from step t to step t + 1, with the action and reward
+    # of step t + 1, as stored by the robot. The frame stacks are views of the
+    # frames, with the first frame repeated before the episode.
+    frames = decoded["frames"]
+    padded = np.concatenate([np.repeat(frames[:1], num_stack - 1, axis=0), frames])
+    stacks = np.lib.stride_tricks.sliding_window_view(padded, num_stack, axis=0)
+    num_steps = len(decoded["reward"]) - 1
+
+    observations = dict(pixels=stacks[:num_steps])
+    next_observations = dict(pixels=stacks[1 : num_steps + 1])
+    for k in STATE_KEYS:
+        observations[k] = decoded[k][:num_steps]
+        next_observations[k] = decoded[k][1 : num_steps + 1]
+    return dict(
+        observations=observations,
+        next_observations=next_observations,
+        actions=decoded["action"][1:],
+        rewards=decoded["reward"][1:],
+        masks=np.zeros((num_steps,), dtype=np.float32),
+        dones=np.arange(num_steps) == num_steps - 1,
+    )
 
 
 class OfflineMemoryEfficientReplayBuffer(MemoryEfficientReplayBuffer):
@@ -17,81 +56,100 @@ class OfflineMemoryEfficientReplayBuffer(MemoryEfficientReplayBuffer):
         include_pixels: bool = True,
         data_url: str = "",
         replay: int = 10,
+        num_workers: int = 4,
+        mp_context: str = "spawn",
     ):
-
-        super().__init__(observation_space, action_space, capacity, include_pixels)
-
+        """
+        A replay buffer that streams the episode files at data_url through
+        it. The file list is indexed once and the files are read in a new
+        random order every pass, by num_workers processes (0 reads them in
+        this process). The buffer is filled on construction; afterwards the
+        iterators of get_iterator() evict the oldest episodes in a background
+        thread while batches are sampled.
+
+        :param replay: the number of batches sampled per streamed episode at
+            most. The stream waits for the learner, not the other way around.
+        """
+        super().__init__(observation_space, action_space, capacity)
+
+        self._include_pixels = include_pixels
         self._data_url = data_url
         self._replay = replay
+        self._num_workers = num_workers
+        self._mp_context = mp_context
+
+        self._files = sorted(glob.glob(self._data_url + "*.pkl"))
+        assert self._files, f"No episodes at {self._data_url}."
+        self._episodes = None
+
+        self._progress = threading.Condition()
+        self._num_sampled = 0
+        self._num_streamed = 0
+        self._stream_thread = None
+        self._stop_stream = threading.Event()
+
         self.load()
 
+    def _shuffled_files(self) -> Iterator[str]:
+        while True:
+            for i in self.np_random.permutation(len(self._files)):
+                yield self._files[i]
+
+    def _next_episode(self) -> dict:
+        if self._episodes is None:
+            if self._num_workers == 0:
+                self._episodes = _in_process(read_episode, self._shuffled_files())
+            else:
+                self._episodes = _in_pool(
+                    read_episode,
+                    self._shuffled_files(),
+                    self._num_workers,
+                    ordered=False,
+                    mp_context=self._mp_context,
+                )
+        return _episode_dict(next(self._episodes), self._num_stack)
+
     def load(self):
         while self._size < self._capacity:
             self.load_episode()
 
     def load_episode(self):
-        file = self.np_random.choice(glob.glob(self._data_url + "*.pkl"))
-        episode = np.load(file, allow_pickle=True)
-        frames = collections.deque(maxlen=self._num_stack)
-        import pdb; pdb.set_trace()
-        for _ in range(self._num_stack):
-            frames.append(
-                np.concatenate(
-                    [
-                        episode["camera_0_rgb"][0],
-                        episode["camera_1_rgb"][0],
-                        episode["camera_gripper_rgb"][0],
-                    ],
-                    axis=-1,
-                )
-            )
-        for t in range(episode["reward"].shape[0] - 1):
-            transition = dict()
-            transition["observations"] = dict()
-            transition["observations"]["pixels"] = np.stack(frames, axis=-1)
-            transition["observations"]["ee_forces"] = episode["ee_forces"][t]
-            transition["observations"]["ee_qp"] = episode["ee_qp"][t]
-            transition["observations"]["robot_qp"] = episode["robot_qp"][t]
-
-            transition["actions"] = episode["action"][t + 1]
-            transition["rewards"] = episode["reward"][t + 1]
-
-            frames.append(
-                np.concatenate(
-                    [
-                        episode["camera_0_rgb"][t + 1],
-                        episode["camera_1_rgb"][t + 1],
-                        episode["camera_gripper_rgb"][t + 1],
-                    ],
-                    axis=-1,
-                )
-            )
-
-            transition["next_observations"] = dict()
-            transition["next_observations"]["pixels"] = np.stack(frames, axis=-1)
-            transition["next_observations"]["ee_forces"] = episode["ee_forces"][t + 1]
-            transition["next_observations"]["ee_qp"] = episode["ee_qp"][t + 1]
-            transition["next_observations"]["robot_qp"] = episode["robot_qp"][t + 1]
-
-            transition["masks"] = 0.0
-            transition["dones"] = 0.0
-
-            self.insert(transition)
-
-    def get_iterator(self, queue_size: int = 2, sample_args: dict = {}):
-        # See https://flax.readthedocs.io/en/latest/_modules/flax/jax_utils.html#prefetch_to_device
-        # queue_size = 2 should be ok for one GPU.
-
-        queue = collections.deque()
-
-        def enqueue(n):
-            for _ in range(n):
-                data = self.sample(**sample_args)
-                queue.append(jax.device_put(data))
-
-        enqueue(queue_size)
-        while queue:
-            for _ in range(self._replay):
-                yield queue.popleft()
-                enqueue(1)
-            self.load_episode()
+        self.insert_episode(self._next_episode())
+
+    def _stream(self):
+        while not self._stop_stream.is_set():
+            episode = self._next_episode()
+            with self._progress:
+                while self._num_sampled < self._replay * self._num_streamed:
+                    if self._stop_stream.is_set():
+                        return
+                    self._progress.wait(0.1)
+            self.insert_episode(episode)
+            with self._progress:
+                self._num_streamed += 1
+
+    def start_streaming(self):
+        if self._stream_thread is None:
+            self._stop_stream.clear()
+            self._stream_thread = threading.Thread(target=self._stream, daemon=True)
+            self._stream_thread.start()
+
+    def stop_streaming(self):
+        if self._stream_thread is not None:
+            self._stop_stream.set()
+            self._stream_thread.join()
+            self._stream_thread = None
+
+    def sample(self, *args, **kwargs) -> frozen_dict.FrozenDict:
+        batch = super().sample(*args, **kwargs)
+        with self._progress:
+            self._num_sampled += 1
+            self._progress.notify()
+        return batch
+
+    def get_iterator(
+        self, queue_size: int = 2, sample_args: dict = {}, num_workers: int = 1
+    ):
+        sample_args = {"include_pixels": self._include_pixels, **sample_args}
+        self.start_streaming()
+        return super().get_iterator(queue_size, sample_args, num_workers)
@@ -1,21 +1,47 @@
-import collections
 import copy
-from typing import Iterable, Optional
+from typing import Dict, Iterable, Optional, Tuple
 
 import gym
-import jax
 import numpy as np
 from flax.core import frozen_dict
 from gym.spaces import Box
 
-from jaxrl2.data.dataset import DatasetDict, _sample
-from jaxrl2.data.replay_buffer import ReplayBuffer
+from jaxrl2.data.compressed_frames import CompressedFrames
+from jaxrl2.data.dataset import DatasetDict, _key_tree, _sample, _select, _unpermute
+from jaxrl2.data.index_set import IndexSet
+from jaxrl2.data.packed_frames import pack_frame_stacks
+from jaxrl2.data.prefetch import make_iterator
+from jaxrl2.data.replay_buffer import ReplayBuffer, _synchronized
+
+
+def _pop_pixels(key_tree: dict, key: str, columns: Iterable[str]) -> bool:
+    # Removes "pixels" from the columns of key_tree[key], all columns if
+    # None, and returns whether it was selected.
+    if key not in key_tree:
+        return False
+    if key_tree[key] is None:
+        key_tree[key] = dict.fromkeys(columns)
+    return key_tree[key].pop("pixels", False) is None
 
 
 class MemoryEfficientReplayBuffer(ReplayBuffer):
     def __init__(
-        self, observation_space: gym.Space, action_space: gym.Space, capacity: int
+        self,
+        observation_space: gym.Space,
+        action_space: gym.Space,
+        capacity: int,
+        storage_dir: Optional[str] = None,
+        frame_codec: Optional[str] = None,
+        frame_cache_size: int = 4096,
+        num_decode_threads: int = 4,
+        task_key: Optional[str] = None,
+        initial_capacity: Optional[int] = None,
     ):
+        """
+        :param frame_codec: as in ReplayBuffer, for the unstacked frames.
+        :param initial_capacity: as in ReplayBuffer; the frame stacks of the
+            first rows never wrap around, so they stay valid as it grows.
+        """
 
         pixel_obs_space = observation_space.spaces["pixels"]
         self._num_stack = pixel_obs_space.shape[-1]
@@ -28,6 +54,8 @@ class MemoryEfficientReplayBuffer(ReplayBuffer):
 
         self._first = True
         self._is_correct_index = np.full(capacity, False, dtype=bool)
+        # Dense copy of the correct indices, so that sampling needs no rejection.
+        self._correct_indices = IndexSet(capacity)
 
         next_observation_space_dict = copy.deepcopy(observation_space.spaces)
         next_observation_space_dict.pop("pixels")
@@ -38,14 +66,80 @@ class MemoryEfficientReplayBuffer(ReplayBuffer):
             action_space,
             capacity,
             next_observation_space=next_observation_space,
+            storage_dir=storage_dir,
+            task_key=task_key,
+            initial_capacity=initial_capacity,
+            frame_codec=frame_codec,
+            frame_cache_size=frame_cache_size,
+            num_decode_threads=num_decode_threads,
         )
 
+    def _set_correct_index(self, indx: int, is_correct: bool):
+        self._is_correct_index[indx] = is_correct
+        if is_correct:
+            self._correct_indices.add(indx)
+        else:
+            self._correct_indices.discard(indx)
+        if self._task_index is not None:
+            if is_correct:
+                self._task_index.add(indx)
+            else:
+                self._task_index.discard(indx)
+
+    def _set_correct_indices(self, indxs: np.ndarray, is_correct: bool):
+        self._is_correct_index[indxs] = is_correct
+        if is_correct:
+            self._correct_indices.add_many(indxs)
+        else:
+            self._correct_indices.discard_many(indxs)
+        if self._task_index is not None:
+            if is_correct:
+                self._task_index.add(indxs)
+            else:
+                self._task_index.discard(indxs)
+
+    def _index_tasks(self, task_values: np.ndarray, slots: np.ndarray):
+        # Only rows with a complete frame stack are sampled, as set above.
+        self._task_index.set_labels(slots, self._task_index.label(task_values))
+
+    def _is_sampleable(self, slots: np.ndarray) -> np.ndarray:
+        return self._is_correct_index[slots]
+
+    def _episode_rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Rows without a complete frame stack are padding or copies of other
+        # rows, except for the oldest steps, which are partly overwritten.
+        rows, _ = super()._episode_rows()
+        return rows, self._is_correct_index[rows]
+
+    def _filter_rows(self, kept_rows: np.ndarray, removed_rows: np.ndarray):
+        # The correct indices are the sampling index; removed rows rejoin it
+        # when they are overwritten.
+        self._correct_indices = IndexSet(self._capacity)
+        self._correct_indices.add_many(np.flatnonzero(self._is_correct_index))
+        self._correct_indices.discard_many(removed_rows)
+
+    def _snapshot_state(self) -> Dict[str, np.ndarray]:
+        state = super()._snapshot_state()
+        state["is_correct_index"] = self._is_correct_index.copy()
+        state["first"] = np.bool_(self._first)
+        return state
+
+    def _restore_snapshot_state(self, state: Dict[str, np.ndarray]):
+        super()._restore_snapshot_state(state)
+        self._is_correct_index[:] = state["is_correct_index"]
+        self._correct_indices = IndexSet(self._capacity)
+        self._correct_indices.add_many(np.flatnonzero(self._is_correct_index))
+        if self._task_index is not None:
+            self._task_index.add(np.flatnonzero(self._is_correct_index))
+        self._first = bool(state["first"])
+
+    @_synchronized
     def insert(self, data_dict: DatasetDict):
         if self._insert_index == 0 and self._capacity == len(self) and not self._first:
             indxs = np.arange(len(self) - self._num_stack, len(self))
             for indx in indxs:
                 element = super().sample(1, indx=indx)
-                self._is_correct_index[self._insert_index] = False
+                self._set_correct_index(self._insert_index, False)
                 super().insert(element)
 
         data_dict = data_dict.copy()
@@ -58,91 +152,230 @@ class MemoryEfficientReplayBuffer(ReplayBuffer):
         if self._first:
             for i in range(self._num_stack):
                 data_dict["observations"]["pixels"] = obs_pixels[..., i]
-                self._is_correct_index[self._insert_index] = False
+                self._set_correct_index(self._insert_index, False)
                 super().insert(data_dict)
 
         data_dict["observations"]["pixels"] = next_obs_pixels[..., -1]
 
         self._first = data_dict["dones"]
 
-        self._is_correct_index[self._insert_index] = True
+        # The frame stack of the first slots would wrap around the end of the
+        # buffer, which the sliding window in sample() does not support.
+        self._set_correct_index(
+            self._insert_index, self._insert_index >= self._num_stack
+        )
         super().insert(data_dict)
 
         for i in range(self._num_stack):
             indx = (self._insert_index + i) % len(self)
-            self._is_correct_index[indx] = False
+            self._set_correct_index(indx, False)
+
+    @_synchronized
+    def insert_episode(self, episode_dict: DatasetDict):
+        """Inserts a whole episode with slice assignment.
+
+        episode_dict has the same structure as in insert() with a leading time
+        axis. Only the first observation stack and the last frame of every next
+        observation stack are read, so the stacked pixels can be a
+        sliding_window_view over the episode frames.
+        """
+        episode_dict, trajectory_id = self._pop_trajectory_id(episode_dict)
+        episode_dict["observations"] = dict(episode_dict["observations"])
+        episode_dict["next_observations"] = dict(episode_dict["next_observations"])
+
+        obs_pixels = episode_dict["observations"].pop("pixels")
+        next_obs_pixels = episode_dict["next_observations"].pop("pixels")
+
+        first = self._first
+        if first:
+            padding = _sample(episode_dict, np.zeros(self._num_stack, dtype=int))
+            padding["observations"]["pixels"] = np.moveaxis(obs_pixels[0], -1, 0)
+            padding_len = self._num_stack
+            start = 0
+            while start < padding_len:
+                num_rows = min(padding_len - start, self._capacity - self._insert_index)
+                rows = _sample(padding, np.s_[start : start + num_rows])
+                self._set_correct_indices(
+                    self._insert_rows(rows, trajectory_id), False
+                )
+                start += num_rows
+
+        episode_dict["observations"]["pixels"] = next_obs_pixels[..., -1]
+        episode_len = len(episode_dict["rewards"])
+
+        start = 0
+        while start < episode_len:
+            if self._insert_index == 0 and self._capacity == len(self) and not first:
+                self._copy_last_frames(trajectory_id)
+            num_rows = min(episode_len - start, self._capacity - self._insert_index)
+            slots = self._insert_rows(
+                _sample(episode_dict, np.s_[start : start + num_rows]), trajectory_id
+            )
+            self._set_correct_indices(slots[slots >= self._num_stack], True)
+            self._set_correct_indices(slots[slots < self._num_stack], False)
+            first = False
+            start += num_rows
+
+        self._first = episode_dict["dones"][-1]
+
+        indxs = (self._insert_index + np.arange(self._num_stack)) % len(self)
+        self._set_correct_indices(indxs, False)
+        if self._first:
+            self.increment_traj_counter()
+
+    def _copy_last_frames(self, trajectory_id: int):
+        # Bulk version of the wrap-around copy at the beginning of insert().
+        indxs = np.arange(len(self) - self._num_stack, len(self))
+        rows = _sample(self.dataset_dict, indxs)
+        self._set_correct_indices(self._insert_rows(rows, trajectory_id), False)
 
+    @_synchronized
     def sample(
         self,
         batch_size: int,
         keys: Optional[Iterable[str]] = None,
         indx: Optional[np.ndarray] = None,
         include_pixels: bool = True,
+        out: Optional[DatasetDict] = None,
+        pack_frames: bool = False,
+        sort_indices: bool = False,
     ) -> frozen_dict.FrozenDict:
+        """
+        :param keys: as in Dataset.sample. The frame stacks are only gathered
+            for "observations/pixels" or "next_observations/pixels".
+        :param include_pixels: if False, observations contain the
+            num_stack + 1 frames of the observation and the next observation,
+            and next_observations no pixels.
+        :param pack_frames: if True, observations contain the frames of the
+            batch once each, as "frames", and "frame_indices" into them
+            instead of "pixels"; see packed_frames.unpack_frames. Implies
+            include_pixels=False.
+        :param sort_indices: if True, the rows and frame stacks are gathered
+            in the order of their slots; see Dataset.sample.
+        """
 
-        if indx is None:
+        inverse = None
+        if indx is None and self._task_sampling:
+            indx = self._sample_task_indices(batch_size)
+        elif indx is None:
+            num_correct = len(self._correct_indices)
             if hasattr(self.np_random, "integers"):
-                indx = self.np_random.integers(len(self), size=batch_size)
+                positions = self.np_random.integers(num_correct, size=batch_size)
             else:
-                indx = self.np_random.randint(len(self), size=batch_size)
-
-            for i in range(batch_size):
-                while not self._is_correct_index[indx[i]]:
-                    if hasattr(self.np_random, "integers"):
-                        indx[i] = self.np_random.integers(len(self))
-                    else:
-                        indx[i] = self.np_random.randint(len(self))
+                positions = self.np_random.randint(num_correct, size=batch_size)
+            indx = self._correct_indices.indices[positions]
         else:
-            raise NotImplementedError()
+            indx = np.asarray(indx)
+            assert np.all(
+                self._is_correct_index[indx]
+            ), "Can only sample indices with a complete frame stack."
+            if sort_indices:
+                order = np.argsort(indx, kind="stable")
+                indx = indx[order]
+                inverse = np.argsort(order)
+        if sort_indices and inverse is None:
+            indx = np.sort(indx)
 
-        if keys is None:
-            keys = self.dataset_dict.keys()
-        else:
-            assert "observations" in keys
+        key_tree = _key_tree(self.dataset_dict.keys() if keys is None else keys)
+        # The pixels are gathered from the frame stacks below.
+        obs_pixels_selected = _pop_pixels(
+            key_tree, "observations", self.dataset_dict["observations"]
+        )
+        next_pixels_selected = _pop_pixels(
+            key_tree,
+            "next_observations",
+            (*self.dataset_dict["next_observations"], "pixels"),
+        )
+        if pack_frames or not include_pixels:
+            # Both are part of the num_stack + 1 frames of the observation.
+            obs_pixels_selected = obs_pixels_selected or next_pixels_selected
+            next_pixels_selected = False
 
-        keys = list(keys)
-        keys.remove("observations")
+        batch = _sample(_select(self.dataset_dict, key_tree), indx, out)
+        if inverse is not None:
+            # Pixels are put back in order below, once per gathered array.
+            _unpermute(batch, inverse)
+        if not (obs_pixels_selected or next_pixels_selected):
+            return frozen_dict.freeze(batch)
 
-        batch = super().sample(batch_size, keys, indx)
-        batch = batch.unfreeze()
+        obs_out = None if out is None else out.get("observations")
+        if obs_pixels_selected:
+            batch.setdefault("observations", {})
 
-        obs_keys = self.dataset_dict["observations"].keys()
-        obs_keys = list(obs_keys)
-        obs_keys.remove("pixels")
+        obs_pixels = self.dataset_dict["observations"]["pixels"]
+        if pack_frames:
+            frames, frame_indices = pack_frame_stacks(
+                obs_pixels,
+                indx,
+                self._num_stack,
+                None if obs_out is None else obs_out.get("frames"),
+            )
+            if inverse is not None:
+                _unpermute(frame_indices, inverse)
+            batch["observations"]["frames"] = frames
+            batch["observations"]["frame_indices"] = frame_indices
+            return frozen_dict.freeze(batch)
 
-        batch["observations"] = {}
-        for k in obs_keys:
-            batch["observations"][k] = _sample(
-                self.dataset_dict["observations"][k], indx
+        if isinstance(obs_pixels, CompressedFrames):
+            # Frames shared by the stacks of the batch are decoded once.
+            stack_rows = (indx - self._num_stack)[:, None] + np.arange(
+                self._num_stack + 1
+            )
+            obs_pixels = np.moveaxis(obs_pixels.take(stack_rows), 1, -1)
+            stack_indx = np.arange(len(indx))
+        else:
+            obs_pixels = np.lib.stride_tricks.sliding_window_view(
+                obs_pixels, self._num_stack + 1, axis=0
             )
+            stack_indx = indx - self._num_stack
 
-        obs_pixels = self.dataset_dict["observations"]["pixels"]
-        obs_pixels = np.lib.stride_tricks.sliding_window_view(
-            obs_pixels, self._num_stack + 1, axis=0
-        )
-        obs_pixels = obs_pixels[indx - self._num_stack]
+        if out is not None:
+            # Gathers each stack straight into its output array.
+            gathered = []
+            if include_pixels:
+                if obs_pixels_selected:
+                    batch["observations"]["pixels"] = _sample(
+                        obs_pixels[..., :-1], stack_indx, obs_out["pixels"]
+                    )
+                    gathered.append(batch["observations"]["pixels"])
+                if next_pixels_selected:
+                    batch["next_observations"]["pixels"] = _sample(
+                        obs_pixels[..., 1:],
+                        stack_indx,
+                        out["next_observations"]["pixels"],
+                    )
+                    gathered.append(batch["next_observations"]["pixels"])
+            else:
+                batch["observations"]["pixels"] = _sample(
+                    obs_pixels, stack_indx, obs_out["pixels"]
+                )
+                gathered.append(batch["observations"]["pixels"])
+            if inverse is not None:
+                for pixels in gathered:
+                    _unpermute(pixels, inverse)
+            return frozen_dict.freeze(batch)
+
+        obs_pixels = obs_pixels[stack_indx]
+        if inverse is not None:
+            obs_pixels = obs_pixels[inverse]
 
         if include_pixels:
-            batch["observations"]["pixels"] = obs_pixels[..., :-1]
-            if "next_observations" in keys:
+            if obs_pixels_selected:
+                batch["observations"]["pixels"] = obs_pixels[..., :-1]
+            if next_pixels_selected:
                 batch["next_observations"]["pixels"] = obs_pixels[..., 1:]
         else:
             batch["observations"]["pixels"] = obs_pixels
 
         return frozen_dict.freeze(batch)
 
-    def get_iterator(self, queue_size: int = 2, sample_args: dict = {}):
-        # See https://flax.readthedocs.io/en/latest/_modules/flax/jax_utils.html#prefetch_to_device
-        # queue_size = 2 should be ok for one GPU.
-
-        queue = collections.deque()
-
-        def enqueue(n):
-            for _ in range(n):
-                data = self.sample(**sample_args)
-                queue.append(jax.device_put(data))
-
-        enqueue(queue_size)
-        while queue:
-            yield queue.popleft()
-            enqueue(1)
+    def get_iterator(
+        self,
+        queue_size: int = 2,
+        sample_args: dict = {},
+        num_workers: int = 1,
+        num_processes: int = 0,
+    ):
+        return make_iterator(
+            self, self.np_random, sample_args, queue_size, num_workers, num_processes
+        )
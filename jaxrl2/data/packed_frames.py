@@ -0,0 +1,52 @@
+from typing import Optional, Tuple
+
+import jax.numpy as jnp
+import numpy as np
+from flax.core import frozen_dict
+
+from jaxrl2.data.batch_pool import take_rows
+
+
+def pack_frame_stacks(
+    pixels: np.ndarray,
+    indx: np.ndarray,
+    num_stack: int,
+    out: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Gathers the frames of the stacks ending at indx, each frame once.
+
+    Returns the unique frames and a (batch_size, num_stack + 1) index tensor
+    into them, from which unpack_frames rebuilds the stacks on the device.
+    The number of frames is padded to a multiple of the batch size, so that
+    a jitted update is compiled for at most num_stack + 1 frame counts.
+
+    :param out: preallocated frames, used if it has the padded length.
+    """
+    batch_size = len(indx)
+    rows = (np.asarray(indx) - num_stack)[:, None] + np.arange(num_stack + 1)
+    unique_rows, frame_indices = np.unique(rows, return_inverse=True)
+
+    num_frames = -(-len(unique_rows) // batch_size) * batch_size
+    # Padding repeats the last frame.
+    unique_rows = np.pad(unique_rows, (0, num_frames - len(unique_rows)), mode="edge")
+    if out is None or len(out) != num_frames:
+        out = None
+    if out is None:
+        frames = pixels[unique_rows]
+    else:
+        frames = take_rows(pixels, unique_rows, out)
+    return frames, frame_indices.reshape(rows.shape).astype(np.int32)
+
+
+def unpack_frames(observations: frozen_dict.FrozenDict) -> frozen_dict.FrozenDict:
+    """Rebuilds the (..., num_stack + 1) pixel stacks of packed observations.
+
+    Observations without packed frames are returned unchanged. Works on host
+    and device arrays, e.g. inside a jitted update.
+    """
+    if "frame_indices" not in observations:
+        return observations
+    observations, frames = frozen_dict.pop(observations, "frames")
+    observations, frame_indices = frozen_dict.pop(observations, "frame_indices")
+    pixels = jnp.moveaxis(frames[frame_indices], 1, -1)
+    return frozen_dict.copy(observations, add_or_replace={"pixels": pixels})
@@ -0,0 +1,111 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+import jax
+import numpy as np
+import tqdm
+
+_DONE = object()
+
+
+def _nbytes(episode: Any) -> int:
+    return sum(
+        leaf.nbytes for leaf in jax.tree_util.tree_leaves(episode) if isinstance(leaf, np.ndarray)
+    )
+
+
+def _in_process(load_fn: Callable[[Any], Any], items: Iterable[Any]) -> Iterator[Any]:
+    for item in items:
+        yield load_fn(item)
+
+
+def _in_pool(
+    load_fn: Callable[[Any], Any],
+    items: Iterable[Any],
+    num_workers: int,
+    ordered: bool,
+    mp_context: str,
+) -> Iterator[Any]:
+    executor = concurrent.futures.ProcessPoolExecutor(
+        num_workers, mp_context=multiprocessing.get_context(mp_context)
+    )
+    # Bounds the number of decoded episodes waiting for the consumer.
+    max_pending = 2 * num_workers
+    items = iter(items)
+    pending = collections.deque()
+
+    def submit():
+        item = next(items, _DONE)
+        if item is not _DONE:
+            pending.append(executor.submit(load_fn, item))
+
+    try:
+        for _ in range(max_pending):
+            submit()
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                future = next(iter(done))
+                pending.remove(future)
+            episode = future.result()
+            submit()
+            yield episode
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def load_episodes(
+    load_fn: Callable[[Any], Any],
+    items: Iterable[Any],
+    num_workers: Optional[int] = None,
+    ordered: bool = True,
+    desc: str = "Loading episodes",
+    mp_context: str = "spawn",
+) -> Iterator[Any]:
+    """Yields load_fn(item) for every item, decoded in a process pool.
+
+    load_fn must be picklable, e.g. a module-level function or a
+    functools.partial of one. Episodes are yielded in the order of items, or
+    as soon as they are ready if ordered is False, so that the caller can
+    insert them while the workers decode the next ones. Stopping the iteration
+    early cancels the remaining items.
+
+    :param num_workers: number of processes, all cores by default; 0 loads the
+        episodes in this process.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    items = list(items)
+
+    if num_workers == 0:
+        episodes = _in_process(load_fn, items)
+    else:
+        episodes = _in_pool(load_fn, items, min(num_workers, max(len(items), 1)), ordered, mp_context)
+
+    num_episodes, num_bytes = 0, 0
+    start = time.time()
+    try:
+        with tqdm.tqdm(total=len(items), desc=desc, smoothing=0.1) as pbar:
+            for episode in episodes:
+                num_episodes += 1
+                num_bytes += _nbytes(episode)
+                pbar.set_postfix(MBps=num_bytes / 2**20 / max(time.time() - start, 1e-6))
+                pbar.update()
+                yield episode
+    finally:
+        episodes.close()
+
+    duration = max(time.time() - start, 1e-6)
+    print(
+        f"{desc}: {num_episodes} episodes, {num_bytes / 2**20:.0f} MB in {duration:.1f}s "
+        f"({num_episodes / duration:.1f} episodes/s, {num_bytes / 2**20 / duration:.0f} MB/s "
+        f"with {num_workers} workers)."
+    )
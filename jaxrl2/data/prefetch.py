@@ -0,0 +1,234 @@
+import queue
+import threading
+import time
+import weakref
+from typing import Any, Callable
+
+import jax
+
+from jaxrl2.data.batch_pool import BatchPool
+from jaxrl2.data.shared_memory_sampler import SharedMemorySampler
+
+
+class _WorkerError(object):
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+def _worker(
+    sample_fn: Callable[[], Any],
+    put_fn: Callable[[Any], Any],
+    batches: queue.Queue,
+    free_slots: threading.Semaphore,
+    draw: list,
+    stop: threading.Event,
+):
+    # Must not reference the iterator itself, so that dropping the iterator
+    # stops the workers. draw holds the lock and the number of the next
+    # batch: batches are drawn one at a time and numbered in that order.
+    while not stop.is_set():
+        if not free_slots.acquire(timeout=0.1):
+            continue
+        with draw[0]:
+            batch_number = draw[1]
+            draw[1] += 1
+            try:
+                item = sample_fn()
+            except BaseException as e:
+                item = _WorkerError(e)
+
+        if not isinstance(item, _WorkerError):
+            try:
+                item = put_fn(item)
+            except BaseException as e:
+                item = _WorkerError(e)
+        batches.put((batch_number, item))
+
+        if isinstance(item, _WorkerError):
+            return
+
+
+def _shutdown(batches: queue.Queue, stop: threading.Event, threads: list):
+    stop.set()
+    while True:
+        try:
+            batches.get_nowait()
+        except queue.Empty:
+            break
+    for thread in threads:
+        if thread is not threading.current_thread():
+            thread.join(timeout=1.0)
+
+
+class PrefetchIterator(object):
+    """Samples and transfers batches to the device in background threads.
+
+    Numpy gathers and jax.device_put release the GIL, so the training thread
+    only pops ready device batches from a bounded queue. The threads start
+    with the first batch, so the iterator can be created before the dataset
+    is filled. Batches are drawn one at a time, in the order they are
+    returned, so runs are reproducible for any num_workers; only the
+    transfers overlap.
+
+    Replay buffers hold a lock while sampling and inserting, so batches
+    never contain a partly written row. When inserting while iterating,
+    e.g. online, the queued batches are sampled up to queue_size batches
+    before they are returned and do not contain the latest rows.
+    """
+
+    def __init__(
+        self,
+        sample_fn: Callable[[], Any],
+        queue_size: int = 2,
+        num_workers: int = 1,
+        put_fn: Callable[[Any], Any] = jax.device_put,
+    ):
+        # See https://flax.readthedocs.io/en/latest/_modules/flax/jax_utils.html#prefetch_to_device
+        # queue_size = 2 should be ok for one GPU.
+        self._sample_fn = sample_fn
+        self._queue_size = queue_size
+        self._num_workers = num_workers
+        self._put_fn = put_fn
+        self._threads = None
+        self._done = {}
+
+        self.num_batches = 0
+        self.num_starved = 0
+        self.wait_time = 0.0
+
+    def _start(self):
+        self._batches = queue.Queue()
+        self._free_slots = threading.Semaphore(self._queue_size)
+        self._stop = threading.Event()
+        draw = [threading.Lock(), 0]
+        self._threads = [
+            threading.Thread(
+                target=_worker,
+                args=(
+                    self._sample_fn,
+                    self._put_fn,
+                    self._batches,
+                    self._free_slots,
+                    draw,
+                    self._stop,
+                ),
+                daemon=True,
+            )
+            for _ in range(self._num_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        self._finalizer = weakref.finalize(
+            self, _shutdown, self._batches, self._stop, self._threads
+        )
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._threads is None:
+            self._start()
+
+        if self.num_batches not in self._done and self._batches.empty():
+            self.num_starved += 1
+
+        t0 = time.time()
+        while self.num_batches not in self._done:
+            batch_number, item = self._batches.get()
+            self._done[batch_number] = item
+        item = self._done.pop(self.num_batches)
+        self.wait_time += time.time() - t0
+
+        if isinstance(item, _WorkerError):
+            self.close()
+            raise item.exception
+
+        self._free_slots.release()
+        self.num_batches += 1
+        return item
+
+    def close(self):
+        if self._threads is not None:
+            self._finalizer()
+
+    @property
+    def stats(self):
+        """Queue-starvation counters, e.g. for logging."""
+        return {
+            "num_batches": self.num_batches,
+            "num_starved": self.num_starved,
+            "starved_fraction": self.num_starved / max(self.num_batches, 1),
+            "wait_time": self.wait_time,
+        }
+
+
+class _PooledSampleFn(object):
+    """Samples batches into the buffers of a BatchPool, and put() puts them
+    on the device.
+
+    The first batch is allocated by sample() and serves as the template of
+    the pool. A buffer is released once its transfer has finished.
+    """
+
+    def __init__(self, dataset, sample_args: dict):
+        self._dataset = dataset
+        self._sample_args = sample_args
+        self._pool = BatchPool()
+        self._template = None
+
+    def __call__(self):
+        if self._template is None:
+            self._template = self._dataset.sample(**self._sample_args)
+            return self._template, None
+        out = self._pool.get(self._template)
+        try:
+            return self._dataset.sample(**self._sample_args, out=out), out
+        except BaseException:
+            self._pool.release(out)
+            raise
+
+    def put(self, item):
+        batch, out = item
+        try:
+            return jax.block_until_ready(jax.device_put(batch))
+        finally:
+            if out is not None:
+                self._pool.release(out)
+
+
+def make_iterator(
+    dataset,
+    np_random,
+    sample_args: dict,
+    queue_size: int = 2,
+    num_workers: int = 1,
+    num_processes: int = 0,
+):
+    """Returns a PrefetchIterator, or a SharedMemorySampler with num_processes
+    worker processes seeded from np_random if num_processes is positive."""
+    if num_processes > 0:
+        if hasattr(np_random, "integers"):
+            seed = np_random.integers(2**31)
+        else:
+            seed = np_random.randint(2**31)
+        return SharedMemorySampler(
+            dataset,
+            sample_args,
+            num_workers=num_processes,
+            num_slots=queue_size + num_processes,
+            seed=int(seed),
+        )
+    if jax.default_backend() == "cpu":
+        # device_put may alias host arrays on the CPU, so they cannot be reused.
+        return PrefetchIterator(
+            lambda: dataset.sample(**sample_args),
+            queue_size=queue_size,
+            num_workers=num_workers,
+        )
+    sample_fn = _PooledSampleFn(dataset, sample_args)
+    return PrefetchIterator(
+        sample_fn,
+        queue_size=queue_size,
+        num_workers=num_workers,
+        put_fn=sample_fn.put,
+    )
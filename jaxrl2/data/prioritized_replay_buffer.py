@@ -0,0 +1,166 @@
+import threading
+from typing import Iterable, Optional
+
+import numpy as np
+from flax.core import frozen_dict
+
+from jaxrl2.data.dataset import DatasetDict
+from jaxrl2.data.prefetch import make_iterator
+from jaxrl2.data.replay_buffer import _synchronized
+from jaxrl2.data.sum_tree import SumTree
+
+
+class PrioritizedReplayBuffer():
+    """Samples a ReplayBuffer or MemoryEfficientReplayBuffer proportionally
+    to priorities, e.g. (|TD error| + eps) ** alpha.
+
+    Rows inserted, through this wrapper or into the buffer directly, get the
+    largest priority so far. Batches contain "indx", the slots to pass to
+    update_priorities(), and the "importance_weights" (p_min / p) ** beta of
+    the rows, which are at most 1. In a MixingReplayBuffer, the rows of the
+    other buffers have indx -1, which update_priorities() skips, and a weight
+    of 1. Priorities are not part of snapshots: the rows already in the
+    buffer, and load(), give all rows the largest priority.
+
+    The priorities are read by the threads of get_iterator() and written by
+    the training thread, so they are only accessed under the lock.
+    """
+
+    def __init__(self, replay_buffer, alpha: float = 0.6, beta: float = 0.4, eps: float = 1e-6):
+        self.replay_buffer = replay_buffer
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self._lock = threading.RLock()
+        self._max_priority = 1.0
+        self._reset_priorities()
+
+    def __getstate__(self):
+        # E.g. for the processes of a SharedMemorySampler.
+        state = dict(self.__dict__)
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _reset_priorities(self):
+        # Rows already in the buffer, e.g. loaded from a snapshot, get the
+        # largest priority.
+        buf = self.replay_buffer
+        with buf._lock:
+            self._num_tracked = buf._num_inserted
+            slots = np.arange(len(buf))
+            sampleable = buf._is_sampleable(slots)
+        self._tree = SumTree(buf._capacity)
+        self._tree.update(slots, np.where(sampleable, self._max_priority, 0))
+
+    def _track_inserts(self):
+        # The rows inserted since the last call were written up to the insert
+        # index. The memory-efficient buffer also stops sampling the
+        # num_stack rows after them.
+        buf = self.replay_buffer
+        with buf._lock:
+            num_new = min(buf._num_inserted - self._num_tracked, buf._capacity)
+            if num_new == 0:
+                return
+            self._num_tracked = buf._num_inserted
+            window = min(num_new + getattr(buf, "_num_stack", 0), buf._capacity)
+            positions = np.arange(window)
+            slots = (buf._insert_index - num_new + positions) % buf._capacity
+            sampleable = buf._is_sampleable(slots)
+        priorities = np.where(positions < num_new, self._max_priority, self._tree.get(slots))
+        self._tree.update(slots, np.where(sampleable, priorities, 0))
+
+    @_synchronized
+    def insert(self, data_dict: DatasetDict):
+        self.replay_buffer.insert(data_dict)
+        self._track_inserts()
+
+    @_synchronized
+    def insert_episode(self, episode_dict: DatasetDict):
+        self.replay_buffer.insert_episode(episode_dict)
+        self._track_inserts()
+
+    @_synchronized
+    def update_priorities(self, indx: np.ndarray, td_errors: np.ndarray):
+        """Sets the priorities of the rows indx of a batch from their TD errors.
+
+        td_errors has a leading ensemble axis, e.g. qs - target_q of a
+        critic ensemble, or not; the largest error of the ensemble is used.
+        Rows with indx -1, from the other buffers of a mixture, are skipped.
+        """
+        self._track_inserts()
+        td_errors = np.abs(np.asarray(td_errors, dtype=np.float64))
+        if td_errors.ndim > 1:
+            td_errors = td_errors.max(axis=0)
+        indx = np.asarray(indx)
+        td_errors = td_errors[indx >= 0]
+        indx = indx[indx >= 0]
+        if len(indx) == 0:
+            return
+        priorities = (td_errors + self.eps) ** self.alpha
+        self._max_priority = max(self._max_priority, float(priorities.max()))
+        with self.replay_buffer._lock:
+            sampleable = self.replay_buffer._is_sampleable(indx)
+        self._tree.update(indx, np.where(sampleable, priorities, 0))
+
+    def _sample_indx(self, batch_size: int) -> np.ndarray:
+        # Stratified: one row from each of batch_size equal parts of the total.
+        assert self._tree.total > 0, "No rows to sample."
+        uniform = self.replay_buffer.np_random.random(batch_size)
+        values = (np.arange(batch_size) + uniform) * (self._tree.total / batch_size)
+        return self._tree.find(values)
+
+    @_synchronized
+    def sample(self,
+               batch_size: int,
+               keys: Optional[Iterable[str]] = None,
+               indx: Optional[np.ndarray] = None,
+               out: Optional[DatasetDict] = None,
+               **kwargs) -> frozen_dict.FrozenDict:
+        self._track_inserts()
+        if indx is None:
+            indx = self._sample_indx(batch_size)
+        if out is not None:
+            out = {k: v for k, v in out.items() if k not in ('indx', 'importance_weights')}
+        batch = self.replay_buffer.sample(batch_size, keys, indx, out=out, **kwargs)
+        weights = (self._tree.get(indx) / self._tree.min) ** -self.beta
+        return batch.copy(add_or_replace=dict(
+            indx=indx, importance_weights=weights.astype(np.float32)))
+
+    def seed(self, seed):
+        return self.replay_buffer.seed(seed)
+
+    def get_random_trajs(self, batch_size):
+        return self.replay_buffer.get_random_trajs(batch_size)
+
+    def get_iterator(self,
+                     queue_size: int = 2,
+                     sample_args: dict = {},
+                     num_workers: int = 1,
+                     num_processes: int = 0):
+        """
+        Batches are sampled ahead, so priorities updated afterwards only
+        apply to the batches after those in the queue.
+        """
+        return make_iterator(self, self.replay_buffer.np_random, sample_args,
+                             queue_size, num_workers, num_processes)
+
+    def increment_traj_counter(self):
+        return self.replay_buffer.increment_traj_counter()
+
+    def save(self, path: str, wait: bool = False):
+        return self.replay_buffer.save(path, wait)
+
+    @_synchronized
+    def load(self, path: str):
+        self.replay_buffer.load(path)
+        self._reset_priorities()
+
+    def compute_action_stats(self):
+        return self.replay_buffer.compute_action_stats()
+
+    def __len__(self) -> int:
+        return len(self.replay_buffer)
@@ -1,30 +1,83 @@
-from typing import Optional, Union
+import functools
+import os
+import threading
+from concurrent.futures import Future
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
 
 import gym
 import gym.spaces
 import numpy as np
 
-from jaxrl2.data.dataset import Dataset, DatasetDict
+from jaxrl2.data.compressed_frames import CompressedFrames
+from jaxrl2.data.dataset import Dataset, DatasetDict, _check_lengths, _sample
+from jaxrl2.data.snapshot import SnapshotWriter, read_chunk, read_snapshot
+from jaxrl2.data.task_index import TaskIndex
+from jaxrl2.data.trajectory_index import TrajectoryIndex
+
+
+def _empty(
+    shape: tuple, dtype: np.dtype, storage_dir: Optional[str] = None, name: str = ""
+) -> np.ndarray:
+    # Columns are kept in RAM unless a storage directory is given, in which case
+    # they are memory-mapped files and served through the page cache.
+    if storage_dir is None:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(
+        os.path.join(storage_dir, f"{name}.dat"), dtype=dtype, mode="w+", shape=shape
+    )
 
 
 def _init_replay_dict(
-    obs_space: gym.Space, capacity: int
+    obs_space: gym.Space,
+    capacity: int,
+    storage_dir: Optional[str] = None,
+    name: str = "",
+    frame_columns: Optional[dict] = None,
 ) -> Union[np.ndarray, DatasetDict]:
+    # frame_columns are the arguments of the CompressedFrames columns that
+    # store "pixels", if they are compressed. These have all their slots
+    # from the start, so the raw frames are never allocated.
     if isinstance(obs_space, gym.spaces.Box):
-        return np.empty((capacity, *obs_space.shape), dtype=obs_space.dtype)
+        if frame_columns is not None and name.endswith(".pixels"):
+            return CompressedFrames(
+                frame_shape=obs_space.shape, dtype=obs_space.dtype, **frame_columns
+            )
+        return _empty(
+            (capacity, *obs_space.shape), obs_space.dtype, storage_dir, name
+        )
     elif isinstance(obs_space, gym.spaces.Dict):
         data_dict = {}
         for k, v in obs_space.spaces.items():
-            data_dict[k] = _init_replay_dict(v, capacity)
+            data_dict[k] = _init_replay_dict(
+                v, capacity, storage_dir, f"{name}.{k}", frame_columns
+            )
         return data_dict
     else:
         raise TypeError()
 
 
+def _grow_columns(dataset_dict: DatasetDict, num_rows: int, num_filled: int):
+    # Replaces the columns, in place, by ones with num_rows rows, of which the
+    # first num_filled are copied. Memory-mapped files are extended and mapped
+    # again instead. Compressed frames only hold a reference per slot, so they
+    # have all slots from the start.
+    for k, v in dataset_dict.items():
+        if isinstance(v, dict):
+            _grow_columns(v, num_rows, num_filled)
+        elif isinstance(v, np.memmap):
+            v.flush()
+            shape = (num_rows, *v.shape[1:])
+            os.truncate(v.filename, int(np.prod(shape)) * v.dtype.itemsize)
+            dataset_dict[k] = np.memmap(v.filename, dtype=v.dtype, mode="r+", shape=shape)
+        elif not isinstance(v, CompressedFrames):
+            dataset_dict[k] = np.empty((num_rows, *v.shape[1:]), dtype=v.dtype)
+            dataset_dict[k][:num_filled] = v[:num_filled]
+
+
 def _insert_recursively(
     dataset_dict: DatasetDict, data_dict: DatasetDict, insert_index: int
 ):
-    if isinstance(dataset_dict, np.ndarray):
+    if isinstance(dataset_dict, (np.ndarray, CompressedFrames)):
         dataset_dict[insert_index] = data_dict
     elif isinstance(dataset_dict, dict):
         assert dataset_dict.keys() == data_dict.keys(), f"dataset_dict.keys(): {dataset_dict.keys()}, data_dict.keys(): {data_dict.keys()}"
@@ -34,6 +87,46 @@ def _insert_recursively(
         raise TypeError()
 
 
+def _read_rows(dataset_dict: DatasetDict, slots: np.ndarray) -> DatasetDict:
+    # Copies rows for a snapshot, with compressed frames kept encoded.
+    rows = {}
+    for k, v in dataset_dict.items():
+        if isinstance(v, dict):
+            rows[k] = _read_rows(v, slots)
+        elif isinstance(v, CompressedFrames):
+            encoded, lengths = v.get_encoded(slots)
+            rows[k] = dict(encoded=encoded, lengths=lengths)
+        else:
+            rows[k] = v[slots]
+    return rows
+
+
+def _write_rows(dataset_dict: DatasetDict, rows: DatasetDict, slots: np.ndarray):
+    # Restores rows returned by _read_rows; empty dicts are not saved.
+    for k, v in dataset_dict.items():
+        if isinstance(v, dict):
+            _write_rows(v, rows.get(k, {}), slots)
+        elif isinstance(v, CompressedFrames) and isinstance(rows[k], dict):
+            v.set_encoded(slots, rows[k]["encoded"], rows[k]["lengths"])
+        else:
+            assert not isinstance(rows[k], dict), (
+                f"Column {k} of the snapshot holds encoded frames; "
+                "load it into a buffer with a frame_codec."
+            )
+            v[slots] = rows[k]
+
+
+def _synchronized(method):
+    # Inserts and samples hold the lock of the buffer, so that batches sampled
+    # in background threads never contain a partly written row.
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class ReplayBuffer(Dataset):
     def __init__(
         self,
@@ -41,32 +134,398 @@ class ReplayBuffer(Dataset):
         action_space: gym.Space,
         capacity: int,
         next_observation_space: Optional[gym.Space] = None,
+        storage_dir: Optional[str] = None,
+        task_key: Optional[str] = None,
+        initial_capacity: Optional[int] = None,
+        frame_codec: Optional[str] = None,
+        frame_cache_size: int = 4096,
+        num_decode_threads: int = 4,
     ):
+        """
+        :param storage_dir: if given, the columns are np.memmap files in this
+            directory instead of arrays in RAM, which allows buffers larger than
+            memory to be served from disk.
+        :param task_key: if given, the rows are indexed by the task in this
+            observation key, e.g. a one-hot "task_id", for set_task_sampling().
+        :param initial_capacity: if given, the columns start with this many
+            rows and double whenever an insert would not fit, up to capacity.
+            Slots never move, since the buffer only wraps around once it is
+            full.
+        :param frame_codec: if given ("png", "jpeg" or "zlib"), the "pixels"
+            observations are stored encoded in CompressedFrames columns,
+            decoded when sampled by num_decode_threads threads and cached in
+            an LRU cache of frame_cache_size frames.
+        """
+        assert frame_codec is None or storage_dir is None, (
+            "Compressed frames are kept in memory."
+        )
         if next_observation_space is None:
             next_observation_space = observation_space
 
-        observation_data = _init_replay_dict(observation_space, capacity)
-        next_observation_data = _init_replay_dict(next_observation_space, capacity)
+        if storage_dir is not None:
+            os.makedirs(storage_dir, exist_ok=True)
+
+        num_allocated = capacity
+        if initial_capacity is not None:
+            num_allocated = min(max(initial_capacity, 1), capacity)
+
+        frame_columns = None
+        if frame_codec is not None:
+            frame_columns = dict(
+                capacity=capacity,
+                codec=frame_codec,
+                cache_size=frame_cache_size,
+                num_threads=num_decode_threads,
+            )
+
+        observation_data = _init_replay_dict(
+            observation_space, num_allocated, storage_dir, "observations", frame_columns
+        )
+        next_observation_data = _init_replay_dict(
+            next_observation_space,
+            num_allocated,
+            storage_dir,
+            "next_observations",
+            frame_columns,
+        )
         dataset_dict = dict(
             observations=observation_data,
             next_observations=next_observation_data,
-            actions=np.empty((capacity, *action_space.shape), dtype=action_space.dtype),
-            rewards=np.empty((capacity,), dtype=np.float32),
-            masks=np.empty((capacity,), dtype=np.float32),
-            dones=np.empty((capacity,), dtype=bool),
+            actions=_empty(
+                (num_allocated, *action_space.shape),
+                action_space.dtype,
+                storage_dir,
+                "actions",
+            ),
+            rewards=_empty((num_allocated,), np.float32, storage_dir, "rewards"),
+            masks=_empty((num_allocated,), np.float32, storage_dir, "masks"),
+            dones=_empty((num_allocated,), bool, storage_dir, "dones"),
         )
 
         super().__init__(dataset_dict)
+        # Slots are numbered up to capacity, also before all are allocated.
+        self.dataset_len = capacity
+        self._num_allocated = num_allocated
 
         self._size = 0
         self._capacity = capacity
         self._insert_index = 0
+        self._storage_dir = storage_dir
+        # Rows ever inserted and rows written to the last snapshot.
+        self._num_inserted = 0
+        self._num_saved = 0
+        self._snapshot_writer = None
+        # Rows are indexed by trajectory, given as trajectory_id on insert or
+        # the trajectory counter otherwise.
+        self._traj_counter = 0
+        self._traj_index = TrajectoryIndex(capacity)
+        self._task_key = task_key
+        self._task_index = None if task_key is None else TaskIndex(capacity)
+        self._task_sampling = False
+        self._task_weights = None
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        # Locks and the snapshot thread cannot be pickled, e.g. for the
+        # processes of a SharedMemorySampler.
+        state = dict(self.__dict__)
+        state["_lock"] = None
+        state["_snapshot_writer"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
 
     def __len__(self) -> int:
         return self._size
 
+    def increment_traj_counter(self):
+        self._traj_counter += 1
+
+    @_synchronized
     def insert(self, data_dict: DatasetDict):
+        if "trajectory_id" in data_dict:
+            data_dict = dict(data_dict)
+            trajectory_id = int(data_dict.pop("trajectory_id"))
+        else:
+            trajectory_id = self._traj_counter
+        self._reserve(self._insert_index + 1)
         _insert_recursively(self.dataset_dict, data_dict, self._insert_index)
+        self._traj_index.append(trajectory_id, self._num_inserted, 1)
+        if self._task_index is not None:
+            self._index_tasks(
+                np.asarray(data_dict["observations"][self._task_key])[None],
+                np.array([self._insert_index]),
+            )
+        if self._sample_indices is not None:
+            self._sample_indices.add(self._insert_index)
 
         self._insert_index = (self._insert_index + 1) % self._capacity
         self._size = min(self._size + 1, self._capacity)
+        self._num_inserted += 1
+
+    @_synchronized
+    def insert_episode(self, episode_dict: DatasetDict):
+        """Inserts a whole episode, given as arrays with a leading time axis."""
+        episode_dict, trajectory_id = self._pop_trajectory_id(episode_dict)
+        episode_len = _check_lengths(episode_dict)
+        start = 0
+        while start < episode_len:
+            num_rows = min(episode_len - start, self._capacity - self._insert_index)
+            self._insert_rows(
+                _sample(episode_dict, np.s_[start : start + num_rows]), trajectory_id
+            )
+            start += num_rows
+        if episode_dict["dones"][-1]:
+            self.increment_traj_counter()
+
+    def _pop_trajectory_id(self, episode_dict: DatasetDict):
+        # An episode is one trajectory, with the id of its first step if given,
+        # and the trajectory counter is incremented after its last step.
+        episode_dict = dict(episode_dict)
+        trajectory_id = episode_dict.pop("trajectory_id", None)
+        if trajectory_id is None:
+            return episode_dict, self._traj_counter
+        return episode_dict, int(np.asarray(trajectory_id).reshape(-1)[0])
+
+    def _insert_rows(
+        self, rows: DatasetDict, trajectory_id: Optional[int] = None
+    ) -> np.ndarray:
+        # Writes rows at the insert index; they must fit before the end of the buffer.
+        num_rows = _check_lengths(rows)
+        assert self._insert_index + num_rows <= self._capacity
+        self._reserve(self._insert_index + num_rows)
+        slots = np.arange(self._insert_index, self._insert_index + num_rows)
+        _insert_recursively(
+            self.dataset_dict,
+            rows,
+            np.s_[self._insert_index : self._insert_index + num_rows],
+        )
+        if trajectory_id is None:
+            trajectory_id = self._traj_counter
+        self._traj_index.append(trajectory_id, self._num_inserted, num_rows)
+        if self._task_index is not None:
+            self._index_tasks(rows["observations"][self._task_key], slots)
+        if self._sample_indices is not None:
+            self._sample_indices.add_many(slots)
+
+        self._insert_index = (self._insert_index + num_rows) % self._capacity
+        self._size = min(self._size + num_rows, self._capacity)
+        self._num_inserted += num_rows
+        return slots
+
+    def _reserve(self, num_rows: int):
+        # Grows the columns, geometrically, so that they have num_rows rows.
+        if num_rows > self._num_allocated:
+            num_rows = min(max(num_rows, 2 * self._num_allocated), self._capacity)
+            # All allocated rows are copied: load() writes the rows of a
+            # snapshot before it restores the size.
+            _grow_columns(self.dataset_dict, num_rows, self._num_allocated)
+            self._num_allocated = num_rows
+
+    def _index_tasks(self, task_values: np.ndarray, slots: np.ndarray):
+        self._task_index.set_labels(slots, self._task_index.label(task_values))
+        self._task_index.add(slots)
+
+    @_synchronized
+    def set_task_sampling(
+        self,
+        stratified: bool = True,
+        task_weights: Optional[Sequence[float]] = None,
+        task_key: Optional[str] = None,
+    ):
+        """Samples batches stratified by task instead of uniformly.
+
+        Every task gets batch_size * its share of task_weights transitions,
+        with the rest of the batch drawn from the weights. task_weights has
+        a weight per task label, in the order the tasks were first inserted;
+        tasks are weighted equally by default. Ignores filter().
+
+        :param task_key: for a buffer built without a task_key, the
+            observation key to index its rows, and later inserts, by.
+        """
+        if task_key is not None and self._task_index is None:
+            self._task_key = task_key
+            self._task_index = TaskIndex(self._capacity)
+            # Labeled from the oldest row, as if they were inserted now.
+            slots, _ = self._episode_rows()
+            self._index_tasks(self.dataset_dict["observations"][task_key][slots], slots)
+            self._task_index.add(slots[self._is_sampleable(slots)])
+        assert self._task_index is not None, "The buffer has no task_key."
+        self._task_sampling = stratified
+        self._task_weights = task_weights
+
+    def task_counts(self) -> np.ndarray:
+        """The number of transitions of every task, by label."""
+        return self._task_index.counts()
+
+    @_synchronized
+    def sample(
+        self,
+        batch_size: int,
+        keys: Optional[Iterable[str]] = None,
+        indx: Optional[np.ndarray] = None,
+        out: Optional[DatasetDict] = None,
+        sort_indices: bool = False,
+    ):
+        if indx is None and self._task_sampling:
+            indx = self._sample_task_indices(batch_size)
+            if sort_indices:
+                # The drawn rows need not keep their order.
+                indx = np.sort(indx)
+                sort_indices = False
+        return super().sample(
+            batch_size, keys, indx, out=out, sort_indices=sort_indices
+        )
+
+    def _sample_task_indices(self, batch_size: int) -> np.ndarray:
+        sizes = self._task_index.batch_sizes(
+            self.np_random, batch_size, self._task_weights
+        )
+        return self._task_index.sample(self.np_random, sizes)
+
+    def _is_sampleable(self, slots: np.ndarray) -> np.ndarray:
+        return np.asarray(slots) < self._size
+
+    def _episode_rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        # The rows from the oldest to the newest.
+        rows = (self._insert_index - self._size + np.arange(self._size)) % self._capacity
+        return rows, np.full((self._size,), True)
+
+    @_synchronized
+    def get_random_trajs(self, num_trajs: int) -> DatasetDict:
+        """Samples trajectories uniformly from the trajectory index.
+
+        Returns a dict with a list of the rows of each trajectory per key.
+        Rows of trajectories that do not wrap around the end of the buffer
+        are views into it.
+        """
+        oldest = self._num_inserted - self._size
+        _, starts, ends = self._traj_index.sample(self.np_random, num_trajs, oldest)
+        trajs = []
+        for start, end in zip(starts, ends):
+            first = start % self._capacity
+            if first + end - start <= self._capacity:
+                indx = np.s_[first : first + end - start]
+            else:
+                indx = np.arange(start, end) % self._capacity
+            trajs.append(_sample(self.dataset_dict, indx))
+        return {k: [traj[k] for traj in trajs] for k in self.dataset_dict}
+
+    def _snapshot_state(self) -> Dict[str, np.ndarray]:
+        # Copies, since the snapshot is written in the background.
+        return dict(
+            capacity=np.int64(self._capacity),
+            insert_index=np.int64(self._insert_index),
+            size=np.int64(self._size),
+            num_inserted=np.int64(self._num_inserted),
+            traj_counter=np.int64(self._traj_counter),
+            **self._traj_index.state_dict(),
+            **({} if self._task_index is None else self._task_index.state_dict()),
+        )
+
+    def _restore_snapshot_state(self, state: Dict[str, np.ndarray]):
+        assert int(state["capacity"]) == self._capacity, "Capacity mismatch."
+        self._insert_index = int(state["insert_index"])
+        self._size = int(state["size"])
+        self._num_inserted = int(state["num_inserted"])
+        self._traj_counter = int(state["traj_counter"])
+        self._traj_index.load_state_dict(state)
+        if self._task_index is not None:
+            self._task_index = TaskIndex(self._capacity)
+            self._task_index.load_state_dict(state)
+            self._index_tasks(
+                self.dataset_dict["observations"][self._task_key][: self._size],
+                np.arange(self._size),
+            )
+
+    def save(self, path: str, wait: bool = False, block_size: int = 4096) -> Future:
+        """Snapshots the buffer into the directory path in the background.
+
+        Only the rows inserted since the previous save are written, as new
+        chunks. The first save of a buffer, and saves once the chunks hold
+        twice the capacity, write the whole buffer instead and delete the old
+        chunks. Rows modified in place rather than inserted are only saved
+        by such full snapshots.
+
+        Rows are copied from the buffer in blocks of block_size rows by the
+        background thread, which only holds the lock of the buffer while it
+        copies a block. Rows inserted meanwhile are added to the snapshot,
+        which ends with the state of the buffer after them. Compressed
+        frames are written encoded.
+
+        :param wait: block until the snapshot is written.
+        """
+        writer = self._snapshot_writer
+        if writer is not None:
+            writer.wait()
+        if writer is None or writer.path != path:
+            writer = self._snapshot_writer = SnapshotWriter(path)
+            compact = True
+        else:
+            with self._lock:
+                num_new = self._num_inserted - self._num_saved
+            compact = writer.num_rows + num_new > 2 * self._capacity
+
+        future = writer.submit(self._write_snapshot, writer, compact, block_size)
+        if wait:
+            future.result()
+        return future
+
+    def _inserted_slots(self, first: int, num_rows: int) -> np.ndarray:
+        # The slots of num_rows rows, from the first-th row ever inserted.
+        start = self._insert_index - (self._num_inserted - first)
+        return (start + np.arange(num_rows)) % self._capacity
+
+    def _write_snapshot(self, writer: SnapshotWriter, compact: bool, block_size: int):
+        with self._lock:
+            first = self._num_inserted if compact else self._num_saved
+            size = self._size
+        if compact:
+            for start in range(0, size, block_size):
+                slots = np.arange(start, min(start + block_size, size))
+                with self._lock:
+                    rows = _read_rows(self.dataset_dict, slots)
+                writer.write_chunk(slots, rows)
+
+        # Then the rows inserted since first, until the rest fits in a block,
+        # which is copied with the state of the buffer.
+        while True:
+            with self._lock:
+                first = max(first, self._num_inserted - self._capacity)
+                num_rows = self._num_inserted - first
+                slots = self._inserted_slots(first, min(num_rows, block_size))
+                rows = _read_rows(self.dataset_dict, slots)
+                if num_rows <= block_size:
+                    state = self._snapshot_state()
+                    self._num_saved = self._num_inserted
+                    break
+            writer.write_chunk(slots, rows)
+            first += len(slots)
+        if len(slots) > 0:
+            writer.write_chunk(slots, rows)
+        writer.commit(state, compact)
+
+    def load(self, path: str):
+        """Restores a snapshot written by save() into this buffer.
+
+        Later saves to the same path append to the loaded snapshot.
+        """
+        # The snapshot thread copies rows under the lock.
+        if self._snapshot_writer is not None:
+            self._snapshot_writer.wait()
+        with self._lock:
+            chunks, state = read_snapshot(path)
+            num_rows = 0
+            for chunk in chunks:
+                slots, rows = read_chunk(path, chunk)
+                if len(slots) > 0:
+                    self._reserve(int(slots.max()) + 1)
+                _write_rows(self.dataset_dict, rows, slots)
+                num_rows += len(slots)
+            self._restore_snapshot_state(state)
+            self._num_saved = self._num_inserted
+
+            self._snapshot_writer = SnapshotWriter(path)
+            self._snapshot_writer.resume(chunks, num_rows)
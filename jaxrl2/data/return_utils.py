@@ -0,0 +1,105 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def _episode_ends(num_steps: int, dones: Optional[np.ndarray]) -> np.ndarray:
+    ends = np.zeros((num_steps,), dtype=bool)
+    if dones is not None:
+        ends[:] = np.asarray(dones, dtype=bool).reshape(-1)
+    ends[-1] = True
+    return ends
+
+
+def episode_boundaries(dones: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end (exclusive) steps of flat, concatenated episodes.
+
+    dones marks the last step of every episode; the last step of the array
+    always ends one.
+    """
+    ends = np.flatnonzero(_episode_ends(len(dones), dones)) + 1
+    starts = np.concatenate([[0], ends[:-1]])
+    return starts, ends
+
+
+def episode_returns(rewards: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Undiscounted returns of the episodes starting at starts."""
+    rewards = np.asarray(rewards, dtype=np.float64).reshape(-1)
+    return np.add.reduceat(rewards, starts)
+
+
+def _reverse_affine_scan(values: np.ndarray, coefs: np.ndarray) -> np.ndarray:
+    """Solves x_t = values_t + coefs_t * x_{t+1} for all t, with x_T = 0.
+
+    Uses log2(longest chain) vectorized passes that double the number of
+    summed terms, so no products of coefs above one are formed.
+    """
+    x = values.copy()
+    c = coefs.copy()
+    shift = 1
+    while shift < len(x) and c[:-shift].any():
+        x[:-shift] += c[:-shift] * x[shift:]
+        c[:-shift] *= c[shift:]
+        shift *= 2
+    return x
+
+
+def discounted_returns(
+    rewards: np.ndarray,
+    discount: float,
+    masks: Optional[np.ndarray] = None,
+    dones: Optional[np.ndarray] = None,
+    bootstrap_last: bool = False,
+) -> np.ndarray:
+    """Monte Carlo returns of flat, concatenated episodes.
+
+    G_t = r_t + discount * m_t * G_{t+1} within an episode. dones marks the
+    last step of every episode; the last step of the arrays always ends one.
+    After the last step of an episode, G is 0, or r_last / (1 - discount),
+    i.e. the last reward repeated forever, if bootstrap_last.
+    """
+    rewards = np.asarray(rewards)
+    dtype = np.result_type(rewards.dtype, np.float32)
+    rewards = rewards.reshape(-1).astype(np.float64)
+    if masks is None:
+        masks = np.ones_like(rewards)
+    masks = np.asarray(masks, dtype=np.float64).reshape(-1)
+    ends = _episode_ends(len(rewards), dones)
+
+    coefs = discount * masks
+    values = rewards.copy()
+    if bootstrap_last:
+        values[ends] += coefs[ends] * rewards[ends] / (1 - discount)
+    coefs[ends] = 0
+    return _reverse_affine_scan(values, coefs).astype(dtype)
+
+
+def nstep_returns(
+    rewards: np.ndarray,
+    n: int,
+    discount: float,
+    masks: Optional[np.ndarray] = None,
+    dones: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Discounted sums of the next n rewards of flat, concatenated episodes.
+
+    The sum stops after a step with mask 0 and at the end of the episode, as
+    in discounted_returns without bootstrapping.
+    """
+    rewards = np.asarray(rewards)
+    dtype = np.result_type(rewards.dtype, np.float32)
+    rewards = rewards.reshape(-1).astype(np.float64)
+    if masks is None:
+        masks = np.ones_like(rewards)
+    masks = np.asarray(masks, dtype=np.float64).reshape(-1)
+    ends = _episode_ends(len(rewards), dones)
+
+    # alive[t] is the discounted weight of reward t + k for the return of t.
+    num_steps = len(rewards)
+    returns = rewards.copy()
+    alive = np.ones_like(rewards)
+    for k in range(1, min(n, num_steps)):
+        alive = alive[: num_steps - k] * discount * masks[k - 1 : num_steps - 1]
+        alive *= ~ends[k - 1 : num_steps - 1]
+        returns[: num_steps - k] += alive * rewards[k:]
+    return returns.astype(dtype)
@@ -0,0 +1,383 @@
+import copy
+import mmap
+import multiprocessing
+import pickle
+import queue
+import time
+import traceback
+import weakref
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Optional
+
+import jax
+import numpy as np
+from flax import traverse_util
+from flax.core import frozen_dict
+
+
+class _SharedArray(object):
+    """Placeholder for an array that worker processes attach to by name."""
+
+    def __init__(
+        self,
+        shape: tuple,
+        dtype: np.dtype,
+        name: Optional[str] = None,
+        filename: Optional[str] = None,
+        offset: int = 0,
+    ):
+        self.shape = shape
+        self.dtype = dtype
+        self.name = name
+        self.filename = filename
+        self.offset = offset
+
+    @property
+    def key(self):
+        # A memory-mapped column that grows is mapped again from the same file.
+        return self.name or (self.filename, self.offset, self.shape, np.dtype(self.dtype).str)
+
+    def attach(self) -> np.ndarray:
+        if self.filename is not None:
+            return np.memmap(
+                self.filename,
+                dtype=self.dtype,
+                mode="r",
+                offset=self.offset,
+                shape=self.shape,
+            )
+        block = shared_memory.SharedMemory(name=self.name)
+        array = np.ndarray(self.shape, self.dtype, buffer=block.buf)
+        # The block is closed once the array is gone, e.g. when the dataset
+        # no longer reaches it after a column grew.
+        weakref.finalize(array, block.close).atexit = False
+        return array
+
+
+def _shared_empty(shape: tuple, dtype: np.dtype, blocks: list):
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    block = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    blocks.append(block)
+    array = np.ndarray(shape, dtype, buffer=block.buf)
+    # The mapping must outlive every view of the array, so only close it once
+    # the array is gone. Unlinking the name is done by the sampler.
+    weakref.finalize(array, block.close).atexit = False
+    return array, _SharedArray(shape, dtype, name=block.name)
+
+
+def _is_shareable_object(value) -> bool:
+    return hasattr(value, "__dict__") and type(value).__module__.startswith("jaxrl2.")
+
+
+def _share(value, arrays: dict, blocks: list, reached: set):
+    """Moves the arrays reachable from value to shared memory.
+
+    Returns the value for the trainer process, whose arrays are replaced in place
+    by shared copies, and a copy for the workers, in which they are replaced by
+    _SharedArray placeholders. Memory-mapped columns are shared by file name.
+    The keys of arrays that are reachable from value are added to reached.
+    """
+    if isinstance(value, np.ndarray):
+        if id(value) in arrays and arrays[id(value)][0] is value:
+            reached.add(id(value))
+            return value, arrays[id(value)][1]
+
+        if value.dtype.hasobject:
+            # E.g. the encoded frames of a CompressedFrames column.
+            raise TypeError(
+                "Arrays of Python objects cannot be shared with worker "
+                "processes; frame_codec cannot be used with sampling processes."
+            )
+        if isinstance(value, np.memmap) and isinstance(value.base, mmap.mmap):
+            shared, placeholder = value, _SharedArray(
+                value.shape, value.dtype, filename=value.filename, offset=value.offset
+            )
+        else:
+            shared, placeholder = _shared_empty(value.shape, value.dtype, blocks)
+            shared[...] = value
+        arrays[id(shared)] = (shared, placeholder)
+        reached.add(id(shared))
+        return shared, placeholder
+    elif isinstance(value, dict):
+        worker_value = {}
+        for k, v in list(value.items()):
+            value[k], worker_value[k] = _share(v, arrays, blocks, reached)
+        return value, worker_value
+    elif isinstance(value, list):
+        worker_value = []
+        for i, v in enumerate(value):
+            value[i], worker_v = _share(v, arrays, blocks, reached)
+            worker_value.append(worker_v)
+        return value, worker_value
+    elif isinstance(value, (np.random.Generator, np.random.RandomState)):
+        # Workers are reseeded for every batch.
+        return value, None
+    elif _is_shareable_object(value):
+        worker_value = copy.copy(value)
+        for k, v in list(vars(value).items()):
+            shared, worker_value.__dict__[k] = _share(v, arrays, blocks, reached)
+            if shared is not v:
+                setattr(value, k, shared)
+        return value, worker_value
+    else:
+        return value, value
+
+
+def _attach(value, arrays: dict, reached: set):
+    if isinstance(value, _SharedArray):
+        if value.key not in arrays:
+            arrays[value.key] = value.attach()
+        reached.add(value.key)
+        return arrays[value.key]
+    elif isinstance(value, dict):
+        return {k: _attach(v, arrays, reached) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_attach(v, arrays, reached) for v in value]
+    elif _is_shareable_object(value):
+        for k, v in list(vars(value).items()):
+            setattr(value, k, _attach(v, arrays, reached))
+        return value
+    else:
+        return value
+
+
+def _flatten(batch) -> Dict[tuple, np.ndarray]:
+    return traverse_util.flatten_dict(frozen_dict.unfreeze(batch))
+
+
+def _worker(
+    tasks: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    slot_placeholders: list,
+    sample_args: dict,
+):
+    # The slots are kept by reference, so only the dataset arrays are cached.
+    slots = [
+        {path: p.attach() for path, p in slot.items()}
+        for slot in slot_placeholders
+    ]
+    arrays = {}
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        task_id, slot, dataset, seed = task
+        try:
+            reached = set()
+            dataset = _attach(pickle.loads(dataset), arrays, reached)
+            # Arrays replaced in the dataset, e.g. by a growing column, are
+            # dropped, so that their blocks can be freed.
+            for key in arrays.keys() - reached:
+                del arrays[key]
+            # MixingReplayBuffer draws the sub-batch sizes from the global state.
+            dataset.seed(seed)
+            np.random.seed(seed)
+
+            # The rows are gathered straight into the shared slot.
+            out = traverse_util.unflatten_dict(slots[slot])
+            batch = _flatten(dataset.sample(**sample_args, out=out))
+            assert batch.keys() == slots[slot].keys(), "Inconsistent batch keys."
+            for path, value in batch.items():
+                if value is not slots[slot][path]:
+                    slots[slot][path][...] = value
+            results.put((task_id, slot, None))
+        except BaseException:
+            results.put((task_id, slot, traceback.format_exc()))
+
+
+def _shutdown(tasks: multiprocessing.Queue, processes: list, blocks: list):
+    for _ in processes:
+        try:
+            tasks.put_nowait(None)
+        except (queue.Full, ValueError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=1.0)
+        if process.is_alive():
+            process.terminate()
+    for block in blocks:
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedMemorySampler(object):
+    """Samples batches in worker processes.
+
+    The arrays of the dataset (a ReplayBuffer, MemoryEfficientReplayBuffer,
+    MixingReplayBuffer or any other jaxrl2 dataset) are moved to shared memory
+    and the workers attach to them, so gathers and frame stacking do not
+    contend for the GIL of the training process. Workers write the batches
+    into a ring of preallocated shared slots; the training process only maps
+    the next slot to the device and hands the slot back to the workers.
+
+    Each sample() call gets its own seed derived from seed and the batch
+    number, and batches are returned in order, so runs are reproducible for
+    any num_workers. Inserts into the dataset in the training process are
+    seen by the workers, as with PrefetchIterator.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        sample_args: dict,
+        num_workers: int = 2,
+        num_slots: int = 4,
+        seed: Optional[int] = None,
+        put_fn: Callable[[Any], Any] = jax.device_put,
+    ):
+        if sample_args.get("pack_frames", False):
+            # The slots have the shapes of one batch, and the number of packed
+            # frames varies from batch to batch.
+            raise ValueError(
+                "Batches with packed frames cannot be sampled by processes; "
+                "use num_processes=0 with pack_frames."
+            )
+        self._dataset = dataset
+        self._sample_args = sample_args
+        self._num_workers = num_workers
+        self._num_slots = num_slots
+        self._seed = np.random.SeedSequence(seed).entropy
+        self._put_fn = put_fn
+
+        self._arrays = {}
+        self._blocks = []
+        # (task id, blocks) of arrays the dataset no longer reaches, which are
+        # unlinked once the tasks before that id are done.
+        self._stale_blocks = []
+        self._processes = []
+        self._slots = None
+        self._next_task = 0
+        self._num_submitted = 0
+        self._done = {}
+
+        self.num_batches = 0
+        self.num_starved = 0
+        self.wait_time = 0.0
+
+    def _start(self):
+        # Batches are laid out like one sampled in the training process.
+        template = _flatten(self._dataset.sample(**self._sample_args))
+        self._slots, slot_placeholders = [], []
+        for _ in range(self._num_slots):
+            slot, placeholders = {}, {}
+            for path, value in template.items():
+                value = np.asarray(value)
+                slot[path], placeholders[path] = _shared_empty(
+                    value.shape, value.dtype, self._blocks
+                )
+            self._slots.append(slot)
+            slot_placeholders.append(placeholders)
+
+        # Forking a process that has initialized jax is unsafe.
+        context = multiprocessing.get_context("spawn")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._processes = [
+            context.Process(
+                target=_worker,
+                args=(self._tasks, self._results, slot_placeholders, self._sample_args),
+                daemon=True,
+            )
+            for _ in range(self._num_workers)
+        ]
+        for process in self._processes:
+            process.start()
+        self._finalizer = weakref.finalize(
+            self, _shutdown, self._tasks, self._processes, self._blocks
+        )
+
+        for slot in range(self._num_slots):
+            self._submit(slot)
+
+    def _submit(self, slot: int):
+        # The dataset is pickled right away, so that the task sees the size and
+        # the insert index of the dataset at this point.
+        reached = set()
+        _, dataset = _share(self._dataset, self._arrays, self._blocks, reached)
+        stale = {
+            self._arrays.pop(key)[1].name for key in list(self._arrays) if key not in reached
+        }
+        if stale:
+            # The earlier tasks may still attach to these blocks by name.
+            self._stale_blocks.append(
+                (self._num_submitted, [b for b in self._blocks if b.name in stale])
+            )
+        seed = np.random.SeedSequence([self._seed, self._num_submitted])
+        self._tasks.put(
+            (
+                self._num_submitted,
+                slot,
+                pickle.dumps(dataset),
+                int(seed.generate_state(1)[0]),
+            )
+        )
+        self._num_submitted += 1
+
+    def _wait(self, task_id: int) -> int:
+        while task_id not in self._done:
+            try:
+                done_id, slot, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self._processes):
+                    self.close()
+                    raise RuntimeError("A sampling worker died.")
+                continue
+            if error is not None:
+                self.close()
+                raise RuntimeError(f"A sampling worker failed:\n{error}")
+            self._done[done_id] = slot
+        return self._done.pop(task_id)
+
+    def _unlink_stale_blocks(self):
+        # The tasks up to the next one are done, as they are waited for in order.
+        while self._stale_blocks and self._stale_blocks[0][0] <= self._next_task + 1:
+            _, blocks = self._stale_blocks.pop(0)
+            for block in blocks:
+                self._blocks.remove(block)
+                block.unlink()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._slots is None:
+            self._start()
+
+        if self._next_task not in self._done and self._results.empty():
+            self.num_starved += 1
+
+        t0 = time.time()
+        slot = self._wait(self._next_task)
+        self.wait_time += time.time() - t0
+        self._unlink_stale_blocks()
+
+        batch = {path: value for path, value in self._slots[slot].items()}
+        if jax.default_backend() == "cpu":
+            # device_put can alias host memory on CPU, and the slot is reused.
+            batch = {path: value.copy() for path, value in batch.items()}
+        batch = frozen_dict.freeze(traverse_util.unflatten_dict(batch))
+        batch = jax.block_until_ready(self._put_fn(batch))
+
+        self._submit(slot)
+        self._next_task += 1
+        self.num_batches += 1
+        return batch
+
+    def close(self):
+        if self._slots is not None:
+            self._finalizer()
+
+    @property
+    def stats(self):
+        """Queue-starvation counters, e.g. for logging."""
+        return {
+            "num_batches": self.num_batches,
+            "num_starved": self.num_starved,
+            "starved_fraction": self.num_starved / max(self.num_batches, 1),
+            "wait_time": self.wait_time,
+        }
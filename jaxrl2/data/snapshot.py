@@ -0,0 +1,120 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+STATE_FILE = "state.npz"
+
+
+def _flatten(dataset_dict, prefix: str = "") -> Dict[str, np.ndarray]:
+    flat = {}
+    for k, v in dataset_dict.items():
+        if isinstance(v, dict):
+            flat.update(_flatten(v, f"{prefix}{k}/"))
+        else:
+            flat[f"{prefix}{k}"] = v
+    return flat
+
+
+def _unflatten(flat: Dict[str, np.ndarray]) -> dict:
+    dataset_dict = {}
+    for key, v in flat.items():
+        *path, k = key.split("/")
+        d = dataset_dict
+        for p in path:
+            d = d.setdefault(p, {})
+        d[k] = v
+    return dataset_dict
+
+
+def _save_atomic(path: str, **arrays):
+    # A job preempted while writing leaves the previous file intact.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str) -> Tuple[List[str], Dict[str, np.ndarray]]:
+    """Returns the chunk files and the buffer state of a snapshot."""
+    with np.load(os.path.join(path, STATE_FILE)) as state_file:
+        state = {k: state_file[k] for k in state_file.files}
+    chunks = [str(chunk) for chunk in state.pop("chunks")]
+    return chunks, state
+
+
+def read_chunk(path: str, chunk: str) -> Tuple[np.ndarray, dict]:
+    """Returns the slots and the rows written to them of a snapshot chunk."""
+    with np.load(os.path.join(path, chunk)) as chunk_file:
+        rows = {k: chunk_file[k] for k in chunk_file.files}
+    slots = rows.pop("slots")
+    return slots, _unflatten(rows)
+
+
+class SnapshotWriter(object):
+    """Writes append-only chunked snapshots of a replay buffer.
+
+    Every snapshot adds chunk files with the rows inserted since the
+    previous snapshot and their slots, then atomically replaces the state
+    file, which lists the chunks to replay in order and holds the insert
+    index, size and other state of the buffer. A compacting snapshot
+    writes all rows of the buffer and deletes the chunks it replaces.
+
+    Snapshots are written by a function run in a background thread, one
+    snapshot at a time, which adds its chunks with write_chunk() and
+    finishes with commit().
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._executor = ThreadPoolExecutor(1)
+        self._future = None
+        self._chunks = []
+        self._next_chunk = 0
+        self._new_chunks = []
+        self._new_rows = 0
+        self.num_rows = 0
+
+    def resume(self, chunks: List[str], num_rows: int):
+        """Continues appending to the chunks of a loaded snapshot."""
+        self._chunks = list(chunks)
+        self._next_chunk = 1 + max(
+            [int(chunk[len("chunk_") : -len(".npz")]) for chunk in chunks], default=-1
+        )
+        self.num_rows = num_rows
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Runs fn(*args), which writes a snapshot, in the background thread.
+
+        Waits for the previous snapshot, whose errors are raised here.
+        """
+        self.wait()
+        self._future = self._executor.submit(fn, *args)
+        return self._future
+
+    def write_chunk(self, slots: np.ndarray, rows: dict):
+        """Writes rows and their slots as a chunk of the current snapshot."""
+        # Chunks of a snapshot that failed are never listed, so are replaced.
+        chunk = f"chunk_{self._next_chunk:06d}.npz"
+        self._next_chunk += 1
+        _save_atomic(os.path.join(self.path, chunk), slots=slots, **_flatten(rows))
+        self._new_chunks.append(chunk)
+        self._new_rows += len(slots)
+
+    def commit(self, state: Dict[str, np.ndarray], compact: bool):
+        """Ends the current snapshot, which leaves the buffer in state."""
+        chunks = self._new_chunks if compact else self._chunks + self._new_chunks
+        _save_atomic(os.path.join(self.path, STATE_FILE), chunks=np.array(chunks), **state)
+        if compact:
+            for old_chunk in self._chunks:
+                os.remove(os.path.join(self.path, old_chunk))
+        self._chunks = chunks
+        self.num_rows = self._new_rows + (0 if compact else self.num_rows)
+        self._new_chunks = []
+        self._new_rows = 0
+
+    def wait(self):
+        if self._future is not None:
+            self._future.result()
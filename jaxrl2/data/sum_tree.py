@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class SumTree(object):
+    """Priorities of capacity slots in a complete binary tree stored as an array.
+
+    Node i has the children 2 * i and 2 * i + 1, the root is node 1 and the
+    leaves are the last nodes. Every node holds the sum and the minimum
+    positive priority of its subtree. Batches are updated and searched one
+    tree level at a time, in O(batch size * log capacity) vectorized work.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._depth = int(np.ceil(np.log2(max(capacity, 1))))
+        self._num_leaves = 1 << self._depth
+        self._sums = np.zeros((2 * self._num_leaves,), dtype=np.float64)
+        self._mins = np.full((2 * self._num_leaves,), np.inf, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return self._sums[1]
+
+    @property
+    def min(self) -> float:
+        """The smallest positive priority."""
+        return self._mins[1]
+
+    def get(self, indx: np.ndarray) -> np.ndarray:
+        return self._sums[self._num_leaves + np.asarray(indx)]
+
+    def update(self, indx: np.ndarray, priorities: np.ndarray):
+        """Sets the priorities of the slots indx; of repeated slots, the last one."""
+        indx = np.asarray(indx, dtype=np.int64).reshape(-1)
+        if indx.size == 0:
+            return
+        priorities = np.broadcast_to(np.asarray(priorities, dtype=np.float64), indx.shape)
+        indx, last = np.unique(indx[::-1], return_index=True)
+        priorities = priorities[::-1][last]
+
+        nodes = indx + self._num_leaves
+        self._sums[nodes] = priorities
+        self._mins[nodes] = np.where(priorities > 0, priorities, np.inf)
+        for _ in range(self._depth):
+            # The nodes stay sorted, so the parents of siblings are adjacent.
+            nodes = nodes // 2
+            nodes = nodes[np.r_[True, nodes[1:] != nodes[:-1]]]
+            children = 2 * nodes
+            self._sums[nodes] = self._sums[children] + self._sums[children + 1]
+            self._mins[nodes] = np.minimum(self._mins[children], self._mins[children + 1])
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        """The slots where the prefix sums of the priorities reach values.
+
+        Slots without priority are never returned, even where rounding makes
+        a value reach the total.
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(values.shape, dtype=np.int64)
+        for _ in range(self._depth):
+            children = 2 * nodes
+            left_sums = self._sums[children]
+            go_right = (values >= left_sums) & (self._sums[children + 1] > 0)
+            values -= np.where(go_right, left_sums, 0)
+            nodes = children + go_right
+        return nodes - self._num_leaves
@@ -0,0 +1,151 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from jaxrl2.data.index_set import IndexSet
+
+
+class TaskIndex(object):
+    """The rows of a buffer grouped by task, for stratified sampling.
+
+    Tasks are the distinct values of a column, e.g. one-hot task ids, and
+    are labeled in the order they are first seen. Every row has the label
+    of its task, and rows that can be sampled are kept in an IndexSet per
+    task. Whether a row can be sampled is independent of its label, so a
+    row that is relabeled when it is overwritten keeps it.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._row_labels = np.full((capacity,), -1, dtype=np.int64)
+        self._sampleable = np.full((capacity,), False, dtype=bool)
+        self._labels = {}
+        self._tasks = []
+        self._sets = []
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def tasks(self) -> List[np.ndarray]:
+        """The task values, by label."""
+        return self._tasks
+
+    def counts(self) -> np.ndarray:
+        """The number of rows that can be sampled, by label."""
+        return np.array([len(s) for s in self._sets], dtype=np.int64)
+
+    def label(self, values: np.ndarray) -> np.ndarray:
+        """Labels the rows of values, adding the tasks not seen before."""
+        values = np.ascontiguousarray(values).reshape(len(values), -1)
+        if len(values) == 1:
+            return np.array([self._label(values[0])], dtype=np.int64)
+        tasks, first, inverse = np.unique(
+            values, axis=0, return_index=True, return_inverse=True
+        )
+        labels = np.empty((len(tasks),), dtype=np.int64)
+        for i in np.argsort(first):
+            labels[i] = self._label(tasks[i])
+        return labels[inverse.reshape(-1)]
+
+    def _label(self, task: np.ndarray) -> int:
+        key = task.tobytes()
+        label = self._labels.get(key)
+        if label is None:
+            label = self._labels[key] = len(self._tasks)
+            self._tasks.append(task.copy())
+            self._sets.append(IndexSet(self._capacity))
+        return label
+
+    def set_labels(self, slots: np.ndarray, labels: np.ndarray):
+        slots = np.atleast_1d(slots)
+        moved = slots[self._sampleable[slots]]
+        self._discard_from_sets(moved)
+        self._row_labels[slots] = labels
+        self._add_to_sets(moved)
+
+    def add(self, slots: np.ndarray):
+        """Marks the rows at slots as ones that can be sampled."""
+        slots = np.atleast_1d(slots)
+        slots = slots[~self._sampleable[slots]]
+        self._sampleable[slots] = True
+        self._add_to_sets(slots)
+
+    def discard(self, slots: np.ndarray):
+        slots = np.atleast_1d(slots)
+        slots = slots[self._sampleable[slots]]
+        self._sampleable[slots] = False
+        self._discard_from_sets(slots)
+
+    def _add_to_sets(self, slots: np.ndarray):
+        labels = self._row_labels[slots]
+        if len(slots) == 1:
+            if labels[0] >= 0:
+                self._sets[labels[0]].add(slots[0])
+            return
+        for label in np.unique(labels[labels >= 0]):
+            self._sets[label].add_many(slots[labels == label])
+
+    def _discard_from_sets(self, slots: np.ndarray):
+        labels = self._row_labels[slots]
+        if len(slots) == 1:
+            if labels[0] >= 0:
+                self._sets[labels[0]].discard(slots[0])
+            return
+        for label in np.unique(labels[labels >= 0]):
+            self._sets[label].discard_many(slots[labels == label])
+
+    def batch_sizes(
+        self, np_random, batch_size: int, task_weights: Optional[Sequence[float]] = None
+    ) -> np.ndarray:
+        """The number of rows to sample from every task.
+
+        Each task gets batch_size * its normalized weight rows rounded down,
+        and the rest of the batch is drawn from the weights. Tasks without
+        rows, or beyond the given weights, get none; without weights all
+        tasks get the same.
+        """
+        counts = self.counts()
+        weights = np.zeros((len(counts),), dtype=np.float64)
+        if task_weights is None:
+            weights[:] = 1
+        else:
+            task_weights = np.asarray(task_weights, dtype=np.float64)[: len(counts)]
+            weights[: len(task_weights)] = task_weights
+        weights[counts == 0] = 0
+        assert weights.sum() > 0, "No rows of the weighted tasks."
+        weights /= weights.sum()
+
+        sizes = np.floor(batch_size * weights).astype(np.int64)
+        rest = batch_size - sizes.sum()
+        if rest > 0:
+            sizes += np_random.multinomial(rest, weights)
+        return sizes
+
+    def sample(self, np_random, sizes: np.ndarray) -> np.ndarray:
+        """Samples sizes[label] slots of every task, grouped by task."""
+        sizes = np.asarray(sizes)
+        counts = self.counts()
+        assert np.all(counts[sizes > 0] > 0), "Cannot sample tasks without rows."
+        # One draw for the whole batch, scaled to the rows of every task.
+        uniform = np_random.random(sizes.sum())
+        positions = (uniform * np.repeat(counts, sizes)).astype(np.int64)
+
+        indx = np.empty((len(positions),), dtype=np.int64)
+        start = 0
+        for label in np.flatnonzero(sizes):
+            stop = start + sizes[label]
+            indx[start:stop] = self._sets[label].indices[positions[start:stop]]
+            start = stop
+        return indx
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        if not self._tasks:
+            return {}
+        return dict(tasks=np.stack(self._tasks))
+
+    def load_state_dict(self, state: Dict[str, np.ndarray]):
+        # Registers the tasks in the order of their labels; the rows are
+        # relabeled by the buffer.
+        for task in state.get("tasks", ()):
+            self._label(np.ascontiguousarray(task))
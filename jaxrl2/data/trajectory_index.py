@@ -0,0 +1,84 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+class TrajectoryIndex(object):
+    """Start and end positions of the trajectories in a ring buffer.
+
+    Positions count the rows ever inserted, so that the slot of a position
+    is position % capacity and wrapping around the buffer needs no updates:
+    rows overwritten by newer ones are those before the oldest position, and
+    trajectories are clipped to it when sampled. Trajectories are kept in
+    insertion order in a ring of at most capacity entries, since each has at
+    least one row.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._ids = np.zeros((capacity,), dtype=np.int64)
+        self._starts = np.zeros((capacity,), dtype=np.int64)
+        self._ends = np.zeros((capacity,), dtype=np.int64)
+        self._head = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, traj_id: int, position: int, num_rows: int):
+        """Records that rows [position, position + num_rows) belong to traj_id."""
+        if self._count > 0:
+            last = (self._head + self._count - 1) % self._capacity
+            if self._ids[last] == traj_id and self._ends[last] == position:
+                self._ends[last] = position + num_rows
+                self._evict(position + num_rows)
+                return
+
+        if self._count == self._capacity:
+            self._head = (self._head + 1) % self._capacity
+            self._count -= 1
+        last = (self._head + self._count) % self._capacity
+        self._ids[last] = traj_id
+        self._starts[last] = position
+        self._ends[last] = position + num_rows
+        self._count += 1
+        self._evict(position + num_rows)
+
+    def _evict(self, end: int):
+        # Drops the trajectories that were overwritten completely.
+        oldest = end - self._capacity
+        while self._count > 0 and self._ends[self._head] <= oldest:
+            self._head = (self._head + 1) % self._capacity
+            self._count -= 1
+
+    def _entries(self, positions: np.ndarray) -> np.ndarray:
+        return (self._head + positions) % self._capacity
+
+    def sample(self, np_random, num_trajs: int, oldest: int) -> Tuple[np.ndarray, ...]:
+        """Returns the ids, start and end positions of random trajectories.
+
+        Starts are clipped to the oldest position still in the buffer.
+        """
+        assert self._count > 0, "No trajectories were inserted."
+        if hasattr(np_random, "integers"):
+            positions = np_random.integers(self._count, size=num_trajs)
+        else:
+            positions = np_random.randint(self._count, size=num_trajs)
+        entries = self._entries(positions)
+        starts = np.maximum(self._starts[entries], oldest)
+        return self._ids[entries], starts, self._ends[entries]
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        entries = self._entries(np.arange(self._count))
+        return dict(
+            traj_ids=self._ids[entries],
+            traj_starts=self._starts[entries],
+            traj_ends=self._ends[entries],
+        )
+
+    def load_state_dict(self, state: Dict[str, np.ndarray]):
+        self._count = len(state["traj_ids"])
+        self._head = 0
+        self._ids[: self._count] = state["traj_ids"]
+        self._starts[: self._count] = state["traj_starts"]
+        self._ends[: self._count] = state["traj_ends"]
@@ -0,0 +1,100 @@
+import gym
+import numpy as np
+import pytest
+
+from jaxrl2.data import MemoryEfficientReplayBuffer, ReplayBuffer
+
+PIXEL_SHAPE = (2, 2, 1, 3)
+
+
+def _observation(columns, pixels: np.ndarray, value: float):
+    # columns are the observation columns of a Dict space, None for a Box.
+    if columns is None:
+        return np.full((3,), value, dtype=np.float32)
+    obs = {}
+    if "pixels" in columns:
+        obs["pixels"] = pixels
+    if "states" in columns:
+        obs["states"] = np.full((2,), value, dtype=np.float32)
+    return obs
+
+
+def insert_transitions(replay_buffer, start: int, stop: int, reward=None, offset: float = 0.0):
+    """Inserts the transitions start to stop, with episodes of 10 steps.
+
+    The observations and actions of transition i are offset + i, the next
+    observations offset + i + 1 and the rewards reward, i by default. The
+    newest frame of a stack is the step it was observed at.
+    """
+    columns = replay_buffer.dataset_dict["observations"]
+    pixel_shape = PIXEL_SHAPE
+    if not isinstance(columns, dict):
+        columns = None
+    elif "pixels" in columns:
+        pixel_shape = (*columns["pixels"].shape[1:], replay_buffer._num_stack)
+    pixels = np.full(pixel_shape, start, dtype=np.uint8)
+    for i in range(start, stop):
+        next_pixels = np.roll(pixels, -1, axis=-1)
+        next_pixels[..., -1] = i + 1
+        replay_buffer.insert(
+            dict(
+                observations=_observation(columns, pixels, offset + i),
+                actions=np.full((2,), offset + i, dtype=np.float32),
+                rewards=float(i) if reward is None else reward,
+                masks=1.0,
+                dones=i % 10 == 9,
+                next_observations=_observation(columns, next_pixels, offset + i + 1),
+            )
+        )
+        pixels = next_pixels
+
+
+def make_replay_buffer(
+    capacity: int,
+    num_transitions: int = None,
+    observations: str = "box",
+    pixel_shape: tuple = PIXEL_SHAPE,
+    reward=None,
+    offset: float = 0.0,
+    **kwargs,
+):
+    """Returns a buffer filled by insert_transitions with num_transitions,
+    capacity by default.
+
+    observations is "box" for a Box of 3 states, or "states", "pixels" or
+    "pixels_states" for a Dict with 2 states and frame stacks of pixel_shape,
+    which are stored by a MemoryEfficientReplayBuffer. kwargs are passed to
+    the buffer.
+    """
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+    if observations == "box":
+        observation_space = gym.spaces.Box(low=-1, high=1, shape=(3,), dtype=np.float32)
+    else:
+        spaces = {}
+        if "pixels" in observations:
+            spaces["pixels"] = gym.spaces.Box(low=0, high=255, shape=pixel_shape, dtype=np.uint8)
+        if "states" in observations:
+            spaces["states"] = gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+        observation_space = gym.spaces.Dict(spaces)
+
+    if "pixels" in observations:
+        replay_buffer = MemoryEfficientReplayBuffer(
+            observation_space, action_space, capacity, **kwargs
+        )
+    else:
+        replay_buffer = ReplayBuffer(observation_space, action_space, capacity, **kwargs)
+
+    if num_transitions is None:
+        num_transitions = capacity
+    insert_transitions(replay_buffer, 0, num_transitions, reward, offset)
+    return replay_buffer
+
+
+@pytest.fixture(name="make_replay_buffer")
+def make_replay_buffer_fixture():
+    return make_replay_buffer
+
+
+@pytest.fixture(name="insert_transitions")
+def insert_transitions_fixture():
+    return insert_transitions
@@ -0,0 +1,79 @@
+import jax
+import numpy as np
+import pytest
+
+from jaxrl2.data.batch_pool import BatchPool
+from jaxrl2.data.dataset import MixingReplayBuffer
+
+BATCH_SIZE = 8
+
+CAPACITY = 30
+
+
+def _assert_equal(batch, expected):
+    jax.tree_util.tree_map(np.testing.assert_array_equal, batch, expected)
+
+
+def _replay_buffer(make_replay_buffer, reward):
+    return make_replay_buffer(CAPACITY, observations="pixels_states", reward=reward)
+
+
+def test_sample_into_out(make_replay_buffer):
+    replay_buffer = _replay_buffer(make_replay_buffer, 1.0)
+    indx = replay_buffer._correct_indices.indices[:BATCH_SIZE]
+    pool = BatchPool()
+
+    for include_pixels in [True, False]:
+        expected = replay_buffer.sample(BATCH_SIZE, indx=indx, include_pixels=include_pixels)
+        out = pool.get(expected)
+        batch = replay_buffer.sample(
+            BATCH_SIZE, indx=indx, include_pixels=include_pixels, out=out
+        )
+        _assert_equal(batch, expected)
+        assert batch["observations"]["pixels"] is out["observations"]["pixels"]
+        assert batch["actions"] is out["actions"]
+        pool.release(out)
+
+    plain_buffer = make_replay_buffer(CAPACITY)
+    expected = plain_buffer.sample(BATCH_SIZE, indx=indx)
+    out = pool.get(expected)
+    _assert_equal(plain_buffer.sample(BATCH_SIZE, indx=indx, out=out), expected)
+
+    # Out-of-range indices raise as without out.
+    indx = np.array([0, CAPACITY])
+    with pytest.raises(IndexError):
+        plain_buffer.sample(2, indx=indx)
+    with pytest.raises(IndexError):
+        plain_buffer.sample(2, indx=indx, out=pool.get(plain_buffer.sample(2)))
+
+
+def test_mixing_sample_into_out(make_replay_buffer):
+    mixing_buffer = MixingReplayBuffer(
+        [_replay_buffer(make_replay_buffer, 1.0), _replay_buffer(make_replay_buffer, -1.0)], 0.25
+    )
+    mixing_buffer.seed(0)
+    expected = mixing_buffer.sample(BATCH_SIZE)
+
+    mixing_buffer.seed(0)
+    out = BatchPool().get(expected)
+    batch = mixing_buffer.sample(BATCH_SIZE, out=out)
+    _assert_equal(batch, expected)
+    assert batch["rewards"] is out["rewards"]
+    np.testing.assert_array_equal(out["rewards"][: BATCH_SIZE // 4], 1.0)
+    np.testing.assert_array_equal(out["rewards"][BATCH_SIZE // 4 :], -1.0)
+
+
+def test_batch_pool_reuses_buffers():
+    pool = BatchPool()
+    template = dict(a=np.zeros((4, 2), dtype=np.float32), b=dict(c=np.zeros((4,), dtype=bool)))
+    other_template = dict(a=np.zeros((5, 2), dtype=np.float32), b=dict(c=np.zeros((5,), dtype=bool)))
+
+    first = pool.get(template)
+    second = pool.get(template)
+    assert first is not second
+    assert first["b"]["c"].dtype == bool and first["a"].shape == (4, 2)
+
+    pool.release(first)
+    assert pool.get(template) is first
+    assert pool.get(other_template)["a"].shape == (5, 2)
+    assert pool.num_allocated == 3
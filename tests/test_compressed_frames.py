@@ -0,0 +1,101 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from jaxrl2.data.compressed_frames import CompressedFrames
+from jaxrl2.data.shared_memory_sampler import SharedMemorySampler
+
+BATCH_SIZE = 8
+
+CAPACITY = 30
+
+
+@pytest.mark.parametrize("codec", ["zlib", "png"])
+def test_compressed_frames(codec):
+    if codec == "png":
+        pytest.importorskip("PIL")
+    frames = np.random.RandomState(0).randint(0, 256, size=(6, 4, 4, 6), dtype=np.uint8)
+    column = CompressedFrames(6, (4, 4, 6), codec=codec, cache_size=2)
+
+    column[:4] = frames[:4]
+    column[4] = frames[4]
+    np.testing.assert_array_equal(column[:5], frames[:5])
+    # Indices are decoded once and can have any shape.
+    np.testing.assert_array_equal(column.take([[1, 1], [0, 3]]), frames[[[1, 1], [0, 3]]])
+
+    # Overwriting a slot invalidates its cached frame.
+    column[3] = frames[5]
+    np.testing.assert_array_equal(column[3], frames[5])
+    np.testing.assert_array_equal(column[5], np.zeros((4, 4, 6), dtype=np.uint8))
+    assert 0 < column.nbytes
+
+    # Indices as for arrays.
+    column[np.int64(-1)] = frames[0]
+    np.testing.assert_array_equal(column[5], frames[0])
+    np.testing.assert_array_equal(column[4:0:-2], frames[[4, 2]])
+    np.testing.assert_array_equal(column[np.array([True, False] * 3)], frames[[0, 2, 4]])
+    with pytest.raises(IndexError):
+        column[6] = frames[0]
+    with pytest.raises(IndexError):
+        column[-7]
+
+
+def test_compressed_replay_buffer(make_replay_buffer):
+    # Wraps around the end of the buffer.
+    replay_buffer, compressed_buffer = [
+        make_replay_buffer(
+            CAPACITY,
+            CAPACITY + 15,
+            observations="pixels_states",
+            pixel_shape=(4, 4, 3, 3),
+            frame_codec=frame_codec,
+        )
+        for frame_codec in [None, "zlib"]
+    ]
+    for buffer in [replay_buffer, compressed_buffer]:
+        buffer.seed(0)
+
+    np.testing.assert_array_equal(
+        compressed_buffer._correct_indices.indices, replay_buffer._correct_indices.indices
+    )
+    for include_pixels in [True, False]:
+        for pack_frames in [False, True]:
+            expected = replay_buffer.sample(
+                BATCH_SIZE, include_pixels=include_pixels, pack_frames=pack_frames
+            )
+            batch = compressed_buffer.sample(
+                BATCH_SIZE, include_pixels=include_pixels, pack_frames=pack_frames
+            )
+            for k in expected["observations"]:
+                np.testing.assert_array_equal(
+                    batch["observations"][k], expected["observations"][k]
+                )
+            np.testing.assert_array_equal(batch["rewards"], expected["rewards"])
+            if include_pixels and not pack_frames:
+                np.testing.assert_array_equal(
+                    batch["next_observations"]["pixels"],
+                    expected["next_observations"]["pixels"],
+                )
+
+
+def test_compressed_frames_pickle():
+    frames = np.random.RandomState(0).randint(0, 256, size=(3, 4, 4, 3), dtype=np.uint8)
+    column = CompressedFrames(3, (4, 4, 3), codec="zlib")
+    column[:] = frames
+    column.take([0, 1, 2])
+
+    loaded = pickle.loads(pickle.dumps(column))
+    assert len(loaded._cache) == 0
+    np.testing.assert_array_equal(loaded[:], frames)
+
+
+def test_compressed_replay_buffer_sampling_processes(make_replay_buffer):
+    # Encoded frames are Python objects, which cannot live in shared memory.
+    replay_buffer = make_replay_buffer(
+        CAPACITY, observations="pixels", pixel_shape=(4, 4, 3, 3), frame_codec="zlib"
+    )
+    sampler = SharedMemorySampler(replay_buffer, dict(batch_size=BATCH_SIZE), num_workers=1)
+    with pytest.raises(TypeError):
+        next(sampler)
+    sampler.close()
@@ -3,7 +3,6 @@ import numpy as np
 import pytest
 
 from jaxrl2.data import Dataset
-from jaxrl2.data.d4rl_dataset import D4RLDataset
 
 DATASET_LEN = 10
 DATASET_DICT = {
@@ -61,6 +60,9 @@ def test_sample_keys():
 
 
 def test_d4rl_dataset():
+    pytest.importorskip("d4rl")
+    from jaxrl2.data.d4rl_dataset import D4RLDataset
+
     env = gym.make("halfcheetah-expert-v2")
     dataset = D4RLDataset(env)
 
@@ -72,3 +74,13 @@ def test_split():
     train_dataset, test_dataset = dataset.split(0.6)
     assert len(train_dataset) == 6
     assert len(test_dataset) == 4
+
+
+def test_get_iterator():
+    dataset = Dataset(DATASET_DICT)
+    iterator = dataset.get_iterator(BATCH_SIZE, queue_size=2, num_workers=2)
+    for _ in range(5):
+        batch = next(iterator)
+        assert len(batch["action"]) == BATCH_SIZE
+    assert iterator.stats["num_batches"] == 5
+    iterator.close()
@@ -0,0 +1,184 @@
+import functools
+
+import gym
+import jax
+import numpy as np
+
+from jaxrl2.data import MemoryEfficientReplayBuffer, ReplayBuffer
+from jaxrl2.data.dataset import MixingReplayBufferParallel
+from jaxrl2.data.device_dataset import DeviceDataset, sample_device_batch
+
+BATCH_SIZE = 16
+
+CAPACITY = 40
+
+
+def _efficient_replay_buffer():
+    observation_space = gym.spaces.Dict(
+        dict(
+            pixels=gym.spaces.Box(low=0, high=255, shape=(2, 2, 1, 3), dtype=np.uint8),
+            states=gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32),
+        )
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+    replay_buffer = MemoryEfficientReplayBuffer(observation_space, action_space, CAPACITY)
+
+    obs = dict(
+        pixels=np.zeros((2, 2, 1, 3), dtype=np.uint8),
+        states=np.zeros((2,), dtype=np.float32),
+    )
+    # Wraps around the end of the buffer.
+    for i in range(CAPACITY + 15):
+        next_obs = dict(
+            pixels=np.roll(obs["pixels"], -1, axis=-1),
+            states=np.full((2,), i + 1, dtype=np.float32),
+        )
+        next_obs["pixels"][..., -1] = i + 1
+        replay_buffer.insert(
+            dict(
+                observations=obs,
+                actions=np.zeros((2,), dtype=np.float32),
+                rewards=float(i),
+                masks=1.0,
+                dones=i % 10 == 9,
+                next_observations=next_obs,
+            )
+        )
+        obs = next_obs
+    return replay_buffer
+
+
+@functools.partial(jax.jit, static_argnames="num_batches")
+def _sample(rng, batch, num_batches):
+    batches = []
+    for _ in range(num_batches):
+        rng, sampled = sample_device_batch(rng, batch)
+        batches.append(sampled)
+    return batches
+
+
+def test_device_dataset_efficient_replay_buffer():
+    replay_buffer = _efficient_replay_buffer()
+    # Rewards are unique, so they identify the sampled slots.
+    slots = {reward: slot for slot, reward in enumerate(replay_buffer.dataset_dict["rewards"])}
+
+    for include_pixels in [True, False]:
+        device_dataset = DeviceDataset.from_dataset(
+            replay_buffer, BATCH_SIZE, include_pixels=include_pixels
+        )
+        assert len(device_dataset) == len(replay_buffer._correct_indices)
+        assert next(iter(device_dataset)) is device_dataset
+
+        for batch in _sample(jax.random.PRNGKey(0), device_dataset, num_batches=3):
+            indx = np.array([slots[reward] for reward in np.asarray(batch["rewards"])])
+            expected = replay_buffer.sample(
+                BATCH_SIZE, indx=indx, include_pixels=include_pixels
+            )
+            jax.tree_util.tree_map(np.testing.assert_array_equal, batch, expected)
+
+
+def test_device_dataset_replay_buffer():
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(3,), dtype=np.float32)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+    replay_buffer = ReplayBuffer(observation_space, action_space, CAPACITY)
+    for i in range(CAPACITY // 2):
+        obs = np.full((3,), i, dtype=np.float32)
+        replay_buffer.insert(
+            dict(
+                observations=obs,
+                actions=np.zeros((2,), dtype=np.float32),
+                rewards=float(i),
+                next_observations=obs + 1,
+                masks=1.0,
+                dones=False,
+            )
+        )
+
+    device_dataset = DeviceDataset.from_dataset(replay_buffer, BATCH_SIZE)
+    (batch,) = _sample(jax.random.PRNGKey(1), device_dataset, num_batches=1)
+    indx = np.asarray(batch["rewards"]).astype(int)
+    assert indx.max() < len(replay_buffer)
+    expected = replay_buffer.sample(BATCH_SIZE, indx=indx)
+    jax.tree_util.tree_map(np.testing.assert_array_equal, batch, expected)
+
+    # Batches sampled on the host pass through unchanged.
+    rng = jax.random.PRNGKey(2)
+    new_rng, same_batch = sample_device_batch(rng, expected)
+    assert same_batch is expected
+    np.testing.assert_array_equal(new_rng, rng)
+
+
+def test_device_dataset_filtered_replay_buffer():
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(3,), dtype=np.float32)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+    replay_buffer = ReplayBuffer(observation_space, action_space, CAPACITY)
+    for i in range(CAPACITY // 2):
+        obs = np.full((3,), i, dtype=np.float32)
+        replay_buffer.insert(
+            dict(
+                observations=obs,
+                actions=np.zeros((2,), dtype=np.float32),
+                rewards=float(i),
+                next_observations=obs + 1,
+                masks=1.0,
+                dones=i % 5 == 4,
+            )
+        )
+    # Keeps the two episodes with the highest returns, rows 10 to 19.
+    replay_buffer.filter(percentile=50)
+
+    device_dataset = DeviceDataset.from_dataset(replay_buffer, BATCH_SIZE)
+    assert len(device_dataset) == 10
+    batches = _sample(jax.random.PRNGKey(1), device_dataset, num_batches=4)
+    indx = np.concatenate([np.asarray(batch["rewards"]) for batch in batches]).astype(int)
+    assert (indx >= 10).all() and (indx < 20).all()
+    expected = replay_buffer.sample(BATCH_SIZE, indx=indx[:BATCH_SIZE])
+    jax.tree_util.tree_map(np.testing.assert_array_equal, batches[0], expected)
+
+
+@functools.partial(jax.pmap, axis_name="devices")
+def _sample_sharded(rng, batch):
+    return sample_device_batch(rng, batch)[1]
+
+
+def test_device_dataset_sharded():
+    replay_buffer = _efficient_replay_buffer()
+    slots = {reward: slot for slot, reward in enumerate(replay_buffer.dataset_dict["rewards"])}
+    num_devices = jax.local_device_count()
+
+    device_dataset = DeviceDataset.from_dataset_sharded(
+        replay_buffer, BATCH_SIZE, include_pixels=False
+    )
+    assert len(device_dataset) == len(replay_buffer._correct_indices)
+
+    rngs = jax.random.split(jax.random.PRNGKey(0), num_devices)
+    batches = _sample_sharded(rngs, device_dataset)
+    parts = np.array_split(np.sort(replay_buffer._correct_indices.indices), num_devices)
+    for device, part in enumerate(parts):
+        batch = jax.tree_util.tree_map(lambda x: x[device], batches)
+        indx = np.array([slots[reward] for reward in np.asarray(batch["rewards"])])
+        assert np.isin(indx, part).all()
+        expected = replay_buffer.sample(BATCH_SIZE, indx=indx, include_pixels=False)
+        jax.tree_util.tree_map(np.testing.assert_array_equal, batch, expected)
+
+
+def test_mixing_replay_buffer_parallel_sharded():
+    replay_buffers = [_efficient_replay_buffer(), _efficient_replay_buffer()]
+    replay_buffers[1].dataset_dict["rewards"][:] *= -1
+    num_devices = jax.local_device_count()
+    mixing_buffer = MixingReplayBufferParallel(replay_buffers, 0.25, num_devices=num_devices)
+
+    device_dataset = mixing_buffer.get_sharded_dataset(BATCH_SIZE * num_devices)
+    rngs = jax.random.split(jax.random.PRNGKey(0), num_devices)
+    batches = _sample_sharded(rngs, device_dataset)
+    assert batches["rewards"].shape == (num_devices, BATCH_SIZE)
+    # The first BATCH_SIZE / 4 transitions of every device come from the first buffer.
+    assert (np.asarray(batches["rewards"])[:, : BATCH_SIZE // 4] >= 0).all()
+    assert (np.asarray(batches["rewards"])[:, BATCH_SIZE // 4 :] < 0).all()
+
+    # The host iterator has the same layout, with the sample arguments of the buffers.
+    iterator = mixing_buffer.get_iterator(BATCH_SIZE * num_devices, include_pixels=False)
+    batch = next(iterator)
+    iterator.close()
+    assert batch["rewards"].shape == (num_devices, BATCH_SIZE)
+    assert batch["observations"]["pixels"].shape[-1] == 4
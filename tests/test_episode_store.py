@@ -0,0 +1,97 @@
+import gym
+import numpy as np
+import pytest
+
+from jaxrl2.data import ReplayBuffer
+from jaxrl2.data.episode_store import EpisodeStore, EpisodeStoreWriter, is_episode_store
+
+CHUNK_SIZE = 7
+
+
+def _episodes():
+    rng = np.random.default_rng(0)
+    episodes = []
+    for episode_len in [3, 10, 1, 7, 20]:
+        episodes.append(
+            dict(
+                observations=dict(
+                    pixels=rng.integers(256, size=(episode_len, 4, 4, 3), dtype=np.uint8),
+                    states=rng.standard_normal((episode_len, 2)).astype(np.float32),
+                ),
+                actions=rng.standard_normal((episode_len, 2)).astype(np.float32),
+                rewards=rng.standard_normal(episode_len).astype(np.float32),
+            )
+        )
+    return episodes
+
+
+def test_episode_store(tmp_path):
+    episodes = _episodes()
+    with EpisodeStoreWriter(
+        str(tmp_path), chunk_size=CHUNK_SIZE, metadata=dict(discount=0.99)
+    ) as writer:
+        for episode in episodes:
+            writer.add_episode(episode)
+
+    assert is_episode_store(str(tmp_path))
+    store = EpisodeStore(str(tmp_path))
+    assert len(store) == len(episodes)
+    assert store.metadata == dict(discount=0.99)
+    np.testing.assert_array_equal(store.episode_lengths, [3, 10, 1, 7, 20])
+
+    for episode, stored_episode in zip(episodes, store.get_episodes()):
+        for k in ["actions", "rewards"]:
+            np.testing.assert_array_equal(episode[k], stored_episode[k])
+        for k in ["pixels", "states"]:
+            np.testing.assert_array_equal(
+                episode["observations"][k], stored_episode["observations"][k]
+            )
+
+    with pytest.raises(FileExistsError):
+        EpisodeStoreWriter(str(tmp_path))
+
+
+def test_episode_store_reads_selected_rows(tmp_path):
+    episodes = _episodes()
+    with EpisodeStoreWriter(str(tmp_path), chunk_size=CHUNK_SIZE) as writer:
+        for episode in episodes:
+            writer.add_episode(episode)
+
+    store = EpisodeStore(str(tmp_path))
+    # Episode 3 spans rows 14 to 20, i.e. chunk 2 only.
+    episode = store.get_episode(3, keys=["observations/pixels"])
+    assert list(episode.keys()) == ["observations"]
+    np.testing.assert_array_equal(
+        episode["observations"]["pixels"], episodes[3]["observations"]["pixels"]
+    )
+    assert list(store._chunks.keys()) == [("observations/pixels", 2)]
+
+
+def test_episode_store_to_replay_buffer(tmp_path):
+    episodes = _episodes()
+    with EpisodeStoreWriter(str(tmp_path), chunk_size=CHUNK_SIZE) as writer:
+        for episode in episodes:
+            episode = dict(episode)
+            episode["next_observations"] = episode["observations"]
+            episode["masks"] = np.ones_like(episode["rewards"])
+            episode["dones"] = np.zeros_like(episode["rewards"], dtype=bool)
+            writer.add_episode(episode)
+
+    observation_space = gym.spaces.Dict(
+        dict(
+            pixels=gym.spaces.Box(low=0, high=255, shape=(4, 4, 3), dtype=np.uint8),
+            states=gym.spaces.Box(low=-np.inf, high=np.inf, shape=(2,), dtype=np.float32),
+        )
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+    replay_buffer = ReplayBuffer(observation_space, action_space, 100)
+
+    store = EpisodeStore(str(tmp_path))
+    for episode in store.get_episodes([1, 4]):
+        replay_buffer.insert_episode(episode)
+
+    assert len(replay_buffer) == 30
+    np.testing.assert_array_equal(
+        replay_buffer.dataset_dict["actions"][:30],
+        np.concatenate([episodes[1]["actions"], episodes[4]["actions"]]),
+    )
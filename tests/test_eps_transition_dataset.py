@@ -0,0 +1,103 @@
+import os
+
+import jax
+import numpy as np
+import pytest
+
+from jaxrl2.data.dataset import MixingReplayBuffer
+from jaxrl2.data.eps_transition_dataset import EpisodicTransitionDataset
+
+
+def _episode(rng, length, success):
+    obs = [
+        dict(
+            pixels=rng.randint(0, 255, size=(4, 4, 3), dtype=np.uint8),
+            end_effector_pos=rng.rand(3).astype(np.float32),
+            task_id=np.zeros((2,), dtype=np.float32),
+        )
+        for _ in range(length + 1)
+    ]
+    return dict(
+        observations=obs[:-1],
+        next_observations=obs[1:],
+        actions=rng.rand(length, 2).astype(np.float32),
+        rewards=np.r_[np.zeros(length - 1), float(success)],
+        terminals=np.r_[np.zeros(length - 1), 1.0],
+    )
+
+
+def _write_paths(tmp_path):
+    rng = np.random.RandomState(0)
+    paths = []
+    for i in range(2):
+        path = str(tmp_path / f"{i}.npy")
+        episodes = [_episode(rng, 5 + j, j % 2) for j in range(4)]
+        np.save(path, np.array(episodes, dtype=object), allow_pickle=True)
+        paths.append(path)
+    return paths
+
+
+def test_lean_episodic_transition_dataset(tmp_path):
+    paths = _write_paths(tmp_path)
+    dataset = EpisodicTransitionDataset(paths)
+    lean_dataset = EpisodicTransitionDataset(paths, lean=True)
+
+    # The steps of the raw episodes are written straight into the same columns.
+    jax.tree_util.tree_map(
+        np.testing.assert_array_equal, dataset.dataset_dict, lean_dataset.dataset_dict
+    )
+    dtypes = jax.tree_util.tree_map(lambda column: column.dtype, dataset.dataset_dict)
+    assert jax.tree_util.tree_map(lambda column: column.dtype, lean_dataset.dataset_dict) == dtypes
+    assert len(lean_dataset.episodes) == 0
+    np.testing.assert_array_equal(lean_dataset.episodes_lens, [5, 6, 7, 8, 5, 6, 7, 8])
+
+    lean_dataset.seed(0)
+    trajs = lean_dataset.get_random_trajs(3)
+    for rewards, observations in zip(trajs["rewards"], trajs["observations"]):
+        assert observations["pixels"].shape == (len(rewards), 4, 4, 3, 1)
+        assert observations["state"].shape == (len(rewards), 5, 1)
+        # Rewards are only nonzero at the end of an episode.
+        assert not rewards[:-1].any()
+
+    filtered_dataset = EpisodicTransitionDataset(paths, lean=True, filter_success=True)
+    np.testing.assert_array_equal(filtered_dataset.episodes_lens, [6, 8, 6, 8])
+
+
+class _VisualizationAgent(object):
+    def make_value_reward_visulization(self, variant, trajs):
+        # Reads the trajectories the way the pixel agents do.
+        images = []
+        for itraj in range(len(trajs["rewards"])):
+            observations = trajs["observations"][itraj]
+            for t in range(len(trajs["actions"][itraj])):
+                images.append(observations["pixels"][t][..., -1])
+        return np.concatenate(images, axis=0)
+
+
+class _Logger(object):
+    def __init__(self):
+        self.logged = []
+
+    def log(self, info, step):
+        self.logged.append((info, step))
+
+
+def test_value_reward_visualizations_of_lean_dataset(tmp_path, monkeypatch):
+    pytest.importorskip("matplotlib")
+    pytest.importorskip("wandb")
+    monkeypatch.syspath_prepend(
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), "examples")
+    )
+    train_utils = pytest.importorskip("train_utils")
+
+    dataset = EpisodicTransitionDataset(_write_paths(tmp_path), lean=True)
+    dataset.seed(0)
+    mixing_buffer = MixingReplayBuffer([dataset, dataset], 0.5)
+    for i, buffer in enumerate([dataset, mixing_buffer]):
+        logger = _Logger()
+        train_utils.make_multiple_value_reward_visulizations(
+            _VisualizationAgent(), None, i, buffer, logger
+        )
+        assert [(list(info), step) for info, step in logger.logged] == [
+            (["reward_value_images"], i)
+        ]
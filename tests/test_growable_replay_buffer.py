@@ -0,0 +1,109 @@
+import gym
+import numpy as np
+
+from jaxrl2.data import MemoryEfficientReplayBuffer, ReplayBuffer
+
+CAPACITY = 20
+
+
+def _transition(i):
+    return dict(
+        observations=np.full((1,), i, dtype=np.float32),
+        actions=np.zeros((1,), dtype=np.float32),
+        rewards=float(i),
+        next_observations=np.full((1,), i + 1, dtype=np.float32),
+        masks=1.0,
+        dones=False,
+    )
+
+
+def test_replay_buffer_growth(tmp_path):
+    observation_space = gym.spaces.Box(low=0, high=100, shape=(1,), dtype=np.float32)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    fixed = ReplayBuffer(observation_space, action_space, CAPACITY)
+    growable = ReplayBuffer(observation_space, action_space, CAPACITY, initial_capacity=3)
+    memmapped = ReplayBuffer(
+        observation_space,
+        action_space,
+        CAPACITY,
+        storage_dir=str(tmp_path / "columns"),
+        initial_capacity=3,
+    )
+    assert len(growable.dataset_dict["rewards"]) == 3
+
+    sizes = []
+    for i in range(CAPACITY + 5):
+        for replay_buffer in (fixed, growable, memmapped):
+            replay_buffer.insert(_transition(i))
+        sizes.append(len(growable.dataset_dict["rewards"]))
+    assert sorted(set(sizes)) == [3, 6, 12, CAPACITY]
+
+    for replay_buffer in (growable, memmapped):
+        np.testing.assert_array_equal(
+            replay_buffer.dataset_dict["rewards"], fixed.dataset_dict["rewards"]
+        )
+        np.testing.assert_array_equal(
+            replay_buffer.sample(CAPACITY, indx=np.arange(CAPACITY))["observations"],
+            fixed.sample(CAPACITY, indx=np.arange(CAPACITY))["observations"],
+        )
+
+    # Snapshots are loaded into growable buffers as well.
+    fixed.save(str(tmp_path / "snapshot"), wait=True)
+    loaded = ReplayBuffer(observation_space, action_space, CAPACITY, initial_capacity=3)
+    loaded.load(str(tmp_path / "snapshot"))
+    np.testing.assert_array_equal(loaded.dataset_dict["rewards"], fixed.dataset_dict["rewards"])
+
+
+
+def test_load_snapshot_chunks_into_growable_buffer(tmp_path, make_replay_buffer):
+    replay_buffer = make_replay_buffer(100, reward=1.0)
+    replay_buffer.save(str(tmp_path / "snapshot"), wait=True, block_size=10)
+
+    # The columns grow while the chunks are written.
+    loaded = make_replay_buffer(100, num_transitions=0, initial_capacity=4)
+    loaded.load(str(tmp_path / "snapshot"))
+    assert len(loaded) == 100
+    for k in ("observations", "actions", "rewards", "next_observations"):
+        np.testing.assert_array_equal(loaded.dataset_dict[k], replay_buffer.dataset_dict[k])
+
+def test_memory_efficient_replay_buffer_growth():
+    observation_space = gym.spaces.Dict(
+        dict(pixels=gym.spaces.Box(low=0, high=255, shape=(1, 1, 1, 3), dtype=np.uint8))
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    fixed = MemoryEfficientReplayBuffer(observation_space, action_space, CAPACITY)
+    growable = MemoryEfficientReplayBuffer(
+        observation_space, action_space, CAPACITY, initial_capacity=2
+    )
+
+    # Episodes inserted whole and step by step, past the end of the buffer.
+    for episode in range(6):
+        frames = 10 * episode + np.arange(6, dtype=np.uint8).reshape(6, 1, 1, 1)
+        stacks = np.lib.stride_tricks.sliding_window_view(frames, 3, axis=0)
+        episode_dict = dict(
+            observations=dict(pixels=stacks[:3]),
+            next_observations=dict(pixels=stacks[1:4]),
+            actions=np.zeros((3, 1), dtype=np.float32),
+            rewards=np.full((3,), episode, dtype=np.float32),
+            masks=np.ones((3,), dtype=np.float32),
+            dones=np.arange(3) == 2,
+        )
+        for replay_buffer in (fixed, growable):
+            if episode % 2 == 0:
+                replay_buffer.insert_episode(episode_dict)
+            else:
+                for t in range(3):
+                    replay_buffer.insert(
+                        {
+                            k: {kk: vv[t] for kk, vv in v.items()} if isinstance(v, dict) else v[t]
+                            for k, v in episode_dict.items()
+                        }
+                    )
+        np.testing.assert_array_equal(growable._is_correct_index, fixed._is_correct_index)
+
+    indx = fixed._correct_indices.indices
+    expected = fixed.sample(len(indx), indx=indx)
+    batch = growable.sample(len(indx), indx=indx)
+    for k in ("observations", "next_observations"):
+        np.testing.assert_array_equal(batch[k]["pixels"], expected[k]["pixels"])
+    np.testing.assert_array_equal(batch["rewards"], expected["rewards"])
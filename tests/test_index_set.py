@@ -0,0 +1,39 @@
+import numpy as np
+
+from jaxrl2.data.index_set import IndexSet
+
+CAPACITY = 50
+
+
+def test_index_set():
+    index_set = IndexSet(CAPACITY)
+    reference = set()
+    rng = np.random.default_rng(0)
+
+    for _ in range(500):
+        indxs = rng.integers(CAPACITY, size=rng.integers(1, 8))
+        if rng.random() < 0.5:
+            index_set.add_many(indxs)
+            reference |= set(indxs.tolist())
+        else:
+            index_set.discard_many(indxs)
+            reference -= set(indxs.tolist())
+
+        indx = int(rng.integers(CAPACITY))
+        if rng.random() < 0.5:
+            index_set.add(indx)
+            reference.add(indx)
+        else:
+            index_set.discard(indx)
+            reference.discard(indx)
+
+        assert len(index_set) == len(reference)
+        assert set(index_set.indices.tolist()) == reference
+
+
+def test_index_set_clear():
+    index_set = IndexSet(CAPACITY)
+    index_set.add_many(np.arange(10))
+    index_set.clear()
+    assert len(index_set) == 0
+    assert 3 not in index_set
@@ -0,0 +1,56 @@
+import jax
+import numpy as np
+import pytest
+
+CAPACITY = 20
+
+PIXEL_SHAPE = (2, 2, 1, 3)
+
+
+def _episode_transitions(length: int):
+    pixels = np.zeros(PIXEL_SHAPE, dtype=np.uint8)
+    transitions = []
+    for i in range(length):
+        next_pixels = np.roll(pixels, -1, axis=-1)
+        next_pixels[..., -1] = i + 1
+        transitions.append(
+            dict(
+                observations=dict(pixels=pixels, states=np.full((2,), i, dtype=np.float32)),
+                actions=np.full((2,), i, dtype=np.float32),
+                rewards=np.float32(i),
+                masks=np.float32(1.0),
+                dones=np.bool_(i == length - 1),
+                next_observations=dict(
+                    pixels=next_pixels, states=np.full((2,), i + 1, dtype=np.float32)
+                ),
+            )
+        )
+        pixels = next_pixels
+    return transitions
+
+
+@pytest.mark.parametrize("length", [15, 30])
+def test_efficient_replay_buffer_insert_episode(make_replay_buffer, length):
+    # An episode of 30 steps wraps around the end of the buffer.
+    replay_buffer = make_replay_buffer(
+        CAPACITY, 0, observations="pixels_states", pixel_shape=PIXEL_SHAPE
+    )
+    episode_replay_buffer = make_replay_buffer(
+        CAPACITY, 0, observations="pixels_states", pixel_shape=PIXEL_SHAPE
+    )
+
+    transitions = _episode_transitions(length)
+    for transition in transitions:
+        replay_buffer.insert(transition)
+    episode = jax.tree_util.tree_map(lambda *xs: np.stack(xs), *transitions)
+    episode_replay_buffer.insert_episode(episode)
+
+    assert replay_buffer._insert_index == episode_replay_buffer._insert_index
+    assert np.array_equal(
+        replay_buffer._is_correct_index, episode_replay_buffer._is_correct_index
+    )
+
+    indx = np.flatnonzero(replay_buffer._is_correct_index)
+    batch = replay_buffer.sample(len(indx), indx=indx)
+    episode_batch = episode_replay_buffer.sample(len(indx), indx=indx)
+    jax.tree_util.tree_map(np.testing.assert_array_equal, batch, episode_batch)
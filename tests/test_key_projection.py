@@ -0,0 +1,105 @@
+import gym
+import numpy as np
+
+from jaxrl2.data import MemoryEfficientReplayBuffer, ReplayBuffer
+from jaxrl2.data.dataset import PropertyReplayBuffer, select_keys
+
+CAPACITY = 20
+
+
+def _schema(batch, prefix=""):
+    schema = set()
+    for k, v in batch.items():
+        if isinstance(v, np.ndarray):
+            schema.add(prefix + k)
+        else:
+            schema |= _schema(v, prefix + k + "/") or {prefix + k + "/"}
+    return schema
+
+
+def test_select_keys():
+    dataset_dict = dict(
+        observations=dict(pixels=np.zeros(2), states=np.zeros(2)),
+        actions=np.zeros(2),
+        rewards=np.zeros(2),
+    )
+    selected = select_keys(dataset_dict, ["observations/states", "actions"])
+    assert _schema(selected) == {"observations/states", "actions"}
+    assert selected["actions"] is dataset_dict["actions"]
+    # A dict and any of its columns select the whole dict.
+    selected = select_keys(dataset_dict, ["observations/states", "observations"])
+    assert _schema(selected) == {"observations/pixels", "observations/states"}
+
+
+def test_replay_buffer_keys():
+    observation_space = gym.spaces.Dict(
+        dict(
+            pixels=gym.spaces.Box(low=0, high=255, shape=(2, 2, 1, 3), dtype=np.uint8),
+            states=gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32),
+        )
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = ReplayBuffer(observation_space, action_space, CAPACITY)
+    replay_buffer.insert(
+        dict(
+            observations=observation_space.sample(),
+            actions=action_space.sample(),
+            rewards=0.0,
+            next_observations=observation_space.sample(),
+            masks=1.0,
+            dones=False,
+        )
+    )
+    batch = replay_buffer.sample(4, keys=("observations/states", "actions"))
+    assert _schema(batch) == {"observations/states", "actions"}
+
+    # Properties are columns like the others.
+    property_buffer = PropertyReplayBuffer(replay_buffer, dict(cql_alpha=1.0, temperature=0.1))
+    batch = property_buffer.sample(4, keys=("actions", "cql_alpha"))
+    assert _schema(batch) == {"actions", "cql_alpha"}
+
+
+def test_memory_efficient_replay_buffer_keys():
+    observation_space = gym.spaces.Dict(
+        dict(
+            pixels=gym.spaces.Box(low=0, high=255, shape=(2, 2, 1, 3), dtype=np.uint8),
+            states=gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32),
+        )
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = MemoryEfficientReplayBuffer(observation_space, action_space, CAPACITY)
+    frames = np.arange(6, dtype=np.uint8).reshape(6, 1, 1, 1) * np.ones((1, 2, 2, 1), np.uint8)
+    stacks = np.lib.stride_tricks.sliding_window_view(frames, 3, axis=0)
+    states = np.zeros((3, 2), dtype=np.float32)
+    replay_buffer.insert_episode(
+        dict(
+            observations=dict(pixels=stacks[:3], states=states),
+            next_observations=dict(pixels=stacks[1:4], states=states),
+            actions=np.zeros((3, 1), dtype=np.float32),
+            rewards=np.zeros((3,), dtype=np.float32),
+            masks=np.ones((3,), dtype=np.float32),
+            dones=np.arange(3) == 2,
+        )
+    )
+
+    batch = replay_buffer.sample(4, keys=("observations", "actions"))
+    assert _schema(batch) == {"observations/pixels", "observations/states", "actions"}
+    assert batch["observations"]["pixels"].shape == (4, 2, 2, 1, 3)
+
+    batch = replay_buffer.sample(4, keys=("actions", "next_observations/pixels"))
+    assert _schema(batch) == {"actions", "next_observations/pixels"}
+
+    batch = replay_buffer.sample(4, keys=("actions", "rewards"))
+    assert _schema(batch) == {"actions", "rewards"}
+
+    # Without include_pixels, the next frames are part of the observations.
+    batch = replay_buffer.sample(
+        4, keys=("observations/states", "next_observations/pixels"), include_pixels=False
+    )
+    assert _schema(batch) == {"observations/pixels", "observations/states", "next_observations/"}
+    assert batch["observations"]["pixels"].shape == (4, 2, 2, 1, 4)
+
+    batch = replay_buffer.sample(
+        4, keys=("observations/pixels", "actions"), include_pixels=False, pack_frames=True
+    )
+    assert _schema(batch) == {"observations/frames", "observations/frame_indices", "actions"}
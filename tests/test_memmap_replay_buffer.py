@@ -0,0 +1,30 @@
+import jax
+import numpy as np
+
+CAPACITY = 20
+
+
+def test_efficient_replay_buffer_memmap(make_replay_buffer, tmp_path):
+    # Wraps around the end of the buffer.
+    replay_buffer = make_replay_buffer(
+        CAPACITY, CAPACITY + 15, observations="pixels", storage_dir=str(tmp_path)
+    )
+    assert isinstance(replay_buffer.dataset_dict["observations"]["pixels"], np.memmap)
+    in_memory_replay_buffer = make_replay_buffer(CAPACITY, CAPACITY + 15, observations="pixels")
+
+    for _ in range(20):
+        batch = replay_buffer.sample(4)
+        obs = batch["observations"]["pixels"]
+        next_obs = batch["next_observations"]["pixels"]
+        reward = batch["rewards"]
+
+        assert np.all(next_obs - obs >= 0)
+        assert np.all(next_obs - obs <= 1)
+        assert np.allclose(next_obs[..., -1], np.reshape(reward + 1, [-1, 1, 1, 1]))
+
+    indx = np.flatnonzero(replay_buffer._is_correct_index)
+    jax.tree_util.tree_map(
+        np.testing.assert_array_equal,
+        replay_buffer.sample(len(indx), indx=indx),
+        in_memory_replay_buffer.sample(len(indx), indx=indx),
+    )
@@ -0,0 +1,49 @@
+import numpy as np
+
+from jaxrl2.data.dataset import MixingReplayBuffer
+
+BATCH_SIZE = 8
+
+CAPACITY = 10
+
+
+def _replay_buffer(make_replay_buffer, reward):
+    # The observations and actions of a buffer are 100 * reward + step.
+    return make_replay_buffer(CAPACITY, observations="states", reward=reward, offset=100 * reward)
+
+
+def test_mixing_replay_buffer_n_way(make_replay_buffer):
+    mixing_buffer = MixingReplayBuffer(
+        [_replay_buffer(make_replay_buffer, r) for r in [0.0, 1.0, 2.0]], [2, 1, 1]
+    )
+    mixing_buffer.seed(0)
+    expected = np.repeat([0.0, 1.0, 2.0], [4, 2, 2])
+
+    # The first batch is concatenated and the next ones gathered into a new
+    # batch with its schema.
+    for _ in range(2):
+        batch = mixing_buffer.sample(BATCH_SIZE)
+        np.testing.assert_array_equal(batch["rewards"], expected)
+        np.testing.assert_array_equal(batch["observations"]["states"][:, 0] // 100, expected)
+        assert batch["observations"]["states"].dtype == np.float32
+
+    # Buffers with less than one transition per batch are sampled at random.
+    mixing_buffer.set_mixing_ratio([1, 1, 0.01])
+    assert mixing_buffer.sample(BATCH_SIZE)["rewards"].shape == (BATCH_SIZE,)
+
+    mixing_buffer.mixing_schedule = lambda step: [1, 0, 0] if step < 10 else [0, 0, 1]
+    mixing_buffer.set_step(0)
+    np.testing.assert_array_equal(mixing_buffer.sample(BATCH_SIZE)["rewards"], 0.0)
+    mixing_buffer.set_step(10)
+    np.testing.assert_array_equal(mixing_buffer.sample(BATCH_SIZE)["rewards"], 2.0)
+
+
+def test_mixing_replay_buffer_action_stats(make_replay_buffer):
+    replay_buffers = [_replay_buffer(make_replay_buffer, r) for r in [0.0, 5.0, 20.0]]
+    mixing_buffer = MixingReplayBuffer(replay_buffers, [1, 1, 1])
+
+    # With equal weights and sizes, the pooled stats are those of all actions.
+    actions = np.concatenate([b.dataset_dict["actions"] for b in replay_buffers])
+    action_stats = mixing_buffer.compute_action_stats()
+    np.testing.assert_allclose(action_stats["mean"], actions.mean(axis=0), rtol=1e-6)
+    np.testing.assert_allclose(action_stats["std"], actions.std(axis=0), rtol=1e-6)
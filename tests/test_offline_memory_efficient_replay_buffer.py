@@ -0,0 +1,75 @@
+import pickle
+import time
+
+import gym
+import numpy as np
+
+from jaxrl2.data.offline_memory_efficient_replay_buffer import (
+    OfflineMemoryEfficientReplayBuffer,
+)
+
+CAPACITY = 24
+
+EPISODE_LENGTH = 6
+
+
+def _write_episodes(tmp_path, num_episodes):
+    for i in range(num_episodes):
+        steps = 10 * i + np.arange(EPISODE_LENGTH)
+        frame = steps[:, None, None, None] * np.ones((1, 2, 2, 1))
+        episode = dict(
+            camera_0_rgb=frame.astype(np.uint8),
+            camera_1_rgb=frame.astype(np.uint8),
+            camera_gripper_rgb=frame.astype(np.uint8),
+            ee_forces=steps[:, None].astype(np.float32),
+            ee_qp=steps[:, None].astype(np.float32),
+            robot_qp=steps[:, None].astype(np.float32),
+            action=steps[:, None].astype(np.float32),
+            reward=steps.astype(np.float32),
+        )
+        with open(tmp_path / f"episode_{i}.pkl", "wb") as f:
+            pickle.dump(episode, f)
+
+
+def _spaces():
+    observation_space = gym.spaces.Dict(
+        dict(
+            pixels=gym.spaces.Box(low=0, high=255, shape=(2, 2, 3, 3), dtype=np.uint8),
+            ee_forces=gym.spaces.Box(low=-np.inf, high=np.inf, shape=(1,), dtype=np.float32),
+            ee_qp=gym.spaces.Box(low=-np.inf, high=np.inf, shape=(1,), dtype=np.float32),
+            robot_qp=gym.spaces.Box(low=-np.inf, high=np.inf, shape=(1,), dtype=np.float32),
+        )
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    return observation_space, action_space
+
+
+def test_offline_memory_efficient_replay_buffer(tmp_path):
+    _write_episodes(tmp_path, 20)
+    replay_buffer = OfflineMemoryEfficientReplayBuffer(
+        *_spaces(), CAPACITY, data_url=str(tmp_path) + "/", replay=2, num_workers=0
+    )
+    assert len(replay_buffer) == CAPACITY
+
+    batch = replay_buffer.sample(64)
+    steps = batch["observations"]["ee_qp"][:, 0]
+    # Step t + 1 has the action and reward of the transition from step t.
+    np.testing.assert_array_equal(batch["rewards"], steps + 1)
+    np.testing.assert_array_equal(batch["next_observations"]["ee_qp"][:, 0], steps + 1)
+    # The first frame of an episode is repeated before it.
+    first = steps - steps % 10
+    stacks = np.maximum(steps[:, None] + np.arange(-2, 2), first[:, None])
+    np.testing.assert_array_equal(batch["observations"]["pixels"][:, 0, 0, 0], stacks[:, :-1])
+    np.testing.assert_array_equal(batch["next_observations"]["pixels"][:, 0, 0, 0], stacks[:, 1:])
+
+    # Episodes are streamed in while batches are sampled, at most one per
+    # two batches.
+    iterator = replay_buffer.get_iterator(sample_args=dict(batch_size=8))
+    for _ in range(20):
+        next(iterator)
+    deadline = time.time() + 10
+    while replay_buffer._num_streamed < 5 and time.time() < deadline:
+        time.sleep(0.01)
+    replay_buffer.stop_streaming()
+    assert 5 <= replay_buffer._num_streamed <= replay_buffer._num_sampled // 2 + 1
+    assert len(replay_buffer) == CAPACITY
@@ -0,0 +1,39 @@
+import jax
+import numpy as np
+from flax.core import frozen_dict
+
+from jaxrl2.data.packed_frames import unpack_frames
+
+BATCH_SIZE = 8
+
+CAPACITY = 30
+
+
+def test_pack_frames(make_replay_buffer):
+    replay_buffer = make_replay_buffer(CAPACITY, CAPACITY + 5, observations="pixels_states")
+    replay_buffer.seed(0)
+    # Rewards are unique, so they identify the sampled slots.
+    slots = {reward: slot for slot, reward in enumerate(replay_buffer.dataset_dict["rewards"])}
+
+    for _ in range(3):
+        batch = replay_buffer.sample(BATCH_SIZE, pack_frames=True)
+        indx = np.array([slots[reward] for reward in batch["rewards"]])
+        frames = batch["observations"]["frames"]
+        frame_indices = batch["observations"]["frame_indices"]
+
+        assert "pixels" not in batch["observations"]
+        assert "pixels" not in batch["next_observations"]
+        assert len(frames) % BATCH_SIZE == 0
+        assert frame_indices.shape == (BATCH_SIZE, 4)
+
+        expected = replay_buffer.sample(BATCH_SIZE, indx=indx, include_pixels=False)
+        observations = jax.jit(unpack_frames)(batch["observations"])
+        jax.tree_util.tree_map(
+            np.testing.assert_array_equal,
+            frozen_dict.unfreeze(observations),
+            frozen_dict.unfreeze(expected["observations"]),
+        )
+
+    # Unpacked observations are left alone.
+    observations = expected["observations"]
+    assert unpack_frames(observations) is observations
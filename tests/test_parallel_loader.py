@@ -0,0 +1,42 @@
+import numpy as np
+
+from jaxrl2.data.parallel_loader import load_episodes
+
+NUM_EPISODES = 20
+
+
+def _load(episode_file):
+    return np.load(episode_file)
+
+
+def _episode_files(tmp_path):
+    episode_files = []
+    for i in range(NUM_EPISODES):
+        episode_file = str(tmp_path / f"{i}.npy")
+        np.save(episode_file, np.full((i + 1, 3), i))
+        episode_files.append(episode_file)
+    return episode_files
+
+
+def test_load_episodes(tmp_path):
+    episode_files = _episode_files(tmp_path)
+    episodes = list(load_episodes(_load, episode_files, num_workers=0))
+    for i, episode in enumerate(episodes):
+        np.testing.assert_array_equal(episode, np.full((i + 1, 3), i))
+
+    parallel_episodes = list(load_episodes(_load, episode_files, num_workers=3))
+    for episode, parallel_episode in zip(episodes, parallel_episodes):
+        np.testing.assert_array_equal(episode, parallel_episode)
+
+    unordered_episodes = load_episodes(_load, episode_files, num_workers=3, ordered=False)
+    assert sorted(int(episode[0, 0]) for episode in unordered_episodes) == list(
+        range(NUM_EPISODES)
+    )
+
+
+def test_load_episodes_stop_early(tmp_path):
+    episode_files = _episode_files(tmp_path)
+    for i, episode in enumerate(load_episodes(_load, episode_files, num_workers=2)):
+        if i == 2:
+            break
+    np.testing.assert_array_equal(episode, np.full((3, 3), 2))
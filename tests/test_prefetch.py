@@ -0,0 +1,24 @@
+import numpy as np
+
+CAPACITY = 50
+
+
+def test_iterator_before_inserts(make_replay_buffer, insert_transitions):
+    # Nothing is sampled before the first batch is requested.
+    replay_buffer = make_replay_buffer(CAPACITY, 0)
+    iterator = replay_buffer.get_iterator(8)
+    insert_transitions(replay_buffer, 0, CAPACITY)
+    batch = next(iterator)
+    assert len(batch["rewards"]) == 8
+    iterator.close()
+
+
+def test_iterator_is_reproducible(make_replay_buffer):
+    batches = {}
+    for num_workers in (1, 3):
+        replay_buffer = make_replay_buffer(CAPACITY)
+        replay_buffer.seed(0)
+        iterator = replay_buffer.get_iterator(8, queue_size=4, num_workers=num_workers)
+        batches[num_workers] = [np.asarray(next(iterator)["rewards"]) for _ in range(10)]
+        iterator.close()
+    np.testing.assert_array_equal(batches[1], batches[3])
@@ -0,0 +1,168 @@
+import gym
+import numpy as np
+
+from jaxrl2.data import MemoryEfficientReplayBuffer, ReplayBuffer
+from jaxrl2.data.dataset import MixingReplayBuffer
+from jaxrl2.data.prioritized_replay_buffer import PrioritizedReplayBuffer
+from jaxrl2.data.sum_tree import SumTree
+
+CAPACITY = 10
+
+
+def test_sum_tree():
+    tree = SumTree(5)
+    tree.update([0, 1, 2, 3, 4, 1], [1.0, 5.0, 0.0, 2.0, 2.0, 3.0])
+    assert tree.total == 8.0
+    assert tree.min == 1.0
+    np.testing.assert_array_equal(tree.get([1, 2]), [3.0, 0.0])
+    np.testing.assert_array_equal(
+        tree.find([0.0, 0.99, 1.0, 3.99, 4.0, 6.0, 8.0]), [0, 0, 1, 1, 3, 4, 4]
+    )
+
+
+def _insert(replay_buffer, reward):
+    replay_buffer.insert(
+        dict(
+            observations=np.zeros((1,), dtype=np.float32),
+            actions=np.zeros((1,), dtype=np.float32),
+            rewards=reward,
+            next_observations=np.zeros((1,), dtype=np.float32),
+            masks=1.0,
+            dones=False,
+        )
+    )
+
+
+def test_prioritized_replay_buffer():
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = PrioritizedReplayBuffer(
+        ReplayBuffer(observation_space, action_space, CAPACITY), alpha=1.0, beta=1.0, eps=0.0
+    )
+    replay_buffer.seed(0)
+    for i in range(4):
+        _insert(replay_buffer, float(i))
+
+    batch = replay_buffer.sample(8)
+    # Stratified over equal priorities.
+    np.testing.assert_array_equal(np.sort(batch["indx"]), np.repeat(np.arange(4), 2))
+    np.testing.assert_array_equal(batch["rewards"], batch["indx"])
+    np.testing.assert_array_equal(batch["importance_weights"], 1.0)
+
+    # Ensemble TD errors, of which the largest is used.
+    replay_buffer.update_priorities([0, 1, 2, 3], [[1.0, 0.0, 3.0, 1.0], [0.0, 0.0, 0.0, 2.0]])
+    batch = replay_buffer.sample(600)
+    counts = np.bincount(batch["indx"], minlength=4)
+    np.testing.assert_array_equal(counts, [100, 0, 300, 200])
+    np.testing.assert_allclose(batch["importance_weights"], 1.0 / np.array([1.0, 0, 3.0, 2.0])[batch["indx"]])
+
+    # New rows get the largest priority so far.
+    _insert(replay_buffer, 4.0)
+    np.testing.assert_array_equal(replay_buffer._tree.get([4]), [3.0])
+
+
+def test_prioritized_efficient_replay_buffer():
+    observation_space = gym.spaces.Dict(
+        dict(pixels=gym.spaces.Box(low=0, high=255, shape=(2, 2, 1, 3), dtype=np.uint8))
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = PrioritizedReplayBuffer(
+        MemoryEfficientReplayBuffer(observation_space, action_space, 2 * CAPACITY)
+    )
+    replay_buffer.seed(0)
+
+    frames = np.zeros((6, 2, 2, 1), dtype=np.uint8)
+    stacks = np.lib.stride_tricks.sliding_window_view(frames, 3, axis=0)
+    for episode in range(4):
+        replay_buffer.insert_episode(
+            dict(
+                observations=dict(pixels=stacks[:3]),
+                next_observations=dict(pixels=stacks[1:4]),
+                actions=np.zeros((3, 1), dtype=np.float32),
+                rewards=np.full((3,), episode, dtype=np.float32),
+                masks=np.ones((3,), dtype=np.float32),
+                dones=np.arange(3) == 2,
+            )
+        )
+
+    # Padding rows, and the rows of the overwritten episode that lost their
+    # frame stacks, have no priority.
+    sampleable = replay_buffer.replay_buffer._is_correct_index
+    np.testing.assert_array_equal(replay_buffer._tree.get(np.arange(2 * CAPACITY)) > 0, sampleable)
+    batch = replay_buffer.sample(64, include_pixels=False)
+    assert sampleable[batch["indx"]].all()
+
+
+def test_prioritized_existing_rows():
+    # A buffer filled before it is wrapped, like the online buffer of the
+    # training loops.
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    inner = ReplayBuffer(observation_space, action_space, CAPACITY)
+    for i in range(3):
+        _insert(inner, float(i))
+    replay_buffer = PrioritizedReplayBuffer(inner)
+    replay_buffer.seed(0)
+
+    np.testing.assert_array_equal(replay_buffer._tree.get(np.arange(CAPACITY)), [1.0] * 3 + [0.0] * 7)
+    batch = replay_buffer.sample(6)
+    np.testing.assert_array_equal(np.sort(batch["indx"]), np.repeat(np.arange(3), 2))
+
+
+def test_prioritized_threads():
+    # Batches are sampled by the threads of the iterator while rows are
+    # inserted and priorities updated.
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = PrioritizedReplayBuffer(
+        ReplayBuffer(observation_space, action_space, 20 * CAPACITY)
+    )
+    replay_buffer.seed(0)
+    for i in range(4):
+        _insert(replay_buffer, float(i))
+
+    rng = np.random.default_rng(0)
+    iterator = replay_buffer.get_iterator(sample_args=dict(batch_size=16), num_workers=4)
+    for i in range(300):
+        _insert(replay_buffer, float(i))
+        batch = next(iterator)
+        indx = np.asarray(batch["indx"])
+        assert np.all(indx < len(replay_buffer))
+        assert np.all(np.asarray(batch["importance_weights"]) <= 1.0)
+        replay_buffer.update_priorities(indx, rng.random(len(indx)))
+
+    tree = replay_buffer._tree
+    np.testing.assert_allclose(tree.total, tree.get(np.arange(20 * CAPACITY)).sum())
+
+
+def test_prioritized_mixture():
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    offline = ReplayBuffer(observation_space, action_space, CAPACITY)
+    online = ReplayBuffer(observation_space, action_space, CAPACITY)
+    for i in range(4):
+        _insert(offline, -1.0)
+        _insert(online, float(i))
+    prioritized = PrioritizedReplayBuffer(online, alpha=1.0, beta=1.0, eps=0.0)
+    mixing_buffer = MixingReplayBuffer([offline, prioritized], 0.5)
+    mixing_buffer.seed(0)
+
+    # Rows inserted into the online buffer directly are prioritized as well.
+    _insert(online, 4.0)
+    prioritized.update_priorities([0, 1, 2, 3], [1.0, 0.0, 0.0, 0.0])
+
+    # The first batch is concatenated, the next ones gathered into a
+    # preallocated batch.
+    for _ in range(2):
+        batch = mixing_buffer.sample(8)
+        np.testing.assert_array_equal(batch["rewards"][:4], -1.0)
+        np.testing.assert_array_equal(batch["indx"][:4], -1)
+        np.testing.assert_array_equal(batch["importance_weights"][:4], 1.0)
+        assert set(batch["indx"][4:]) <= {0, 4}
+        np.testing.assert_array_equal(batch["rewards"][4:], batch["indx"][4:])
+
+    # The offline rows are skipped.
+    prioritized.update_priorities(batch["indx"], np.full((2, 8), 3.0))
+    expected = np.array([1.0, 0.0, 0.0, 0.0, 1.0])
+    expected[batch["indx"][4:]] = 3.0
+    np.testing.assert_array_equal(prioritized._tree.get(np.arange(5)), expected)
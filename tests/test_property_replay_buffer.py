@@ -0,0 +1,33 @@
+import numpy as np
+
+from jaxrl2.data.batch_pool import BatchPool
+from jaxrl2.data.dataset import PropertyReplayBuffer
+
+BATCH_SIZE = 8
+
+CAPACITY = 20
+
+
+def test_property_replay_buffer(make_replay_buffer):
+    property_dict = dict(cql_alpha=5.0, num_steps=2, task=np.array([0.0, 1.0]))
+    replay_buffer = PropertyReplayBuffer(make_replay_buffer(CAPACITY), property_dict)
+
+    batch = replay_buffer.sample(BATCH_SIZE)
+    np.testing.assert_array_equal(batch["cql_alpha"], np.full((BATCH_SIZE, 1), 5.0))
+    np.testing.assert_array_equal(batch["num_steps"], np.full((BATCH_SIZE, 1), 2.0))
+    np.testing.assert_array_equal(batch["task"], np.tile([0.0, 1.0], (BATCH_SIZE, 1)))
+    assert all(batch[k].dtype == np.float32 for k in property_dict)
+    assert batch["rewards"].shape == (BATCH_SIZE,)
+
+    # The columns are built once and rebuilt when a property changes.
+    assert replay_buffer.sample(BATCH_SIZE)["cql_alpha"] is batch["cql_alpha"]
+    replay_buffer.property_dict["cql_alpha"] /= 2
+    np.testing.assert_array_equal(
+        replay_buffer.sample(BATCH_SIZE)["cql_alpha"], np.full((BATCH_SIZE, 1), 2.5)
+    )
+    assert replay_buffer.sample(4)["task"].shape == (4, 2)
+
+    out = BatchPool().get(batch)
+    out_batch = replay_buffer.sample(BATCH_SIZE, out=out)
+    assert out_batch["rewards"] is out["rewards"]
+    np.testing.assert_array_equal(out_batch["cql_alpha"], np.full((BATCH_SIZE, 1), 2.5))
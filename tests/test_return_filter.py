@@ -0,0 +1,104 @@
+import gym
+import numpy as np
+
+from jaxrl2.data import MemoryEfficientReplayBuffer, ReplayBuffer
+from jaxrl2.data.dataset import Dataset
+from jaxrl2.data.return_utils import episode_boundaries, episode_returns
+
+BATCH_SIZE = 64
+
+
+def test_episode_boundaries_and_returns():
+    dones = np.array([False, True, False, False, True, False])
+    starts, ends = episode_boundaries(dones)
+    np.testing.assert_array_equal(starts, [0, 2, 5])
+    np.testing.assert_array_equal(ends, [2, 5, 6])
+    rewards = np.arange(6, dtype=np.float32)
+    np.testing.assert_array_equal(episode_returns(rewards, starts), [1, 9, 5])
+
+
+def test_dataset_filter():
+    # Four episodes of length 3 with returns 0, 3, 6 and 9.
+    rewards = np.repeat(np.arange(4), 3).astype(np.float32)
+    dataset = Dataset(
+        dict(
+            observations=np.arange(12, dtype=np.float32)[:, None],
+            rewards=rewards.copy(),
+            dones=np.arange(12) % 3 == 2,
+        ),
+        seed=0,
+    )
+
+    dataset.filter(percentile=50)
+    assert set(dataset.sample(BATCH_SIZE)["rewards"]) == {2.0, 3.0}
+    assert len(dataset) == 12
+
+    # Replaces the previous filter.
+    dataset.filter(threshold=3)
+    assert set(dataset.sample(BATCH_SIZE)["rewards"]) == {1.0, 2.0, 3.0}
+
+    assert dataset.normalize_returns(scaling=1) == 1 / 9
+    np.testing.assert_allclose(dataset.dataset_dict["rewards"], rewards / 9)
+
+
+def test_replay_buffer_filter():
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = ReplayBuffer(observation_space, action_space, 10)
+    replay_buffer.seed(0)
+
+    def insert(reward, done):
+        replay_buffer.insert(
+            dict(
+                observations=np.zeros((1,), dtype=np.float32),
+                actions=np.zeros((1,), dtype=np.float32),
+                rewards=reward,
+                next_observations=np.zeros((1,), dtype=np.float32),
+                masks=1.0,
+                dones=done,
+            )
+        )
+
+    # Episodes of length 4 wrap around the end of the buffer, and the oldest
+    # one is partly overwritten.
+    for episode in range(4):
+        for t in range(4):
+            insert(float(episode), t == 3)
+
+    replay_buffer.filter(threshold=8)
+    assert set(replay_buffer.sample(BATCH_SIZE)["rewards"]) == {2.0, 3.0}
+
+    # Rows inserted afterwards are sampled.
+    insert(-1.0, False)
+    assert set(replay_buffer.sample(BATCH_SIZE)["rewards"]) == {-1.0, 2.0, 3.0}
+
+
+def test_efficient_replay_buffer_filter():
+    observation_space = gym.spaces.Dict(
+        dict(pixels=gym.spaces.Box(low=0, high=255, shape=(2, 2, 1, 3), dtype=np.uint8))
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = MemoryEfficientReplayBuffer(observation_space, action_space, 40)
+    replay_buffer.seed(0)
+
+    frames = np.zeros((6, 2, 2, 1), dtype=np.uint8)
+    stacks = np.lib.stride_tricks.sliding_window_view(frames, 3, axis=0)
+    for episode in range(4):
+        replay_buffer.insert_episode(
+            dict(
+                observations=dict(pixels=stacks[:3]),
+                next_observations=dict(pixels=stacks[1:4]),
+                actions=np.zeros((3, 1), dtype=np.float32),
+                rewards=np.full((3,), episode, dtype=np.float32),
+                masks=np.ones((3,), dtype=np.float32),
+                dones=np.arange(3) == 2,
+            )
+        )
+
+    # The padding rows before each episode are not counted in its return.
+    _, _, returns = replay_buffer._trajectory_boundaries_and_returns()
+    np.testing.assert_array_equal(returns, [0, 3, 6, 9])
+
+    replay_buffer.filter(take_top=50)
+    batch = replay_buffer.sample(BATCH_SIZE, include_pixels=False)
+    assert set(batch["rewards"]) == {2.0, 3.0}
@@ -0,0 +1,64 @@
+import numpy as np
+
+from jaxrl2.data.return_utils import discounted_returns, nstep_returns
+
+DISCOUNT = 0.9
+
+
+def _episodes():
+    rng = np.random.default_rng(0)
+    rewards, masks, dones = [], [], []
+    for episode_len in [1, 5, 12, 3]:
+        rewards.append(rng.random(episode_len))
+        masks.append((rng.random(episode_len) > 0.2).astype(np.float32))
+        done = np.zeros(episode_len, dtype=bool)
+        done[-1] = True
+        dones.append(done)
+    return rewards, masks, dones
+
+
+def _discounted_returns(rewards, masks, bootstrap_last):
+    returns = np.zeros_like(rewards)
+    prev_return = rewards[-1] / (1 - DISCOUNT) if bootstrap_last else 0
+    for i in reversed(range(len(rewards))):
+        returns[i] = rewards[i] + DISCOUNT * prev_return * masks[i]
+        prev_return = returns[i]
+    return returns
+
+
+def _nstep_returns(rewards, masks, n):
+    returns = np.zeros_like(rewards)
+    for t in range(len(rewards)):
+        weight = 1.0
+        for k in range(min(n, len(rewards) - t)):
+            returns[t] += weight * rewards[t + k]
+            weight *= DISCOUNT * masks[t + k]
+    return returns
+
+
+def test_discounted_returns():
+    rewards, masks, dones = _episodes()
+    for bootstrap_last in [False, True]:
+        returns = discounted_returns(
+            np.concatenate(rewards),
+            DISCOUNT,
+            masks=np.concatenate(masks),
+            dones=np.concatenate(dones),
+            bootstrap_last=bootstrap_last,
+        )
+        expected = [_discounted_returns(r, m, bootstrap_last) for r, m in zip(rewards, masks)]
+        np.testing.assert_allclose(returns, np.concatenate(expected), rtol=1e-6)
+
+
+def test_nstep_returns():
+    rewards, masks, dones = _episodes()
+    for n in [1, 2, 4]:
+        returns = nstep_returns(
+            np.concatenate(rewards),
+            n,
+            DISCOUNT,
+            masks=np.concatenate(masks),
+            dones=np.concatenate(dones),
+        )
+        expected = [_nstep_returns(r, m, n) for r, m in zip(rewards, masks)]
+        np.testing.assert_allclose(returns, np.concatenate(expected), rtol=1e-6)
@@ -0,0 +1,150 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from jaxrl2.data.dataset import MixingReplayBuffer
+from jaxrl2.data.shared_memory_sampler import SharedMemorySampler
+
+BATCH_SIZE = 8
+
+CAPACITY = 50
+
+
+def _take(sampler, num_batches):
+    batches = [next(sampler) for _ in range(num_batches)]
+    sampler.close()
+    return batches
+
+
+def test_shared_memory_sampler_reproducible(tmp_path, make_replay_buffer):
+    batches = []
+    for num_workers, storage_dir in [(1, None), (2, None), (2, str(tmp_path))]:
+        replay_buffer = make_replay_buffer(CAPACITY, reward=1.0, storage_dir=storage_dir)
+        sampler = SharedMemorySampler(
+            replay_buffer, dict(batch_size=BATCH_SIZE), num_workers=num_workers, seed=0
+        )
+        batches.append(_take(sampler, 5))
+
+    for batch, other_batch, memmap_batch in zip(*batches):
+        np.testing.assert_array_equal(batch["observations"], other_batch["observations"])
+        np.testing.assert_array_equal(batch["observations"], memmap_batch["observations"])
+        np.testing.assert_array_equal(
+            batch["observations"] + 1, batch["next_observations"]
+        )
+
+
+def test_shared_memory_sampler_sees_inserts(make_replay_buffer):
+    replay_buffer = make_replay_buffer(CAPACITY, reward=1.0)
+    sampler = SharedMemorySampler(
+        replay_buffer, dict(batch_size=BATCH_SIZE), num_workers=1, num_slots=1
+    )
+    next(sampler)
+    for _ in range(CAPACITY):
+        obs = np.full((3,), -1, dtype=np.float32)
+        replay_buffer.insert(
+            dict(
+                observations=obs,
+                actions=np.zeros((2,), dtype=np.float32),
+                rewards=1.0,
+                next_observations=obs,
+                masks=1.0,
+                dones=False,
+            )
+        )
+    # The slot freed by the first batch was submitted before the inserts.
+    next(sampler)
+    batch = _take(sampler, 1)[0]
+    assert np.all(batch["observations"] == -1)
+
+
+def test_shared_memory_sampler_mixing(make_replay_buffer):
+    replay_buffer = MixingReplayBuffer(
+        [make_replay_buffer(CAPACITY, reward=0.0), make_replay_buffer(CAPACITY, reward=1.0)], 0.25
+    )
+    sampler = SharedMemorySampler(
+        replay_buffer, dict(batch_size=BATCH_SIZE), num_workers=2, seed=0
+    )
+    for batch in _take(sampler, 3):
+        assert batch["rewards"].sum() == BATCH_SIZE - BATCH_SIZE // 4
+
+
+def test_shared_memory_sampler_efficient_replay_buffer(make_replay_buffer):
+    replay_buffer = make_replay_buffer(CAPACITY, observations="pixels", reward=1.0)
+
+    valid = replay_buffer.sample(
+        BATCH_SIZE, indx=replay_buffer._correct_indices.indices, include_pixels=False
+    )
+    valid_stacks = {p.tobytes() for p in valid["observations"]["pixels"]}
+
+    batches = []
+    for num_workers in [1, 2]:
+        sampler = SharedMemorySampler(
+            replay_buffer,
+            dict(batch_size=BATCH_SIZE, include_pixels=False),
+            num_workers=num_workers,
+            seed=0,
+        )
+        batches.append(_take(sampler, 3))
+
+    for batch, other_batch in zip(*batches):
+        pixels = np.asarray(batch["observations"]["pixels"])
+        np.testing.assert_array_equal(pixels, other_batch["observations"]["pixels"])
+        assert all(p.tobytes() in valid_stacks for p in pixels)
+
+
+def test_shared_memory_sampler_growing_columns(make_replay_buffer, insert_transitions):
+    replay_buffer = make_replay_buffer(
+        CAPACITY, num_transitions=BATCH_SIZE, reward=1.0, initial_capacity=BATCH_SIZE
+    )
+    sampler = SharedMemorySampler(
+        replay_buffer, dict(batch_size=BATCH_SIZE), num_workers=1, num_slots=1, seed=0
+    )
+    next(sampler)
+    num_arrays = len(sampler._arrays)
+    names = {placeholder.name for _, placeholder in sampler._arrays.values()}
+
+    # The columns are replaced by larger ones.
+    insert_transitions(replay_buffer, BATCH_SIZE, CAPACITY, reward=1.0)
+    assert len(replay_buffer.dataset_dict["rewards"]) == CAPACITY
+    next(sampler)
+    assert len(sampler._arrays) == num_arrays
+    stale = names - {placeholder.name for _, placeholder in sampler._arrays.values()}
+    assert stale
+    # The blocks are kept until the task submitted after the growth is done.
+    for name in stale:
+        shared_memory.SharedMemory(name=name).close()
+
+    batch = next(sampler)
+    assert batch["observations"].max() >= BATCH_SIZE
+    for name in stale:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+    sampler.close()
+
+
+def test_shared_memory_sampler_growing_memmap_columns(tmp_path, make_replay_buffer, insert_transitions):
+    replay_buffer = make_replay_buffer(
+        CAPACITY, num_transitions=4, reward=1.0, initial_capacity=4, storage_dir=str(tmp_path)
+    )
+    sampler = SharedMemorySampler(
+        replay_buffer, dict(batch_size=BATCH_SIZE), num_workers=1, num_slots=2, seed=0
+    )
+    next(sampler)
+    # The columns are mapped again, with more rows, from the same files.
+    insert_transitions(replay_buffer, 4, CAPACITY, reward=1.0)
+    batches = _take(sampler, 4)
+    assert batches[-1]["observations"].max() >= 4
+    for batch in batches:
+        np.testing.assert_array_equal(
+            batch["observations"] + 1, batch["next_observations"]
+        )
+
+
+def test_shared_memory_sampler_packed_frames(make_replay_buffer):
+    replay_buffer = make_replay_buffer(CAPACITY, observations="pixels")
+    with pytest.raises(ValueError, match="packed frames"):
+        replay_buffer.get_iterator(
+            sample_args=dict(batch_size=BATCH_SIZE, include_pixels=False, pack_frames=True),
+            num_processes=1,
+        )
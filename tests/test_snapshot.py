@@ -0,0 +1,119 @@
+import os
+
+import jax
+import numpy as np
+
+from jaxrl2.data.snapshot import SnapshotWriter, read_chunk, read_snapshot
+
+CAPACITY = 30
+
+
+def _assert_same_buffer(replay_buffer, loaded_buffer):
+    jax.tree_util.tree_map(
+        np.testing.assert_array_equal,
+        jax.tree_util.tree_map(lambda x: x[: len(replay_buffer)], replay_buffer.dataset_dict),
+        jax.tree_util.tree_map(lambda x: x[: len(loaded_buffer)], loaded_buffer.dataset_dict),
+    )
+    assert loaded_buffer._insert_index == replay_buffer._insert_index
+    assert len(loaded_buffer) == len(replay_buffer)
+    assert loaded_buffer._first == replay_buffer._first
+    np.testing.assert_array_equal(loaded_buffer._is_correct_index, replay_buffer._is_correct_index)
+    np.testing.assert_array_equal(
+        np.sort(loaded_buffer._correct_indices.indices),
+        np.sort(replay_buffer._correct_indices.indices),
+    )
+
+
+def test_snapshot_save_load(tmp_path, make_replay_buffer, insert_transitions):
+    path = str(tmp_path / "replay_buffer")
+    replay_buffer = make_replay_buffer(CAPACITY, 0, observations="pixels_states")
+
+    insert_transitions(replay_buffer, 0, 12)
+    replay_buffer.save(path, wait=True)
+    insert_transitions(replay_buffer, 12, 25)
+    replay_buffer.save(path)
+    # Wraps around the end of the buffer.
+    insert_transitions(replay_buffer, 25, 41)
+    replay_buffer.save(path, wait=True)
+
+    chunks, state = read_snapshot(path)
+    # The rows inserted while the second snapshot is written may be part of it.
+    assert len(chunks) in (2, 3)
+    assert int(state["insert_index"]) == replay_buffer._insert_index
+
+    loaded_buffer = make_replay_buffer(CAPACITY, 0, observations="pixels_states")
+    loaded_buffer.load(path)
+    _assert_same_buffer(replay_buffer, loaded_buffer)
+
+    # The loaded buffer appends to the snapshot until it is compacted.
+    insert_transitions(loaded_buffer, 41, 42)
+    loaded_buffer.save(path, wait=True)
+    assert len(read_snapshot(path)[0]) == len(chunks) + 1
+    insert_transitions(loaded_buffer, 42, 70)
+    loaded_buffer.save(path, wait=True)
+    chunks, _ = read_snapshot(path)
+    assert len(chunks) == 1
+    assert sorted(os.listdir(path)) == sorted(chunks + ["state.npz"])
+
+    resumed_buffer = make_replay_buffer(CAPACITY, 0, observations="pixels_states")
+    resumed_buffer.load(path)
+    _assert_same_buffer(loaded_buffer, resumed_buffer)
+
+
+class _InsertingWriter(SnapshotWriter):
+    # Inserts rows into the buffer after each of its first chunks, as the
+    # training thread does while a snapshot is written.
+    def __init__(self, path, insert):
+        super().__init__(path)
+        self._insert = insert
+        self.num_inserts = 3
+
+    def write_chunk(self, slots, rows):
+        super().write_chunk(slots, rows)
+        if self.num_inserts > 0:
+            self.num_inserts -= 1
+            self._insert()
+
+
+def test_snapshot_blocks(tmp_path, make_replay_buffer, insert_transitions):
+    path = str(tmp_path / "replay_buffer")
+    replay_buffer = make_replay_buffer(CAPACITY, 0, observations="pixels_states")
+    insert_transitions(replay_buffer, 0, 41)
+    num_before = replay_buffer._num_inserted
+
+    num_inserted = [41]
+
+    def insert():
+        insert_transitions(replay_buffer, num_inserted[0], num_inserted[0] + 8)
+        num_inserted[0] += 8
+
+    writer = _InsertingWriter(path, insert)
+    writer.submit(replay_buffer._write_snapshot, writer, True, 7).result()
+    chunks, state = read_snapshot(path)
+    # Five blocks of the buffer, then blocks of the rows inserted meanwhile,
+    # of which those already overwritten are skipped.
+    num_new = min(replay_buffer._num_inserted - num_before, CAPACITY)
+    assert len(chunks) == 5 + int(np.ceil(num_new / 7))
+    assert int(state["num_inserted"]) == replay_buffer._num_inserted
+
+    loaded_buffer = make_replay_buffer(CAPACITY, 0, observations="pixels_states")
+    loaded_buffer.load(path)
+    _assert_same_buffer(replay_buffer, loaded_buffer)
+
+
+def test_snapshot_compressed_frames(tmp_path, make_replay_buffer):
+    path = str(tmp_path / "replay_buffer")
+    replay_buffer = make_replay_buffer(
+        CAPACITY, CAPACITY + 5, observations="pixels", frame_codec="zlib"
+    )
+    replay_buffer.save(path, wait=True)
+
+    # The frames are written encoded.
+    chunks, _ = read_snapshot(path)
+    slots, rows = read_chunk(path, chunks[0])
+    assert rows["observations"]["pixels"]["encoded"].dtype == np.uint8
+    assert rows["observations"]["pixels"]["lengths"].shape == (len(slots), 1)
+
+    loaded_buffer = make_replay_buffer(CAPACITY, 0, observations="pixels", frame_codec="zlib")
+    loaded_buffer.load(path)
+    _assert_same_buffer(replay_buffer, loaded_buffer)
@@ -0,0 +1,82 @@
+import gym
+import numpy as np
+
+from jaxrl2.data import MemoryEfficientReplayBuffer, ReplayBuffer
+from jaxrl2.data.batch_pool import BatchPool
+
+CAPACITY = 20
+
+
+def test_replay_buffer_sort_indices():
+    observation_space = gym.spaces.Box(low=0, high=CAPACITY, shape=(1,), dtype=np.float32)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = ReplayBuffer(observation_space, action_space, CAPACITY)
+    replay_buffer.seed(0)
+    for i in range(CAPACITY):
+        replay_buffer.insert(
+            dict(
+                observations=np.full((1,), i, dtype=np.float32),
+                actions=np.zeros((1,), dtype=np.float32),
+                rewards=float(i),
+                next_observations=np.full((1,), i + 1, dtype=np.float32),
+                masks=1.0,
+                dones=False,
+            )
+        )
+
+    # Drawn rows stay in slot order.
+    batch = replay_buffer.sample(16, sort_indices=True)
+    assert np.all(np.diff(batch["rewards"]) >= 0)
+
+    # Given rows are put back in their order, also when gathered into out.
+    indx = np.array([7, 3, 19, 3, 0, 12])
+    batch = replay_buffer.sample(len(indx), indx=indx, sort_indices=True)
+    np.testing.assert_array_equal(batch["rewards"], indx)
+    np.testing.assert_array_equal(batch["next_observations"][:, 0], indx + 1)
+    out = BatchPool().get(replay_buffer.sample(len(indx)))
+    batch = replay_buffer.sample(len(indx), indx=indx, out=out, sort_indices=True)
+    np.testing.assert_array_equal(batch["observations"][:, 0], indx)
+
+
+def test_memory_efficient_replay_buffer_sort_indices():
+    observation_space = gym.spaces.Dict(
+        dict(pixels=gym.spaces.Box(low=0, high=255, shape=(1, 1, 1, 3), dtype=np.uint8))
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = MemoryEfficientReplayBuffer(observation_space, action_space, CAPACITY)
+    replay_buffer.seed(0)
+
+    # Frames are numbered by episode and step.
+    for episode in range(3):
+        frames = 10 * episode + np.arange(6, dtype=np.uint8).reshape(6, 1, 1, 1)
+        stacks = np.lib.stride_tricks.sliding_window_view(frames, 3, axis=0)
+        replay_buffer.insert_episode(
+            dict(
+                observations=dict(pixels=stacks[:3]),
+                next_observations=dict(pixels=stacks[1:4]),
+                actions=np.zeros((3, 1), dtype=np.float32),
+                rewards=np.full((3,), episode, dtype=np.float32),
+                masks=np.ones((3,), dtype=np.float32),
+                dones=np.arange(3) == 2,
+            )
+        )
+
+    indx = replay_buffer._correct_indices.indices[::-1].copy()
+    for kwargs in (dict(), dict(include_pixels=False), dict(pack_frames=True)):
+        expected = replay_buffer.sample(len(indx), indx=indx, **kwargs)
+        batch = replay_buffer.sample(len(indx), indx=indx, sort_indices=True, **kwargs)
+        np.testing.assert_array_equal(batch["rewards"], expected["rewards"])
+        for k in ("pixels", "frame_indices"):
+            if k in expected["observations"]:
+                np.testing.assert_array_equal(
+                    batch["observations"][k], expected["observations"][k]
+                )
+
+    out = BatchPool().get(replay_buffer.sample(len(indx)))
+    batch = replay_buffer.sample(len(indx), indx=indx, out=out, sort_indices=True)
+    expected = replay_buffer.sample(len(indx), indx=indx)
+    for k in ("observations", "next_observations"):
+        np.testing.assert_array_equal(batch[k]["pixels"], expected[k]["pixels"])
+
+    batch = replay_buffer.sample(16, include_pixels=False, sort_indices=True)
+    assert np.all(np.diff(batch["observations"]["pixels"][:, 0, 0, 0, -1]) >= 0)
@@ -0,0 +1,105 @@
+import gym
+import numpy as np
+import pytest
+
+from jaxrl2.data import MemoryEfficientReplayBuffer, ReplayBuffer
+
+BATCH_SIZE = 12
+
+CAPACITY = 40
+
+NUM_TASKS = 3
+
+
+def _task_id(task):
+    return np.eye(NUM_TASKS, dtype=np.float32)[task]
+
+
+def test_replay_buffer_task_sampling(tmp_path):
+    observation_space = gym.spaces.Dict(
+        dict(
+            states=gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32),
+            task_id=gym.spaces.Box(low=0, high=1, shape=(NUM_TASKS,), dtype=np.float32),
+        )
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = ReplayBuffer(observation_space, action_space, CAPACITY, task_key="task_id")
+    replay_buffer.seed(0)
+
+    # Task 2 is rare, and task 0 is partly overwritten.
+    tasks = np.r_[np.zeros(10, int), np.ones(30, int), np.full(2, 2), np.ones(8, int)]
+    for task in tasks:
+        obs = dict(states=np.zeros((1,), dtype=np.float32), task_id=_task_id(task))
+        replay_buffer.insert(
+            dict(
+                observations=obs,
+                actions=np.zeros((1,), dtype=np.float32),
+                rewards=float(task),
+                next_observations=obs,
+                masks=1.0,
+                dones=False,
+            )
+        )
+    np.testing.assert_array_equal(replay_buffer.task_counts(), [0, 38, 2])
+
+    replay_buffer.set_task_sampling()
+    batch = replay_buffer.sample(BATCH_SIZE)
+    np.testing.assert_array_equal(batch["rewards"], np.repeat([1.0, 2.0], 6))
+    np.testing.assert_array_equal(
+        batch["observations"]["task_id"], _task_id(batch["rewards"].astype(int))
+    )
+
+    replay_buffer.set_task_sampling(task_weights=[1, 2, 1])
+    np.testing.assert_array_equal(
+        replay_buffer.sample(BATCH_SIZE)["rewards"], np.repeat([1.0, 2.0], [8, 4])
+    )
+
+    replay_buffer.set_task_sampling(False)
+    assert np.mean(replay_buffer.sample(1000)["rewards"] == 2) < 0.2
+
+    path = str(tmp_path / "replay_buffer")
+    replay_buffer.save(path, wait=True)
+    loaded_buffer = ReplayBuffer(observation_space, action_space, CAPACITY, task_key="task_id")
+    loaded_buffer.load(path)
+    np.testing.assert_array_equal(loaded_buffer.task_counts(), [0, 38, 2])
+
+
+@pytest.mark.parametrize("task_key", ["task_id", None])
+def test_efficient_replay_buffer_task_sampling(task_key):
+    observation_space = gym.spaces.Dict(
+        dict(
+            pixels=gym.spaces.Box(low=0, high=255, shape=(2, 2, 1, 3), dtype=np.uint8),
+            task_id=gym.spaces.Box(low=0, high=1, shape=(NUM_TASKS,), dtype=np.float32),
+        )
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = MemoryEfficientReplayBuffer(
+        observation_space, action_space, CAPACITY, task_key=task_key
+    )
+    replay_buffer.seed(0)
+
+    frames = np.zeros((6, 2, 2, 1), dtype=np.uint8)
+    stacks = np.lib.stride_tricks.sliding_window_view(frames, 3, axis=0)
+    for task, length in [(0, 3), (1, 1), (0, 3), (2, 2)]:
+        task_id = np.tile(_task_id(task), (length, 1))
+        replay_buffer.insert_episode(
+            dict(
+                observations=dict(pixels=stacks[:length], task_id=task_id),
+                next_observations=dict(pixels=stacks[1 : length + 1], task_id=task_id),
+                actions=np.zeros((length, 1), dtype=np.float32),
+                rewards=np.full((length,), task, dtype=np.float32),
+                masks=np.ones((length,), dtype=np.float32),
+                dones=np.arange(length) == length - 1,
+            )
+        )
+
+    if task_key is None:
+        # The rows inserted so far are indexed when task sampling is enabled.
+        replay_buffer.set_task_sampling(task_key="task_id")
+
+    # The padding rows before every episode are not counted.
+    np.testing.assert_array_equal(replay_buffer.task_counts(), [6, 1, 2])
+
+    replay_buffer.set_task_sampling()
+    batch = replay_buffer.sample(BATCH_SIZE, include_pixels=False)
+    np.testing.assert_array_equal(batch["rewards"], np.repeat([0.0, 1.0, 2.0], 4))
@@ -0,0 +1,88 @@
+import gym
+import numpy as np
+
+from jaxrl2.data import MemoryEfficientReplayBuffer, ReplayBuffer
+from jaxrl2.data.trajectory_index import TrajectoryIndex
+
+CAPACITY = 20
+
+
+def test_trajectory_index():
+    traj_index = TrajectoryIndex(5)
+    traj_index.append(0, 0, 2)
+    traj_index.append(0, 2, 1)
+    traj_index.append(1, 3, 1)
+    assert len(traj_index) == 2
+
+    # Overwrites the first trajectory.
+    traj_index.append(2, 4, 4)
+    assert len(traj_index) == 2
+    ids, starts, ends = traj_index.sample(np.random.RandomState(0), 20, oldest=3)
+    assert set(ids) == {1, 2}
+    np.testing.assert_array_equal(starts, np.where(ids == 1, 3, 4))
+    np.testing.assert_array_equal(ends, np.where(ids == 1, 4, 8))
+
+    # Clips the second trajectory to the oldest row in the buffer.
+    traj_index.append(2, 8, 1)
+    _, starts, _ = traj_index.sample(np.random.RandomState(0), 20, oldest=4)
+    np.testing.assert_array_equal(starts, 4)
+
+
+def test_replay_buffer_get_random_trajs():
+    observation_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = ReplayBuffer(observation_space, action_space, CAPACITY)
+    replay_buffer.seed(0)
+
+    # Trajectories of length 7 wrap around the end of the buffer.
+    for traj in range(8):
+        for t in range(7):
+            replay_buffer.insert(
+                dict(
+                    observations=np.array([t], dtype=np.float32),
+                    actions=np.zeros((1,), dtype=np.float32),
+                    rewards=float(traj),
+                    next_observations=np.array([t + 1], dtype=np.float32),
+                    masks=1.0,
+                    dones=t == 6,
+                    trajectory_id=traj,
+                )
+            )
+
+    trajs = replay_buffer.get_random_trajs(16)
+    assert len(trajs["rewards"]) == 16
+    for rewards, observations in zip(trajs["rewards"], trajs["observations"]):
+        # The oldest trajectory in the buffer lost its first row.
+        assert rewards[0] >= 5
+        np.testing.assert_array_equal(rewards, rewards[0])
+        np.testing.assert_array_equal(observations[:, 0], np.arange(7 - len(rewards), 7))
+
+
+def test_efficient_replay_buffer_get_random_trajs():
+    observation_space = gym.spaces.Dict(
+        dict(pixels=gym.spaces.Box(low=0, high=255, shape=(2, 2, 1, 3), dtype=np.uint8))
+    )
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+    replay_buffer = MemoryEfficientReplayBuffer(observation_space, action_space, CAPACITY)
+    replay_buffer.seed(0)
+
+    frames = np.arange(10, dtype=np.uint8)[:, None, None, None] * np.ones((1, 2, 2, 1), np.uint8)
+    stacks = np.lib.stride_tricks.sliding_window_view(frames, 3, axis=0)
+    for traj in range(2):
+        replay_buffer.insert_episode(
+            dict(
+                observations=dict(pixels=stacks[:7]),
+                next_observations=dict(pixels=stacks[1:8]),
+                actions=np.zeros((7, 1), dtype=np.float32),
+                rewards=np.full((7,), traj, dtype=np.float32),
+                masks=np.ones((7,), dtype=np.float32),
+                dones=np.arange(7) == 6,
+            )
+        )
+    assert replay_buffer._traj_counter == 2
+
+    trajs = replay_buffer.get_random_trajs(4)
+    for rewards, observations in zip(trajs["rewards"], trajs["observations"]):
+        # The unstacked frames, including the padding before the first step.
+        assert len(rewards) == 3 + 7
+        np.testing.assert_array_equal(observations["pixels"][:, 0, 0, 0], np.arange(10))